@@ -0,0 +1,78 @@
+# bench_compression.py
+"""Measure upload compression for lamb datagen output.
+
+For each codec/level, reports bytes on the wire (compressed size and ratio),
+client compression throughput, and the server-side cost of verifying an upload
+(streaming decompression + SHA256, which is what server.py does per chunk).
+
+Usage: python bench_compression.py data/*.bin [--levels 1,3,6,9,19]
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import time
+import zlib
+from pathlib import Path
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+parser = argparse.ArgumentParser(description="Benchmark upload compression on .bin files")
+parser.add_argument("files", nargs="+", help=".bin files to compress")
+parser.add_argument("--levels", default="1,3,6,9,19", help="Comma-separated levels to try (gzip caps at 9)")
+args = parser.parse_args()
+
+def compress(codec, level, data):
+    if codec == "zstd":
+        return zstd.ZstdCompressor(level=level).compress(data)
+    buf = io.BytesIO()
+    with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=buf, mtime=0) as gz:
+        gz.write(data)
+    return buf.getvalue()
+
+def verify(codec, payload):
+    """Server-side work for one upload: decode in 64 KB blocks and hash the result."""
+    decoder = zstd.ZstdDecompressor().decompressobj() if codec == "zstd" else zlib.decompressobj(wbits=31)
+    file_hash = hashlib.sha256()
+    for i in range(0, len(payload), 64 * 1024):
+        file_hash.update(decoder.decompress(payload[i:i + 64 * 1024]))
+    return file_hash.hexdigest()
+
+def main():
+    data = b"".join(Path(f).read_bytes() for f in args.files)
+    if not data:
+        print("No data to compress")
+        return
+    raw_mb = len(data) / (1024 * 1024)
+    expected = hashlib.sha256(data).hexdigest()
+
+    start = time.perf_counter()
+    hashlib.sha256(data).hexdigest()
+    identity_s = time.perf_counter() - start
+    print(f"Input: {len(args.files)} files, {raw_mb:.1f} MB | identity verify: {raw_mb / identity_s:.0f} MB/s")
+    print(f"{'codec':<6} {'level':>5} {'wire MB':>9} {'ratio':>7} {'compress MB/s':>14} {'verify MB/s':>12} {'verify CPU s/GB':>16}")
+
+    codecs = ["gzip"] + (["zstd"] if zstd is not None else [])
+    for codec in codecs:
+        for level in sorted({min(int(l), 9) if codec == "gzip" else int(l) for l in args.levels.split(",")}):
+            start = time.perf_counter()
+            payload = compress(codec, level, data)
+            compress_s = time.perf_counter() - start
+
+            start = time.process_time()
+            digest = verify(codec, payload)
+            verify_s = time.process_time() - start
+            assert digest == expected, f"{codec} level {level} round-trip mismatch"
+
+            print(f"{codec:<6} {level:>5} {len(payload) / (1024 * 1024):>9.2f} {len(payload) / len(data):>7.1%} "
+                  f"{raw_mb / compress_s:>14.0f} {raw_mb / max(verify_s, 1e-9):>12.0f} "
+                  f"{verify_s / raw_mb * 1024:>16.2f}")
+
+    if zstd is None:
+        print("(zstandard not installed: pip install zstandard to include zstd)")
+
+if __name__ == "__main__":
+    main()
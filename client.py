@@ -1,33 +1,74 @@
 # client.py (Corrected)
 import argparse
 import requests
+from urllib3.exceptions import NewConnectionError
 import json
 import time
 import subprocess
-import multiprocessing
+import asyncio
 import socket
 import datetime
 import random
 import string
 import os
 import re
+import threading
+import queue
 from pathlib import Path
 import shutil
 from pathlib import Path
 import hashlib # Import hashlib for file hashing
+import sqlite3
+from contextlib import closing
+import gzip
+from collections import deque
+import functools
+
+try:
+    import zstandard as zstd # Optional: enables zstd-compressed uploads
+except ImportError:
+    zstd = None
 
 # === CLI Arguments ===
+def _concurrency_arg(value):
+    if value == "auto":
+        return value
+    try:
+        count = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    if count < 1:
+        raise argparse.ArgumentTypeError("must be a positive integer or 'auto'")
+    return count
+
 parser = argparse.ArgumentParser(description="Lamb Distributed Client")
 parser.add_argument("--name", required=True, help="Unique name for this computer (e.g. node01)")
-parser.add_argument("--concurrency", type=int, default=4, help="Number of parallel lamb processes")
+parser.add_argument("--concurrency", type=_concurrency_arg, default=4,
+                    help="Number of parallel lamb processes, or 'auto' to follow the machine's load")
+parser.add_argument("--min-concurrency", type=int, default=1, help="Lower bound for --concurrency auto (default: 1)")
+parser.add_argument("--max-concurrency", type=int, default=None,
+                    help="Upper bound for --concurrency auto (default: number of usable cores)")
 parser.add_argument("--server", default="http://192.168.65.97:5000", help="Server URL")
 parser.add_argument("--engine-path", default="./lambergar", help="Path to the lambergar executable (default: ./lambergar)")
 # Add flag to force fresh registration
 parser.add_argument("--fresh-registration", action='store_true', help="Delete stored client ID and register as a new client on startup.")
+parser.add_argument("--upload-concurrency", type=int, default=2,
+                    help="Number of files uploaded in parallel in the background (default: 2)")
+parser.add_argument("--compress", choices=["auto", "zstd", "gzip", "none"], default="auto",
+                    help="Compression for uploads; 'auto' uses zstd if available, else gzip (default: auto)")
+parser.add_argument("--compress-level", type=int, default=None,
+                    help="Compression level (default: 3 for zstd, 6 for gzip)")
 args = parser.parse_args()
 
 SERVER_URL = args.server.rstrip("/")
-CONCURRENCY = args.concurrency
+CPU_COUNT = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+AUTO_CONCURRENCY = args.concurrency == "auto"
+if AUTO_CONCURRENCY:
+    MIN_CONCURRENCY = max(1, args.min_concurrency)
+    MAX_CONCURRENCY = max(MIN_CONCURRENCY, args.max_concurrency or CPU_COUNT)
+else:
+    MIN_CONCURRENCY = MAX_CONCURRENCY = args.concurrency
+CONCURRENCY = MAX_CONCURRENCY # Supervisor slots; slots above the active count stay parked
 COMP_NAME = args.name  # ← Used everywhere
 POLL_INTERVAL = 10
 CLIENT_ID_FILE = Path("/tmp/lamb_client_id")
@@ -36,6 +77,118 @@ LAMB_HASH_FILE = Path("/tmp/lamb_engine_hash.txt") # File to store the known ser
 OUTPUT_DIR = Path("data")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
+# === HTTP Transport ===
+# Every call to the server goes through http_request(): one keep-alive
+# requests.Session per process (a session must not be shared across a fork),
+# a default timeout for each kind of call, retries
+# with backoff on transient failures, optional gzip request bodies, and
+# per-endpoint latency/failure counters.
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUTS = {"control": 10, "upload": 60, "download": 60}
+HTTP_RETRIES = 3 # Extra attempts after the first one
+HTTP_RETRY_STATUSES = (502, 503, 504)
+HTTP_IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE") # Safe to repeat after the server may have seen them
+HTTP_BACKOFF_BASE = 1
+HTTP_BACKOFF_MAX = 15
+HTTP_GZIP_MIN_BYTES = 1024 # Smaller JSON bodies are not worth compressing
+HTTP_STATS_LOG_INTERVAL = 600 # Seconds between counter summaries in the main loop
+
+_http_session = {"pid": None, "session": None}
+http_stats_lock = threading.Lock()
+http_stats = {} # endpoint -> counters, see _record_http
+
+def http_session():
+    """Return this process's keep-alive session, creating it after a fork."""
+    if _http_session["pid"] != os.getpid():
+        session = requests.Session()
+        # Uploader threads, the reporter, the slots' lease calls and the main loop share the pool
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=args.upload_concurrency + CONCURRENCY + 4)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session.update(pid=os.getpid(), session=session)
+    return _http_session["session"]
+
+def _record_http(endpoint, elapsed_ms, failed=False, retried=False):
+    with http_stats_lock:
+        stats = http_stats.setdefault(endpoint, {"requests": 0, "failures": 0, "retries": 0,
+                                                 "total_ms": 0.0, "max_ms": 0.0})
+        stats["requests"] += 1
+        stats["failures"] += failed
+        stats["retries"] += retried
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+def http_request(method, path, kind="control", timeout=None, retries=HTTP_RETRIES, gzip_body=False, **kwargs):
+    """Send method SERVER_URL+path through the process's session and return the Response.
+
+    Failures and 502/503/504 answers are retried with backoff (honouring
+    Retry-After) for idempotent methods. A POST may already have been applied
+    once its body went out, so it is only retried when no connection could be
+    made, or on a 503 (the server turned it away unprocessed). Once retries run
+    out the last response is returned or the last error raised. Pass retries=0
+    when the body is a stream that cannot be re-sent.
+    """
+    url = f"{SERVER_URL}{path}"
+    endpoint = "/" + path.lstrip("/").split("/")[0].split("?")[0]
+    timeout = timeout or (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUTS[kind])
+    if gzip_body and "json" in kwargs:
+        body = json.dumps(kwargs.pop("json")).encode()
+        headers = dict(kwargs.pop("headers", None) or {}, **{"Content-Type": "application/json"})
+        if len(body) >= HTTP_GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+        kwargs.update(data=body, headers=headers)
+
+    idempotent = method in HTTP_IDEMPOTENT_METHODS
+    for attempt in range(1, retries + 2):
+        start = time.perf_counter()
+        try:
+            r = http_session().request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            retryable = idempotent or _failed_to_connect(e)
+            _record_http(endpoint, elapsed_ms, failed=True, retried=retryable and attempt <= retries)
+            if not retryable or attempt > retries:
+                raise
+            delay = backoff_delay(attempt, base=HTTP_BACKOFF_BASE, cap=HTTP_BACKOFF_MAX)
+            print(f"[DEBUG] {method} {path} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+        else:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            retry = (r.status_code in HTTP_RETRY_STATUSES if idempotent else r.status_code == 503) \
+                and attempt <= retries
+            _record_http(endpoint, elapsed_ms, failed=r.status_code >= 500, retried=retry)
+            if not retry:
+                return r
+            try:
+                delay = min(float(r.headers.get("Retry-After", "")), HTTP_BACKOFF_MAX)
+            except ValueError:
+                delay = backoff_delay(attempt, base=HTTP_BACKOFF_BASE, cap=HTTP_BACKOFF_MAX)
+            r.close()
+            print(f"[DEBUG] {method} {path} answered {r.status_code}, retrying in {delay:.1f}s")
+        time.sleep(delay)
+
+def _failed_to_connect(e):
+    """True if e happened before a connection existed, so the server never saw the request.
+
+    "Connection aborted" and read timeouts come after the body went out and are not.
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    # requests wraps connect failures as ConnectionError(MaxRetryError(reason=NewConnectionError))
+    cause = e.args[0] if e.args else None
+    return isinstance(getattr(cause, "reason", cause), NewConnectionError)
+
+def get_http_stats():
+    with http_stats_lock:
+        return {endpoint: dict(stats) for endpoint, stats in http_stats.items()}
+
+def log_http_stats():
+    for endpoint, stats in sorted(get_http_stats().items()):
+        avg_ms = stats["total_ms"] / stats["requests"] if stats["requests"] else 0.0
+        print(f"[*] HTTP {endpoint}: {stats['requests']} requests, {stats['failures']} failed, "
+              f"{stats['retries']} retried, avg {avg_ms:.0f} ms, max {stats['max_ms']:.0f} ms")
+
 def calculate_file_hash(filepath):
     """Calculate the SHA256 hash of a file."""
     if not filepath.exists():
@@ -44,7 +197,7 @@ def calculate_file_hash(filepath):
     try:
         with open(filepath, "rb") as f:
             file_hash = hashlib.sha256()
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
                 file_hash.update(chunk)
         return file_hash.hexdigest()
     except Exception as e:
@@ -158,7 +311,7 @@ def ensure_engine_exists():
         if server_engine_hash and stored_hash:
             if server_engine_hash != stored_hash:
                 print(f"[INFO] Server engine hash differs from stored hash. Downloading new version.")
-                success = download_engine_from_server()
+                success = download_engine_from_server(server_engine_hash)
                 if success:
                     # Update the stored hash file with the new hash and current time
                     now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
@@ -189,7 +342,7 @@ def ensure_engine_exists():
         elif server_engine_hash:
             # No stored hash, but server has one -> download
             print(f"[INFO] No stored hash found, but server has one. Downloading engine.")
-            success = download_engine_from_server()
+            success = download_engine_from_server(server_engine_hash)
             if success:
                 # Update the stored hash file with the new hash and current time
                 now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
@@ -234,34 +387,85 @@ def ensure_engine_exists():
             exit(1)
 
 
-def download_engine_from_server():
-    """Download the lamb executable from the server."""
+def download_engine_from_server(expected_hash=None):
+    """Download the lamb executable from the server.
+
+    The binary is streamed to a temp file next to LAMB_BINARY, checked against
+    expected_hash (or the server's X-Engine-SHA256), and renamed into place, so
+    lamb processes that are already running keep their old inode and never see
+    a half-written file. An unchanged engine costs a 304; a partial temp file
+    left by an interrupted download is resumed with a Range request, and
+    thrown away for a download from byte 0 if it cannot be resumed.
+    """
+    tmp_path = LAMB_BINARY.with_name(LAMB_BINARY.name + ".download")
     try:
-        download_url = f"{SERVER_URL}/download_engine"
-        print(f"[DEBUG] Attempting to download engine from: {download_url}")
-        response = requests.get(download_url, timeout=30)
-        response.raise_for_status() # Raise an exception for bad status codes (4xx, 5xx)
+        print(f"[DEBUG] Attempting to download engine from: {SERVER_URL}/download_engine")
 
         # Ensure the directory for the binary exists
         LAMB_BINARY.parent.mkdir(parents=True, exist_ok=True)
 
-        # Write the binary content to the specified path
-        with open(LAMB_BINARY, 'wb') as f:
-            f.write(response.content)
-
-        print(f"[+] Downloaded engine to {LAMB_BINARY}")
-
-        # Set executable permissions
+        headers = {}
+        local_hash = calculate_file_hash(LAMB_BINARY) if LAMB_BINARY.exists() else None
+        if local_hash:
+            headers["If-None-Match"] = f'"{local_hash}"'
+        file_hash = hashlib.sha256()
+        resume_from = tmp_path.stat().st_size if tmp_path.exists() and expected_hash else 0
+        if resume_from:
+            # Only resume if the server still has the same engine; otherwise it sends the whole file
+            headers["Range"] = f"bytes={resume_from}-"
+            headers["If-Range"] = f'"{expected_hash}"'
+
+        resumed = False
+        with http_request("GET", "/download_engine", kind="download", headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                print(f"[+] Local engine {LAMB_BINARY} is already up to date")
+                tmp_path.unlink(missing_ok=True)
+                LAMB_BINARY.chmod(0o755)
+                return True
+            if response.status_code == 416 and resume_from:
+                # The leftover temp file is at least as long as the engine: nothing left to resume
+                print(f"[!] Cannot resume engine download at byte {resume_from}, starting over")
+            else:
+                response.raise_for_status() # Raise an exception for bad status codes (4xx, 5xx)
+                expected_hash = expected_hash or response.headers.get("X-Engine-SHA256")
+
+                resumed = response.status_code == 206
+                if resumed:
+                    print(f"[DEBUG] Resuming engine download at byte {resume_from}")
+                    with open(tmp_path, "rb") as f:
+                        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                            file_hash.update(chunk)
+                with open(tmp_path, "ab" if resumed else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+                        file_hash.update(chunk)
+        if response.status_code == 416:
+            tmp_path.unlink(missing_ok=True)
+            return download_engine_from_server(expected_hash) # No temp file left, so this starts at byte 0
+
+        downloaded_hash = file_hash.hexdigest()
+        if expected_hash and downloaded_hash != expected_hash:
+            print(f"[!] Downloaded engine hash {downloaded_hash[:16]}... does not match expected {expected_hash[:16]}...")
+            tmp_path.unlink(missing_ok=True)
+            if resumed:
+                # The kept prefix may have been bad; one more try from byte 0
+                return download_engine_from_server(expected_hash)
+            return False
+
+        # Set executable permissions before the binary becomes visible under its real name
         try:
-            LAMB_BINARY.chmod(0o755) # rwxr-xr-x
-            print(f"[+] Set executable permissions for {LAMB_BINARY}")
+            tmp_path.chmod(0o755) # rwxr-xr-x
         except Exception as e:
-            print(f"[!] Error setting executable permissions for {LAMB_BINARY}: {e}")
+            print(f"[!] Error setting executable permissions for {tmp_path}: {e}")
+            tmp_path.unlink(missing_ok=True) # A complete leftover could never be resumed
             return False # Return False if chmod fails
+        os.replace(tmp_path, LAMB_BINARY)
 
+        print(f"[+] Downloaded engine to {LAMB_BINARY} ({downloaded_hash[:16]}...)")
         return True
 
     except requests.exceptions.RequestException as e:
+        # Keep any partial temp file so the next attempt can resume it
         print(f"[!] Error downloading engine from server: {e}")
         return False
     except Exception as e:
@@ -275,114 +479,584 @@ def get_client_id():
         return CLIENT_ID_FILE.read_text().strip()
 
     payload = {"name": COMP_NAME}
-    r = requests.post(f"{SERVER_URL}/register", json=payload)
+    r = http_request("POST", "/register", json=payload)
+    r.raise_for_status()
     cid = r.json()["client_id"]
     CLIENT_ID_FILE.write_text(cid)
     print(f"[+] Registered as {COMP_NAME} → {cid}")
     return cid
 
+# === Engine Version ===
+# Latest engine hash/version id advertised by /parameters
+server_engine = {"hash": None, "version": None}
+# Server version id of the local binary, reported with every progress update.
+# None if the local binary is not the one the server currently serves.
+ENGINE_VERSION = None
+# Server engine hash this run has already acted on (at startup or by a hot swap);
+# the server advertising a different one triggers the next swap.
+engine_in_use = {"server_hash": None}
+
+def set_engine_version():
+    """Match the local binary against the server's engine and remember its version id."""
+    global ENGINE_VERSION
+    local_hash = calculate_file_hash(LAMB_BINARY) if LAMB_BINARY.exists() else None
+    if local_hash and local_hash == server_engine["hash"]:
+        ENGINE_VERSION = server_engine["version"]
+    else:
+        ENGINE_VERSION = None
+    print(f"[*] Engine version: {ENGINE_VERSION if ENGINE_VERSION is not None else 'unknown (local build)'}")
+
+def install_engine(expected_hash):
+    """Download the server's engine into place and switch reports to its version. Returns success."""
+    if not download_engine_from_server(expected_hash):
+        return False
+    LAMB_HASH_FILE.write_text(f"{expected_hash}|{datetime.datetime.now(datetime.timezone.utc).isoformat()}")
+    set_engine_version()
+    engine_in_use["server_hash"] = expected_hash
+    return True
+
 # === Fetch Parameters (Updated) ===
-def fetch_parameters():
+# Last parameter set seen by this process, with the version and ETag it came
+# with. Polls send both, so an unchanged set costs a bodyless 304.
+params_cache = {"etag": None, "version": None, "parameters": None, "concurrency_cap": None}
+
+def fetch_parameters(wait=0, cid=None):
+    """Return (parameters, changed, restart_required, engine_hash).
+
+    With wait > 0 the server holds the request for up to wait seconds until the
+    parameters or engine change (long poll). changed/restart_required are
+    relative to the version this process saw last. With cid, the server's
+    worker cap for this client lands in params_cache["concurrency_cap"].
+    """
     try:
-        r = requests.get(f"{SERVER_URL}/parameters", timeout=5)
+        headers = {}
+        query = {"client_id": cid} if cid else {}
+        if params_cache["etag"] and params_cache["parameters"] is not None:
+            headers["If-None-Match"] = params_cache["etag"]
+            query["since"] = params_cache["version"]
+            if wait:
+                query["wait"] = wait
+        r = http_request("GET", "/parameters", params=query, headers=headers, retries=1,
+                         timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUTS["control"] + wait))
+        if r.status_code == 304:
+            return dict(params_cache["parameters"]), False, False, server_engine["hash"]
         r.raise_for_status()
         data = r.json()
         # Return 4 values: parameters (including engine_hash), changed, restart_required, engine_hash
         params = data.get("parameters", {})
         engine_hash = data.get("engine_hash") # Extract engine hash from response
-        # Include engine_hash in the main params dict for easy access if needed elsewhere
-        # Or keep it separate. Let's keep it separate for clarity.
+        server_engine["hash"] = engine_hash
+        server_engine["version"] = data.get("engine_version")
+        params_cache.update(etag=r.headers.get("ETag"), version=data.get("version"), parameters=dict(params),
+                            concurrency_cap=data.get("concurrency_cap"))
         return params, data.get("changed", False), data.get("restart_required", False), engine_hash
     except Exception as e:
         print(f"[!] Param fetch error: {e}")
         # Return 4 values even on error, with engine_hash as None
         return None, False, False, None
 
+# === Shared Parameter Snapshot ===
+# Only the main loop polls /parameters. It publishes the result here and the
+# supervisor's slots read it at batch start, so batches cost no parameter requests.
+param_snapshot = {"parameters": None, "version": None}
+
+def publish_parameters(params):
+    """Main loop: publish the current parameter set and its server version to the slots."""
+    global param_snapshot
+    # Replaced as a whole, so a slot never sees parameters from one version with another's number
+    param_snapshot = {"parameters": dict(params), "version": params_cache["version"]}
+
+def read_parameters(fallback):
+    """Slot: return the latest published parameters (fallback until the first publish)."""
+    return dict(param_snapshot["parameters"] or fallback)
+
 # === Report Progress (with games/positions) ===
+# Slots and the main loop only queue progress events; a reporter thread sends
+# them to /progress_batch every REPORT_FLUSH_INTERVAL seconds, or as soon as
+# REPORT_BATCH_MAX are waiting.
+REPORT_FLUSH_INTERVAL = 5
+REPORT_BATCH_MAX = 100
+REPORT_BUFFER_MAX = 5000 # Events kept while the server is unreachable; oldest are dropped beyond this
+
+report_queue = None # queue.Queue drained by the reporter thread, set up by start_reporter()
+report_batching = {"supported": True} # Cleared when the server predates /progress_batch
+reporter = None
+
 def report_progress(cid, message, games=0, positions=0, output_file=None):
     payload = {
         "client_id": cid,
         "progress": message,
         "games": games,
-        "positions": positions
+        "positions": positions,
+        "time": time.time() # When it happened; the event may wait in a batch or the retry buffer
     }
     if output_file:
         payload["output_file"] = output_file
+    if ENGINE_VERSION is not None:
+        payload["engine_version"] = ENGINE_VERSION
 
     print(f"[DEBUG] Reporting progress: {message}, games={games}, positions={positions}, file={output_file}")  # ADD THIS
 
+    if report_queue is not None:
+        report_queue.put(payload)
+    else:
+        _post_progress(payload)
+
+def _post_progress(payload):
     try:
-        response = requests.post(f"{SERVER_URL}/progress", json=payload, timeout=5)
+        response = http_request("POST", "/progress", json=payload)
         print(f"[DEBUG] Progress report response: {response.status_code}")  # ADD THIS
     except Exception as e:
         print(f"[DEBUG] Progress report failed: {e}")  # ADD THIS
 
+def send_progress_batch(events):
+    """Send events in one request. Returns False if they should be kept and retried."""
+    if report_batching["supported"]:
+        try:
+            r = http_request("POST", "/progress_batch", gzip_body=True,
+                             json={"client_id": events[0]["client_id"], "events": events})
+        except requests.exceptions.RequestException as e:
+            # Once the body went out the server may have counted it: dropping beats double-counting
+            retry = _failed_to_connect(e)
+            print(f"[DEBUG] Progress batch failed{'' if retry else ', dropping it'}: {e}")
+            return not retry
+        except Exception as e:
+            print(f"[DEBUG] Progress batch failed: {e}")
+            return False
+        if r.status_code != 404:
+            print(f"[DEBUG] Progress batch ({len(events)} events) response: {r.status_code}")
+            # 4xx means the server will never take these; only retry server-side trouble
+            return r.status_code < 500
+        print("[*] Server has no /progress_batch, reporting events one at a time")
+        report_batching["supported"] = False
+    for event in events:
+        _post_progress(event)
+    return True
+
+def reporter_loop():
+    pending = []
+    backlogged = False
+    stopping = False
+    while not stopping:
+        # Collect until the flush interval passes or a full batch is waiting. While
+        # the server is failing, keep collecting for the whole interval instead.
+        deadline = time.monotonic() + REPORT_FLUSH_INTERVAL
+        while backlogged or len(pending) < REPORT_BATCH_MAX:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                event = report_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if event is None:
+                stopping = True
+                break
+            pending.append(event)
+
+        backlogged = False
+        while pending:
+            batch = pending[:REPORT_BATCH_MAX]
+            if not send_progress_batch(batch):
+                backlogged = True
+                break
+            del pending[:len(batch)]
+        if len(pending) > REPORT_BUFFER_MAX:
+            print(f"[!] Dropping {len(pending) - REPORT_BUFFER_MAX} unsent progress reports")
+            del pending[:len(pending) - REPORT_BUFFER_MAX]
+
+def start_reporter():
+    global report_queue, reporter
+    report_queue = queue.Queue()
+    reporter = threading.Thread(target=reporter_loop, name="reporter", daemon=True)
+    reporter.start()
+
+def stop_reporter(timeout=15):
+    """Flush queued progress events (one attempt) and stop the reporter thread."""
+    if reporter is None or not reporter.is_alive():
+        return
+    report_queue.put(None)
+    reporter.join(timeout)
+
 # === Parse lamb Output ===
-def parse_lamb_output(stdout):
+LAMB_TAIL_LINES = 40 # Output lines kept per batch for error reports
+PROGRESS_REPORT_INTERVAL = 30 # Seconds between live progress reports while a batch runs
+RE_GAMES = re.compile(r"games=(\d+)")
+RE_POSITIONS = re.compile(r"positions=(\d+)")
+
+def parse_counts(line):
+    """Return (games, positions) from a lamb output line, or None."""
+    m = RE_GAMES.search(line)
+    n = RE_POSITIONS.search(line) if m else None
+    if m and n:
+        return int(m.group(1)), int(n.group(1))
+    return None
+
+class LambOutput:
+    """Incremental parser for lamb stdout, fed one line at a time.
+
+    Keeps only the counts that matter and a bounded tail of recent lines.
+    """
+    def __init__(self):
+        self.summary = None   # counts from "datagen summary"
+        self.progress = None  # counts from the latest "datagen progress"
+        self.other = None     # first other line with games=/positions=
+        self.tail = deque(maxlen=LAMB_TAIL_LINES)
+
+    def feed(self, line):
+        """Parse one line; return its counts if it was a progress line."""
+        line = line.rstrip("\n")
+        self.tail.append(line)
+        if "datagen progress" in line:
+            counts = parse_counts(line)
+            if counts:
+                self.progress = counts
+            return counts
+        if "datagen summary" in line:
+            if self.summary is None:
+                self.summary = parse_counts(line)
+        elif self.other is None and "games=" in line and "positions=" in line:
+            self.other = parse_counts(line)
+        return None
+
+    def result(self):
+        """Final (games, positions): summary, else last progress, else any counts line."""
+        counts = self.summary or self.progress or self.other
+        if counts:
+            print(f"[DEBUG] Successfully parsed: {counts[0]} games, {counts[1]} positions")
+            return counts
+        print(f"[DEBUG] Could not parse games/positions from output")
+        print(f"[DEBUG] Output tail: {' | '.join(list(self.tail)[-5:])}")
+        return 0, 0
+
+# === Upload Spool ===
+# A small SQLite journal in OUTPUT_DIR recording every output file and its
+# upload state, written by the supervisor and the uploader threads. It lets a
+# restarted client resume pending uploads and keeps cleanup_old_files() away
+# from anything the server does not have yet.
+#   running     lamb is (or was, before a crash) writing the file
+#   pending     finished, waiting for upload
+#   uploaded    the server has it; safe to delete locally
+#   failed      lamb exited with an error
+#   interrupted the client stopped while lamb was running; output is partial
+#   missing     the file disappeared before it was uploaded
+# failed, interrupted and missing files are never uploaded; cleanup_old_files()
+# deletes them once SPOOL_DISCARD_AFTER has passed since their last state change.
+SPOOL_DB = OUTPUT_DIR / "spool.db"
+SPOOL_DISCARD_STATES = ("failed", "interrupted", "missing")
+SPOOL_DISCARD_AFTER = 24 * 60 * 60 # Seconds they are kept for inspection
+
+def _spool_connect():
+    conn = sqlite3.connect(SPOOL_DB, timeout=30, isolation_level=None) # Autocommit; one statement per call
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+def init_spool():
+    """Create the journal; on first use, adopt .bin files left by older clients as pending."""
+    with closing(_spool_connect()) as conn:
+        is_new = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'spool'").fetchone() is None
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS spool (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            created TEXT,
+            updated TEXT
+        )""")
+        if is_new:
+            for f in OUTPUT_DIR.glob("*.bin"):
+                spool_record(f.name, "pending")
+
+def spool_record(name, state):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    try:
+        with closing(_spool_connect()) as conn:
+            conn.execute("""
+                INSERT INTO spool (name, state, created, updated) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET state = excluded.state, updated = excluded.updated
+            """, (name, state, now, now))
+    except sqlite3.Error as e:
+        print(f"[!] Spool journal error recording {name} as {state}: {e}")
+
+def spool_count_attempt(name):
     try:
-        lines = stdout.split('\n')
+        with closing(_spool_connect()) as conn:
+            conn.execute("UPDATE spool SET attempts = attempts + 1 WHERE name = ?", (name,))
+    except sqlite3.Error as e:
+        print(f"[!] Spool journal error counting an upload attempt for {name}: {e}")
+
+def spool_names(*states):
+    with closing(_spool_connect()) as conn:
+        rows = conn.execute(f"SELECT name FROM spool WHERE state IN ({','.join('?' * len(states))}) ORDER BY created",
+                            states).fetchall()
+    return [row[0] for row in rows]
+
+def spool_states():
+    """name -> state for every file in the journal."""
+    with closing(_spool_connect()) as conn:
+        return dict(conn.execute("SELECT name, state FROM spool").fetchall())
+
+def spool_discardable():
+    """Files in SPOOL_DISCARD_STATES whose state is older than SPOOL_DISCARD_AFTER."""
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=SPOOL_DISCARD_AFTER)
+    states = SPOOL_DISCARD_STATES
+    with closing(_spool_connect()) as conn:
+        rows = conn.execute(f"SELECT name FROM spool WHERE state IN ({','.join('?' * len(states))}) AND updated < ?",
+                            states + (cutoff.isoformat(),)).fetchall()
+    return [row[0] for row in rows]
+
+def spool_forget(name):
+    with closing(_spool_connect()) as conn:
+        conn.execute("DELETE FROM spool WHERE name = ?", (name,))
+
+def resume_spooled_uploads():
+    """Called once at startup, before any lamb process runs: requeue everything not yet uploaded."""
+    for name in spool_names("running"):
+        print(f"[SPOOL] {name} was still being written when the client stopped; marking interrupted")
+        spool_record(name, "interrupted")
+    resumed = requeue_pending_uploads()
+    if resumed:
+        print(f"[SPOOL] Resumed {resumed} pending uploads")
+
+def requeue_pending_uploads():
+    """Submit every pending file that no uploader holds. Returns how many were queued."""
+    queued = 0
+    for name in spool_names("pending"):
+        if upload_in_flight(name):
+            continue
+        file_path = OUTPUT_DIR / name
+        if not file_path.exists():
+            print(f"[SPOOL] Pending file {name} no longer exists")
+            spool_record(name, "missing")
+            continue
+        submit_upload(file_path)
+        queued += 1
+    return queued
 
-        # Priority 1: Look for final summary line
-        summary_line = None
-        for line in lines:
-            if "datagen summary" in line:
-                summary_line = line
-                break
+# === Upload File to Server ===
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024 # Capped by the chunk_size the server advertises
+UPLOAD_MAX_ATTEMPTS = 5 # Resume attempts within one upload_file_to_server call
+UPLOAD_BACKOFF_BASE = 2 # Seconds; doubled per attempt, with jitter
+UPLOAD_BACKOFF_MAX = 30
+UPLOAD_RETRY_BASE = 30 # Between whole upload rounds in the background uploader
+UPLOAD_RETRY_MAX = 15 * 60
+COMPRESS_DEFAULT_LEVELS = {"zstd": 3, "gzip": 6}
+COMPRESS_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+
+_server_encodings = None # Cached answer from /upload/encodings
+
+def _negotiate_encoding():
+    """Pick the upload encoding: the --compress choice if the server accepts it, else identity."""
+    global _server_encodings
+    if args.compress == "none":
+        return "identity"
+    if _server_encodings is None:
+        try:
+            r = http_request("GET", "/upload/encodings", retries=0)
+            _server_encodings = r.json()["encodings"] if r.status_code == 200 else ["identity"]
+        except Exception as e:
+            print(f"[DEBUG] Could not query server upload encodings: {e}")
+            return "identity" # Not cached; ask again next upload
+    wanted = ["zstd", "gzip"] if args.compress == "auto" else [args.compress]
+    for encoding in wanted:
+        if encoding == "zstd" and zstd is None:
+            continue
+        if encoding in _server_encodings:
+            return encoding
+    return "identity"
 
-        # Priority 2: If no summary, use the last progress line
-        if not summary_line:
-            progress_lines = [line for line in lines if "datagen progress" in line]
-            if progress_lines:
-                summary_line = progress_lines[-1]  # Last progress line
-
-        # Priority 3: If still nothing, use any line with games/positions
-        if not summary_line:
-            for line in lines:
-                if "games=" in line and "positions=" in line:
-                    summary_line = line
-                    break
+def compress_file(file_path, encoding):
+    """Stream-compress file_path next to itself and return the compressed path.
 
-        if summary_line:
-            print(f"[DEBUG] Using line for parsing: {summary_line.strip()}")
+    An existing compressed copy (left by an interrupted upload) is reused so the
+    server-side partial upload it belongs to can be resumed.
+    """
+    target = file_path.with_name(file_path.name + COMPRESS_SUFFIXES[encoding])
+    if target.exists():
+        return target
+    level = args.compress_level if args.compress_level is not None else COMPRESS_DEFAULT_LEVELS[encoding]
+    tmp_path = target.with_name(target.name + ".tmp")
+    with open(file_path, "rb") as fin, open(tmp_path, "wb") as fout:
+        if encoding == "zstd":
+            zstd.ZstdCompressor(level=level).copy_stream(fin, fout)
+        else:
+            # Fixed name and mtime keep the output reproducible
+            with gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=fout, mtime=0) as gz:
+                shutil.copyfileobj(fin, gz, 1024 * 1024)
+    os.replace(tmp_path, target)
+    return target
+
+def _upload_legacy(file_path, sha256):
+    """Single multipart POST, for servers without the chunked upload endpoints."""
+    with open(file_path, "rb") as f:
+        files = {"file": (file_path.name, f, "application/octet-stream")}
+        # The file object is consumed by the first attempt, so no transport retries here
+        r = http_request("POST", "/upload", kind="upload", retries=0, files=files, data={"sha256": sha256})
+    if r.status_code == 200:
+        print(f"[+] Uploaded {file_path.name}")
+        return True
+    print(f"[!] Upload failed with status {r.status_code}: {r.text}")
+    return False
 
-            # Extract games and positions
-            m = re.search(r"games=(\d+)", summary_line)
-            n = re.search(r"positions=(\d+)", summary_line)
+def _upload_chunked(file_path, sha256, encoding):
+    """Send file_path in offset-addressed chunks, resuming from the server's offset.
 
-            if m and n:
-                games = int(m.group(1))
-                positions = int(n.group(1))
-                print(f"[DEBUG] Successfully parsed: {games} games, {positions} positions")
-                return games, positions
+    Returns True on success, False on a permanent failure, and None if the server
+    does not support chunked uploads (or the encoding). Network errors propagate
+    to the caller.
+    """
+    size = file_path.stat().st_size
+    send_path = file_path if encoding == "identity" else compress_file(file_path, encoding)
+    encoded_size = send_path.stat().st_size
+    payload = {"filename": file_path.name, "size": size, "sha256": sha256,
+               "encoding": encoding, "encoded_size": encoded_size}
+    r = http_request("POST", "/upload/init", json=payload)
+    if r.status_code in (404, 415):
+        return None
+    if r.status_code == 409:
+        print(f"[!] Upload rejected: {r.json().get('error')}")
+        return False
+    r.raise_for_status()
+    info = r.json()
+    if info.get("status") == "exists":
+        print(f"[+] Server already has {file_path.name} ({sha256[:16]}...), skipping upload")
+        _remove_compressed_copy(file_path, send_path)
+        return True
+    upload_id, offset = info["upload_id"], info["offset"]
+    chunk_size = min(UPLOAD_CHUNK_SIZE, info.get("chunk_size", UPLOAD_CHUNK_SIZE))
+    if offset:
+        print(f"[DEBUG] Resuming upload of {file_path.name} at {offset}/{encoded_size} bytes")
+
+    with open(send_path, "rb") as f:
+        while offset < encoded_size:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            r = http_request("PUT", f"/upload/{upload_id}", kind="upload", params={"offset": offset}, data=chunk,
+                             headers={"Content-Type": "application/octet-stream"})
+            if r.status_code == 409:
+                offset = r.json()["offset"] # Server has a different view; continue from there
+                continue
+            if r.status_code == 422:
+                _remove_compressed_copy(file_path, send_path)
+                raise IOError(f"server rejected {encoding} stream for {file_path.name}")
+            r.raise_for_status()
+            offset = r.json()["offset"]
+
+    r = http_request("POST", f"/upload/{upload_id}/finalize", kind="upload")
+    if r.status_code == 200:
+        ratio = f", {encoded_size / size:.1%} as {encoding}" if encoding != "identity" and size else ""
+        print(f"[+] Uploaded {file_path.name} ({size} bytes{ratio})")
+        _remove_compressed_copy(file_path, send_path)
+        return True
+    if r.status_code == 422:
+        # Server discarded the corrupt transfer; the next attempt starts from zero
+        _remove_compressed_copy(file_path, send_path)
+        raise IOError(f"server reported sha256 mismatch for {file_path.name}")
+    print(f"[!] Upload finalize failed with status {r.status_code}: {r.text}")
+    return False
 
-        print(f"[DEBUG] Could not parse games/positions from output")
-        print(f"[DEBUG] Output sample: {stdout[:300]}...")
-        return 0, 0
+def _remove_compressed_copy(file_path, send_path):
+    if send_path != file_path:
+        send_path.unlink(missing_ok=True)
 
-    except Exception as e:
-        print(f"[DEBUG] Parse error: {e}")
-        print(f"[DEBUG] Output that caused error: {stdout[:500]}")
-        return 0, 0
+def backoff_delay(attempt, base=UPLOAD_BACKOFF_BASE, cap=UPLOAD_BACKOFF_MAX):
+    """Exponential backoff with full jitter for the given 1-based attempt number."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
 
-# === Upload File to Server ===
 def upload_file_to_server(file_path):
+    """Upload file_path, resuming partial uploads. Returns True once the server has the file."""
     if not file_path.exists():
         print(f"[DEBUG] Upload failed: {file_path} does not exist")
-        return
-    try:
-        print(f"[DEBUG] Attempting to upload {file_path}")
-        with open(file_path, "rb") as f:
-            files = {"file": (file_path.name, f, "application/octet-stream")}
-            r = requests.post(f"{SERVER_URL}/upload", files=files, timeout=30)
-            if r.status_code == 200:
-                print(f"[+] Uploaded {file_path.name}")
-                # Optional: delete after successful upload to save space
-                # file_path.unlink()
-                # print(f"[+] Deleted local file {file_path.name}")
-            else:
-                print(f"[!] Upload failed with status {r.status_code}: {r.text}")
-    except Exception as e:
-        print(f"[!] Upload failed: {e}")
+        return False
+    print(f"[DEBUG] Attempting to upload {file_path}")
+    sha256 = calculate_file_hash(file_path)
+    if sha256 is None:
+        return False
+    encoding = _negotiate_encoding()
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
+        try:
+            result = _upload_chunked(file_path, sha256, encoding)
+            if result is None and encoding != "identity":
+                print(f"[DEBUG] Server refused {encoding} upload, sending uncompressed")
+                encoding = "identity"
+                result = _upload_chunked(file_path, sha256, encoding)
+            if result is None:
+                return _upload_legacy(file_path, sha256)
+            return result
+        except Exception as e:
+            print(f"[!] Upload of {file_path.name} interrupted (attempt {attempt}/{UPLOAD_MAX_ATTEMPTS}): {e}")
+            if attempt < UPLOAD_MAX_ATTEMPTS:
+                time.sleep(backoff_delay(attempt))
+    return False
+
+# === Background Uploader ===
+# Slots hand finished files to upload_queue and go straight on to their next
+# batch; uploader threads drain the queue. A file whose upload fails is retried
+# with exponential backoff and jitter. Files an uploader gave up on stay
+# pending in the spool, and the main loop re-submits them every
+# SPOOL_REQUEUE_INTERVAL.
+UPLOAD_RETRY_ROUNDS = 8 # upload_file_to_server calls per file before giving up
+SPOOL_REQUEUE_INTERVAL = 30 * 60 # Seconds between re-submissions of stale pending files
+
+upload_queue = None # queue.Queue drained by the uploader threads, set up by main()
+uploads_in_flight = set() # Names queued or being uploaded, so no file is queued twice
+uploads_in_flight_lock = threading.Lock()
+
+def upload_in_flight(name):
+    with uploads_in_flight_lock:
+        return name in uploads_in_flight
+
+def submit_upload(file_path):
+    """Queue file_path for background upload (or upload inline before main() sets up the queue)."""
+    if upload_queue is None:
+        uploaded = upload_file_to_server(file_path)
+        if uploaded:
+            spool_record(file_path.name, "uploaded")
+        return uploaded
+    with uploads_in_flight_lock:
+        if file_path.name in uploads_in_flight:
+            return True
+        uploads_in_flight.add(file_path.name)
+    upload_queue.put(str(file_path))
+    print(f"[DEBUG] Queued {file_path.name} for upload")
+    return True
+
+def uploader_loop():
+    while True:
+        file_path = Path(upload_queue.get())
+        try:
+            upload_spooled_file(file_path)
+        except Exception as e:
+            # Keep the thread alive; the file stays pending in the spool for the next requeue
+            print(f"[!] Uploader error on {file_path.name}, leaving it pending: {e}")
+        finally:
+            with uploads_in_flight_lock:
+                uploads_in_flight.discard(file_path.name)
+
+def upload_spooled_file(file_path):
+    """Upload one queued file, retrying with backoff, and record the result in the spool."""
+    started = time.perf_counter()
+    uploaded = False
+    for attempt in range(1, UPLOAD_RETRY_ROUNDS + 1):
+        spool_count_attempt(file_path.name)
+        if upload_file_to_server(file_path):
+            spool_record(file_path.name, "uploaded")
+            uploaded = True
+            break
+        if not file_path.exists():
+            spool_record(file_path.name, "missing")
+            break
+        delay = backoff_delay(attempt, base=UPLOAD_RETRY_BASE, cap=UPLOAD_RETRY_MAX)
+        print(f"[!] Upload of {file_path.name} failed (round {attempt}/{UPLOAD_RETRY_ROUNDS}), retrying in {delay:.0f}s")
+        time.sleep(delay)
+    else:
+        # Still pending in the spool, so requeue_pending_uploads() tries again later
+        print(f"[!] Giving up on uploading {file_path.name} for now; it stays in {OUTPUT_DIR}")
+    record_upload_done(file_path.name, time.perf_counter() - started, uploaded)
+
+def start_uploaders(count):
+    for i in range(count):
+        threading.Thread(target=uploader_loop, name=f"uploader-{i}", daemon=True).start()
 
 # === Generate Unique Filename ===
 def make_output_filename():
@@ -390,15 +1064,250 @@ def make_output_filename():
     uniq = ''.join(random.choices(string.ascii_uppercase, k=4))
     return f"data_{now}_{COMP_NAME}_{uniq}.bin"  # ADD .bin extension
 
-# === Run ONE Batch of lamb (called by worker) ===
-def run_one_batch(params, cid):
-    output_file = make_output_filename()
-    output_path = OUTPUT_DIR / output_file
+# === Adaptive Batch Size ===
+# With batch_mode "adaptive", each supervisor slot keeps moving averages of its
+# own positions/sec (lamb start to exit, so startup and file writing are
+# included) and positions/game, and sizes its next batch to last
+# target_batch_seconds. The first batch of a slot runs min_games.
+BATCH_EWMA_ALPHA = 0.3 # Weight of the newest batch in the averages
+BATCH_MAX_GROWTH = 4 # Limit on how much one batch can grow over the previous one
+
+def new_batch_rates():
+    return {"pos_per_sec": None, "pos_per_game": None, "last_games": None}
+
+def _ewma(old, new):
+    return new if old is None else old + BATCH_EWMA_ALPHA * (new - old)
+
+def record_batch_rate(batch_rates, games, positions, seconds):
+    """Feed a finished batch into a slot's speed estimates."""
+    if games <= 0 or positions <= 0 or seconds <= 0:
+        return
+    batch_rates["pos_per_sec"] = _ewma(batch_rates["pos_per_sec"], positions / seconds)
+    batch_rates["pos_per_game"] = _ewma(batch_rates["pos_per_game"], positions / games)
+
+def choose_batch_games(params, batch_rates):
+    """Games for the next batch: params['games'], or the slot's adaptive estimate within min/max."""
+    if params.get("batch_mode", "fixed") != "adaptive":
+        return params["games"]
+    min_games = params.get("min_games", 1)
+    max_games = max(min_games, params.get("max_games", params["games"]))
+    if batch_rates["pos_per_sec"] is None:
+        # No measurement yet: start small so the first estimate arrives quickly
+        games = min_games
+    else:
+        seconds_per_game = batch_rates["pos_per_game"] / batch_rates["pos_per_sec"]
+        games = round(params.get("target_batch_seconds", 300) / seconds_per_game)
+        if batch_rates["last_games"]:
+            games = min(games, batch_rates["last_games"] * BATCH_MAX_GROWTH)
+    games = max(min_games, min(max_games, games))
+    batch_rates["last_games"] = games
+    return games
+
+def describe_batch_size(params):
+    if params.get("batch_mode", "fixed") == "adaptive":
+        return (f"adaptive ~{params.get('target_batch_seconds', 300)}s batches "
+                f"({params.get('min_games', 1)}-{params.get('max_games', params['games'])} games)")
+    return f"{params['games']} games"
+
+# === Work Leases ===
+# Each batch runs under a lease from the server: a games quota (capped when the
+# job is nearly done) plus the parameters to use. A heartbeat task keeps the
+# lease alive while lamb runs. Against a server without /lease, or while the
+# server is unreachable, batches run unleased as before.
+lease_support = {"enabled": True} # Cleared in this process when the server has no /lease
+
+def request_lease(cid, games):
+    """Return a lease dict, seconds to wait if the server has no work now, or None to run unleased."""
+    if not lease_support["enabled"]:
+        return None
+    try:
+        r = http_request("POST", "/lease", json={"client_id": cid, "games": games})
+    except Exception as e:
+        print(f"[DEBUG] Lease request failed, running unleased: {e}")
+        return None
+    if r.status_code == 404:
+        print("[*] Server does not hand out leases, running unleased")
+        lease_support["enabled"] = False
+        return None
+    if r.status_code == 204:
+        try:
+            return float(r.headers.get("Retry-After", POLL_INTERVAL))
+        except ValueError:
+            return POLL_INTERVAL
+    if r.status_code != 200:
+        print(f"[DEBUG] Lease request answered {r.status_code}, running unleased")
+        return None
+    return r.json()
+
+async def lease_heartbeat_loop(lease, parsed):
+    """Keep lease alive while its batch runs; cancelled when the batch ends."""
+    while True:
+        await asyncio.sleep(lease.get("heartbeat_interval", 30))
+        positions = parsed.progress[1] if parsed.progress else 0
+        try:
+            r = await run_blocking(http_request, "POST", f"/lease/{lease['lease_id']}/heartbeat",
+                                   json={"positions": positions}, retries=1)
+            if r.status_code == 404:
+                print(f"[!] Lease {lease['lease_id'][:8]} expired on the server; finishing the batch anyway")
+                return
+        except Exception as e:
+            print(f"[DEBUG] Lease heartbeat failed: {e}")
+
+def finish_lease(lease, games, positions):
+    try:
+        r = http_request("POST", f"/lease/{lease['lease_id']}/complete", json={"games": games, "positions": positions})
+        if r.status_code == 200 and r.json().get("status") == "late":
+            print(f"[DEBUG] Lease {lease['lease_id'][:8]} had expired; output was still credited")
+        elif r.status_code in (404, 409):
+            print(f"[DEBUG] Lease {lease['lease_id'][:8]} not credited: {r.json().get('error')}")
+    except Exception as e:
+        # The server reclaims the lease after its TTL
+        print(f"[DEBUG] Could not complete lease {lease['lease_id'][:8]}: {e}")
+
+# === Batch Accounting ===
+# Each batch gets a record: wall time per phase, the lamb process's CPU time
+# and peak RSS, and positions per CPU-second. CPU and RSS are sampled from /proc
+# every PROC_SAMPLE_INTERVAL while lamb runs (the event loop's child watcher
+# reaps it at once, so there is no rusage to collect at exit); they can miss
+# only lamb's final second. A record is appended to BATCH_METRICS_FILE once its
+# output has been uploaded (or at once if there is nothing to upload), and
+# folded into totals that the main loop sends to POST /batch_stats.
+BATCH_METRICS_FILE = OUTPUT_DIR / "batch_metrics.jsonl"
+BATCH_METRICS_MAX_BYTES = 16 * 1024 * 1024 # Rotated to batch_metrics.jsonl.1 beyond this
+BATCH_STATS_INTERVAL = 300 # Seconds between aggregate reports to the server
+PROC_SAMPLE_INTERVAL = 1 # Seconds between /proc samples of a running lamb
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+batch_metrics_lock = threading.Lock()
+batch_totals = {} # Aggregate of records not yet sent to the server, see merge_batch_totals
+awaiting_upload = {} # Output file name -> batch record waiting for its upload phase
+batch_stats_support = {"enabled": True} # Cleared when the server has no /batch_stats
+
+def read_proc_usage(pid):
+    """(user CPU s, system CPU s, peak RSS KB or None) of a live process, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the parenthesised command name; utime and stime are fields 14 and 15
+            fields = f.read().rsplit(")", 1)[1].split()
+        usage = (int(fields[11]) / CLK_TCK, int(fields[12]) / CLK_TCK)
+        peak_rss = None
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_rss = int(line.split()[1])
+                    break
+    except (OSError, ValueError, IndexError):
+        return None
+    return usage + (peak_rss,)
+
+def sample_usage(record, pid):
+    usage = read_proc_usage(pid)
+    if usage is None:
+        return
+    record["cpu_user"] = max(record["cpu_user"], usage[0])
+    record["cpu_sys"] = max(record["cpu_sys"], usage[1])
+    if usage[2] is not None:
+        record["max_rss_kb"] = max(record["max_rss_kb"] or 0, usage[2])
 
+async def usage_sampler(record, pid):
+    while True:
+        sample_usage(record, pid)
+        await asyncio.sleep(PROC_SAMPLE_INTERVAL)
+
+def add_phase(record, phase, since):
+    """Add the time since `since` (a perf_counter value) to record's phase. Returns the current perf_counter."""
+    now = time.perf_counter()
+    record["phases"][phase] = record["phases"].get(phase, 0.0) + (now - since)
+    return now
+
+def new_batch_record(slot, params, batch_games, output_file, lease):
+    return {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "file": output_file, "slot": slot["index"], "leased": lease is not None,
+        "games_requested": batch_games, "depth": params.get("depth"), "engine_version": ENGINE_VERSION,
+        "outcome": "stopped", "games": 0, "positions": 0, "wall": 0.0,
+        "cpu_user": 0.0, "cpu_sys": 0.0, "max_rss_kb": None, "positions_per_cpu_sec": None,
+        "phases": {"lease": slot.pop("lease_seconds", 0.0)},
+    }
+
+def finish_batch_record(record, upload_name=None):
+    """Complete record; it is written now, or after upload_name has been uploaded."""
+    cpu = record["cpu_user"] + record["cpu_sys"]
+    record["positions_per_cpu_sec"] = round(record["positions"] / cpu, 1) if cpu > 0 else None
+    record["phases"] = {phase: round(seconds, 3) for phase, seconds in record["phases"].items()}
+    record["wall"] = round(record["wall"], 3)
+    if upload_name:
+        with batch_metrics_lock:
+            awaiting_upload[upload_name] = record
+        return
+    write_batch_record(record)
+
+def record_upload_done(name, seconds, uploaded):
+    """Uploader: add the upload phase to the batch that produced name and write its record."""
+    with batch_metrics_lock:
+        record = awaiting_upload.pop(name, None)
+    if record is None:
+        return # Resumed from a previous run
+    record["phases"]["upload"] = round(seconds, 3)
+    record["uploaded"] = uploaded
+    write_batch_record(record)
+
+def write_batch_record(record):
+    line = json.dumps(record)
+    with batch_metrics_lock:
+        merge_batch_totals(batch_totals, {
+            "batches": 1, "failed": 0 if record["outcome"] in ("finished", "preempted") else 1,
+            "games": record["games"], "positions": record["positions"], "wall_seconds": record["wall"],
+            "cpu_seconds": record["cpu_user"] + record["cpu_sys"], "max_rss_kb": record["max_rss_kb"] or 0,
+            "phase_seconds": record["phases"]})
+        try:
+            if BATCH_METRICS_FILE.exists() and BATCH_METRICS_FILE.stat().st_size > BATCH_METRICS_MAX_BYTES:
+                os.replace(BATCH_METRICS_FILE, BATCH_METRICS_FILE.with_name(BATCH_METRICS_FILE.name + ".1"))
+            with open(BATCH_METRICS_FILE, "a") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"[!] Could not write {BATCH_METRICS_FILE}: {e}")
+
+def merge_batch_totals(totals, other):
+    """Add aggregate other into totals (max for max_rss_kb, per phase for phase_seconds)."""
+    for key, value in other.items():
+        if key == "phase_seconds":
+            phases = totals.setdefault(key, {})
+            for phase, seconds in value.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+        elif key == "max_rss_kb":
+            totals[key] = max(totals.get(key, 0), value)
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def send_batch_stats(cid):
+    """Main loop: send the totals gathered since the last call to the server."""
+    global batch_totals
+    with batch_metrics_lock:
+        totals, batch_totals = batch_totals, {}
+    if not totals or not batch_stats_support["enabled"]:
+        return
+    try:
+        r = http_request("POST", "/batch_stats", json={"client_id": cid, **totals})
+        if r.status_code == 404:
+            print("[*] Server does not collect batch stats; they stay in the local log")
+            batch_stats_support["enabled"] = False
+            return
+        r.raise_for_status()
+    except Exception as e:
+        print(f"[DEBUG] Batch stats report failed, keeping them for the next one: {e}")
+        with batch_metrics_lock:
+            merge_batch_totals(batch_totals, totals)
+
+# === Run ONE Batch of lamb (called by a supervisor slot) ===
+LAMB_STOP_TIMEOUT = 10 # Seconds lamb gets to exit after SIGTERM before it is killed
+LAMB_LINE_LIMIT = 1024 * 1024 # Longest stdout/stderr line the stream reader accepts
+
+def build_lamb_command(params, batch_games, output_path):
     cmd = [
         str(LAMB_BINARY.absolute()), # Convert Path to absolute string path (Fixed)
         "datagen",
-        "games", str(params["games"]),
+        "games", str(batch_games),
         "depth", str(params["depth"]),
         "save_min_ply", str(params["save_min_ply"]),
         "save_max_ply", str(params["save_max_ply"]),
@@ -410,62 +1319,408 @@ def run_one_batch(params, cid):
     ]
     if params["skipnoisy"]:
         cmd.append("skipnoisy")
+    return cmd
+
+async def _collect_lines(stream, tail):
+    async for line in stream:
+        tail.append(line.decode("utf-8", "replace").rstrip("\n"))
+
+async def run_one_batch(slot, params, cid, batch_games, lease=None):
+    """Run one lamb batch in slot. Returns False if lamb failed, True otherwise."""
+    output_file = make_output_filename()
+    output_path = OUTPUT_DIR / output_file
+    cmd = build_lamb_command(params, batch_games, output_path)
 
-    print(f"[DEBUG] Running command: {' '.join(cmd)}")
+    print(f"[DEBUG] Slot {slot['index']} running command: {' '.join(cmd)}")
 
+    record = new_batch_record(slot, params, batch_games, output_file, lease)
+    batch_started = mark = time.perf_counter()
     report_progress(cid, f"starting → {output_file}")
+    await run_blocking(spool_record, output_file, "running")
+    mark = add_phase(record, "report", mark)
+    slot.update(file=output_file, batch_games=batch_games, games=0, positions=0, preempted=False)
+    proc = None
+    sampler = None
+    upload_name = None
+    parsed = LambOutput()
+    lease_result = (0, 0)
+    heartbeat = asyncio.create_task(lease_heartbeat_loop(lease, parsed)) if lease else None
     try:
-        result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-        print(f"[DEBUG] lamb stdout: {result.stdout}")
-        print(f"[DEBUG] lamb stderr: {result.stderr}")
-
-        games, positions = parse_lamb_output(result.stdout)
-
-        # CHECK FOR .bin EXTENSION
-        output_path_bin = output_path.with_suffix('.bin')
-        if output_path_bin.exists():
-            print(f"[DEBUG] Found .bin file: {output_path_bin}")
-            report_progress(cid, f"finished → {games} games, {positions} pos", games, positions, output_path_bin.name)
-            upload_file_to_server(output_path_bin)
-        elif output_path.exists():
-            print(f"[DEBUG] Found file without extension: {output_path}")
-            report_progress(cid, f"finished → {games} games, {positions} pos", games, positions, output_path.name)
-            upload_file_to_server(output_path)
-        else:
-            print(f"[DEBUG] No output file found. Checking directory:")
-            for f in OUTPUT_DIR.glob("*"):
-                print(f"  - {f.name}")
-            report_progress(cid, f"finished but no file → {games} games, {positions} pos", games, positions)
+        stderr_tail = deque(maxlen=LAMB_TAIL_LINES)
+        started = time.monotonic()
+        last_report = started
+        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                    stderr=asyncio.subprocess.PIPE, limit=LAMB_LINE_LIMIT)
+        mark = run_started = add_phase(record, "launch", mark)
+        slot.update(proc=proc, pid=proc.pid)
+        sampler = asyncio.create_task(usage_sampler(record, proc.pid))
+        # Drain stderr alongside stdout so a chatty lamb can never block on a full pipe
+        stderr_reader = asyncio.create_task(_collect_lines(proc.stderr, stderr_tail))
+
+        parse_seconds = 0.0
+        async for raw in proc.stdout:
+            parse_started = time.perf_counter()
+            counts = parsed.feed(raw.decode("utf-8", "replace"))
+            parse_seconds += time.perf_counter() - parse_started
+            if not counts:
+                continue
+            slot.update(games=counts[0], positions=counts[1])
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_REPORT_INTERVAL:
+                rate = counts[1] / max(now - started, 1e-6)
+                # Totals are only counted by the final report, so live reports carry 0/0
+                report_progress(cid, f"running → {output_file}: {counts[0]}/{batch_games} games, "
+                                     f"{counts[1]} pos, {rate:.0f} pos/s")
+                last_report = now
+
+        # stdout closed: lamb is exiting, try for one last sample before it is reaped
+        sampler.cancel()
+        sample_usage(record, proc.pid)
+        returncode = await proc.wait()
+        mark = add_phase(record, "run", run_started)
+        # Parsing happened while lamb ran, so it is reported on its own, not subtracted from run
+        record["phases"]["parse"] = parse_seconds
+        await asyncio.wait_for(stderr_reader, timeout=5)
+        if stderr_tail:
+            print(f"[DEBUG] lamb stderr (tail): {' | '.join(stderr_tail)}")
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, stderr="\n".join(stderr_tail))
+
+        games, positions = parsed.result()
+        lease_result = (games, positions)
+        if slot.pop("preempted", False):
+            # lamb handled SIGTERM and exited cleanly, so its output ends on a whole record
+            record.update(outcome="preempted", games=games, positions=positions)
+            upload_name = await hand_off_output(cid, output_path, "preempted, salvaged", games, positions)
+            return True
+        record_batch_rate(slot["batch_rates"], games, positions, time.monotonic() - started)
+        record.update(outcome="finished", games=games, positions=positions)
+        upload_name = await hand_off_output(cid, output_path, "finished", games, positions)
+        return True
 
     except subprocess.CalledProcessError as e:
+        if slot.pop("preempted", False):
+            # Killed mid-write: the file may end inside a record, so it is never uploaded
+            record["outcome"] = "preempted"
+            report_progress(cid, f"preempted → {output_file}, partial output discarded", 0, 0, output_file)
+            await run_blocking(spool_record, output_file, "failed")
+            return True
         error = f"lamb failed: {e.returncode}\n{e.stderr[-200:]}"
         print(f"[DEBUG] lamb error: {error}")
+        record["outcome"] = "failed"
         report_progress(cid, error, 0, 0, output_file)
+        await run_blocking(spool_record, output_file, "failed")
+        return False
     except Exception as e:
         print(f"[DEBUG] Exception: {e}")
+        record["outcome"] = "error"
         # Include the command that failed in the error report
         report_progress(cid, f"error running command '{' '.join(cmd)}': {e}", 0, 0, output_file)
-
-# === Worker for multiprocessing ===
-def worker_task(current_params, cid):
-    """Run batches indefinitely, checking for new parameters each time"""
+        await run_blocking(spool_record, output_file, "failed")
+        return False
+    finally:
+        slot.update(proc=None, pid=None)
+        if sampler is not None:
+            sampler.cancel()
+        if heartbeat is not None:
+            heartbeat.cancel()
+        if proc is not None and proc.returncode is None:
+            # Only reached when the supervisor is cancelled (shutdown): stop lamb deterministically
+            await stop_process(proc)
+            mark = add_phase(record, "run", mark)
+        elif lease:
+            await run_blocking(finish_lease, lease, *lease_result)
+        mark = add_phase(record, "report", mark) # Final report, spool and lease bookkeeping
+        record["wall"] = mark - batch_started
+        finish_batch_record(record, upload_name)
+
+async def hand_off_output(cid, output_path, outcome, games, positions):
+    """Report a batch's output file and queue it for upload. Returns the queued file's name, if any."""
+    # CHECK FOR .bin EXTENSION
+    output_path_bin = output_path.with_suffix('.bin')
+    if output_path_bin.exists():
+        print(f"[DEBUG] Found .bin file: {output_path_bin}")
+        found = output_path_bin
+    elif output_path.exists():
+        print(f"[DEBUG] Found file without extension: {output_path}")
+        found = output_path
+    else:
+        print(f"[DEBUG] No output file found. Checking directory:")
+        for f in OUTPUT_DIR.glob("*"):
+            print(f"  - {f.name}")
+        report_progress(cid, f"{outcome} but no file → {games} games, {positions} pos", games, positions)
+        await run_blocking(spool_record, output_path.name, "missing")
+        return None
+    report_progress(cid, f"{outcome} → {games} games, {positions} pos", games, positions, found.name)
+    await run_blocking(spool_record, found.name, "pending")
+    submit_upload(found)
+    return found.name
+
+async def stop_process(proc):
+    """SIGTERM proc, then SIGKILL it if it has not exited after LAMB_STOP_TIMEOUT."""
+    proc.terminate()
+    try:
+        await asyncio.wait_for(proc.wait(), LAMB_STOP_TIMEOUT)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+
+# === Load-Aware Concurrency ===
+# The supervisor always has CONCURRENCY (= max) slots; concurrency_state["active"]
+# says how many may run lamb. A slot whose index is >= active parks before its
+# next batch, so scaling down never kills a running batch. With --concurrency
+# auto the main loop moves the active count one step at a time from
+# /proc/loadavg, CPU steal and MemAvailable; a server-side cap applies in every mode.
+CONCURRENCY_ADJUST_INTERVAL = 30 # Seconds between automatic steps
+LOAD_STEAL_HIGH = 10.0 # % CPU steal above which a worker is dropped
+LOAD_MEM_LOW_FRACTION = 0.10 # Drop a worker when MemAvailable falls below this share of MemTotal
+LOAD_MEM_PER_WORKER_KB = 256 * 1024 # Free memory wanted before adding a worker
+WORKER_PARK_POLL = 5 # Seconds a parked slot sleeps between checks
+
+_cpu_times = {"prev": None}
+# Auto mode starts from the core count; the controller takes it from there
+concurrency_state = {"active": max(MIN_CONCURRENCY, min(MAX_CONCURRENCY, CPU_COUNT)) if AUTO_CONCURRENCY
+                     else MAX_CONCURRENCY, "last_adjust": 0.0}
+
+def read_loadavg():
+    with open("/proc/loadavg") as f:
+        return float(f.read().split()[0])
+
+def read_steal_percent():
+    """CPU steal since the previous call, in percent of all CPU time (0 on the first call)."""
+    with open("/proc/stat") as f:
+        fields = [int(v) for v in f.readline().split()[1:]]
+    # user nice system idle iowait irq softirq steal [guest guest_nice]; guest time is already in user/nice
+    total, steal = sum(fields[:8]), fields[7] if len(fields) > 7 else 0
+    prev, _cpu_times["prev"] = _cpu_times["prev"], (total, steal)
+    if prev is None or total <= prev[0]:
+        return 0.0
+    return 100.0 * (steal - prev[1]) / (total - prev[0])
+
+def read_meminfo():
+    """Return (MemAvailable, MemTotal) in kB."""
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0])
+    return info["MemAvailable"], info["MemTotal"]
+
+def target_concurrency(current, cap=None):
+    """Return (workers, reason) for the next interval, within bounds and the server cap.
+
+    The operator's cap wins over --min-concurrency (and over a fixed --concurrency).
+    """
+    lower, upper = MIN_CONCURRENCY, MAX_CONCURRENCY
+    if cap:
+        lower, upper = min(lower, cap), min(upper, cap)
+    if not AUTO_CONCURRENCY:
+        return upper, "server cap" if cap and cap < MAX_CONCURRENCY else "fixed"
+    try:
+        load = read_loadavg()
+        steal = read_steal_percent()
+        mem_available, mem_total = read_meminfo()
+    except (OSError, ValueError, KeyError, IndexError):
+        return max(lower, min(upper, current)), "no /proc data"
+
+    # Our own lamb processes are part of the load average
+    other_load = max(0.0, load - current)
+    headroom = CPU_COUNT - other_load
+    if steal > LOAD_STEAL_HIGH:
+        target, reason = current - 1, f"steal {steal:.0f}%"
+    elif mem_available < mem_total * LOAD_MEM_LOW_FRACTION:
+        target, reason = current - 1, f"low memory ({mem_available // 1024} MB free)"
+    elif headroom < current - 0.5:
+        target, reason = current - 1, f"load {load:.1f} on {CPU_COUNT} cores"
+    elif headroom >= current + 1 and mem_available > LOAD_MEM_PER_WORKER_KB:
+        target, reason = current + 1, f"load {load:.1f} on {CPU_COUNT} cores"
+    else:
+        target, reason = current, "steady"
+    return max(lower, min(upper, target)), reason
+
+def adjust_concurrency(cid, cap=None):
+    """Main loop: move the active slot count toward target_concurrency. Returns the active count."""
+    current = concurrency_state["active"]
+    if cap == concurrency_state.get("cap") and AUTO_CONCURRENCY and \
+            time.monotonic() - concurrency_state["last_adjust"] < CONCURRENCY_ADJUST_INTERVAL:
+        return current
+    concurrency_state.update(cap=cap, last_adjust=time.monotonic())
+    target, reason = target_concurrency(current, cap)
+    if target != current:
+        concurrency_state["active"] = target
+        print(f"[+] Active workers {current} → {target} ({reason})")
+        report_progress(cid, f"workers {current} → {target} ({reason})")
+    return target
+
+# === Supervisor ===
+# One asyncio event loop, in its own thread, runs CONCURRENCY slots. Each slot
+# leases work, runs lamb with create_subprocess_exec and reads its output as it
+# arrives; a slot whose batch fails is restarted after an exponential backoff.
+# The main loop keeps polling the server and reads the slots' state for status
+# reports; stop_supervisor() cancels the slots, which terminates their lamb.
+SLOT_BACKOFF_BASE = 5 # Seconds; the jitter window doubles per consecutive failure
+SLOT_BACKOFF_MAX = 300
+
+slots = [] # One dict per slot: index, state, pid, proc, file, batch_games, games, positions, failures, batch_rates
+supervisor = {"loop": None, "task": None, "thread": None}
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the loop's default executor (asyncio.to_thread needs 3.9)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+def _new_slot(index):
+    return {"index": index, "state": "starting", "pid": None, "proc": None, "file": None,
+            "batch_games": 0, "games": 0, "positions": 0, "failures": 0, "batch_rates": new_batch_rates()}
+
+async def _slot_backoff(slot, cid, reason):
+    slot["failures"] += 1
+    # Never less than the base, so a lamb that fails instantly cannot spin
+    delay = SLOT_BACKOFF_BASE + backoff_delay(slot["failures"], base=SLOT_BACKOFF_BASE, cap=SLOT_BACKOFF_MAX)
+    slot["state"] = "backoff"
+    print(f"[!] Slot {slot['index']} {reason} ({slot['failures']} in a row), restarting in {delay:.0f}s")
+    report_progress(cid, f"slot {slot['index']} {reason}, restarting in {delay:.0f}s")
+    await asyncio.sleep(delay)
+
+async def run_slot(slot, cid, current_params):
+    """Run batches in one slot indefinitely, picking up the latest parameters each time"""
+    idle = False
     while True:
         try:
-            # Get latest parameters for this batch
-            # CORRECTED: Fetch 4 values
-            params, changed, restart_required, _ = fetch_parameters() # Ignore engine_hash here
-            if params is None:
-                # If fetch failed, use the current params
-                params = current_params
+            if slot["index"] >= concurrency_state["active"]:
+                slot["state"] = "parked" # By the concurrency controller
+                await asyncio.sleep(WORKER_PARK_POLL)
+                continue
+            if engine_swap["hash"]:
+                slot["state"] = "draining" # No new batch until the new engine is in place
+                await asyncio.sleep(1)
+                continue
+
+            params = read_parameters(current_params)
+            current_params = params
+
+            games = choose_batch_games(params, slot["batch_rates"])
+            slot["state"] = "leasing"
+            lease_started = time.perf_counter()
+            lease = await run_blocking(request_lease, cid, games)
+            slot["lease_seconds"] = time.perf_counter() - lease_started
+            if isinstance(lease, float):
+                slot["state"] = "idle"
+                if not idle:
+                    report_progress(cid, "idle → server has no work (job target reached)")
+                    idle = True
+                await asyncio.sleep(lease)
+                continue
+            idle = False
+            slot["state"] = "running"
+            if lease:
+                # A lease carries the parameters it was issued with and may trim the quota
+                ok = await run_one_batch(slot, lease.get("parameters") or params, cid, lease["games"], lease)
             else:
-                # Update our current params
-                current_params = params.copy()
-
-            run_one_batch(params, cid)
-            time.sleep(1)  # Brief pause between batches
+                ok = await run_one_batch(slot, params, cid, games)
+            if ok:
+                slot["failures"] = 0
+                await asyncio.sleep(1)  # Brief pause between batches
+            else:
+                await _slot_backoff(slot, cid, "batch failed")
         except Exception as e:
-            report_progress(cid, f"worker crash: {e}")
-            time.sleep(5)
+            await _slot_backoff(slot, cid, f"crashed: {e}")
+
+async def _supervise(cid, params):
+    supervisor["loop"] = asyncio.get_running_loop()
+    supervisor["task"] = asyncio.current_task()
+    # return_exceptions so a cancel waits for every slot to stop its lamb, not just the first
+    await asyncio.gather(*(run_slot(slot, cid, params) for slot in slots), return_exceptions=True)
+
+def _supervisor_thread(cid, params):
+    try:
+        asyncio.run(_supervise(cid, params))
+    except asyncio.CancelledError:
+        pass # stop_supervisor()
+    print("[*] Supervisor stopped")
+
+def start_supervisor(cid, params):
+    slots[:] = [_new_slot(i) for i in range(CONCURRENCY)]
+    supervisor["thread"] = threading.Thread(target=_supervisor_thread, args=(cid, params), name="supervisor",
+                                            daemon=True)
+    supervisor["thread"].start()
+
+def stop_supervisor(timeout=LAMB_STOP_TIMEOUT + 5):
+    """Cancel every slot (terminating running lamb processes) and wait for the supervisor."""
+    loop, task, thread = supervisor["loop"], supervisor["task"], supervisor["thread"]
+    if thread is None or not thread.is_alive() or loop is None:
+        return
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(timeout)
+
+def _preempt_running():
+    for slot in slots:
+        proc = slot["proc"]
+        if proc is not None and proc.returncode is None:
+            slot["preempted"] = True
+            proc.terminate()
+
+def preempt_slots():
+    """Terminate running lamb processes; their slots start over with the latest parameters.
+
+    Output is uploaded only if lamb exits cleanly on SIGTERM.
+    """
+    if supervisor["loop"] is not None:
+        supervisor["loop"].call_soon_threadsafe(_preempt_running)
+
+# === Engine Hot Swap ===
+# When the server advertises a new engine, slots stop starting batches
+# ("draining"). Once no slot is leasing or running lamb, the new binary is
+# downloaded and swapped in and the slots carry on with it. A preempt reload
+# stops the running batches first. The swap state is only touched on the
+# supervisor's event loop, so a slot can never start lamb halfway through a swap.
+ENGINE_SWAP_RETRY = 300 # Seconds before retrying after a failed engine download
+ENGINE_BUSY_STATES = ("leasing", "running")
+
+engine_swap = {"hash": None, "task": None, "retry_at": 0.0}
+
+def request_engine_swap(cid, new_hash, preempt=False):
+    """Main loop: have the supervisor swap in the engine with new_hash."""
+    loop = supervisor["loop"]
+    if loop is None or time.monotonic() < engine_swap["retry_at"]:
+        return
+    loop.call_soon_threadsafe(_begin_engine_swap, cid, new_hash, preempt)
+
+def _begin_engine_swap(cid, new_hash, preempt):
+    if preempt:
+        _preempt_running()
+    engine_swap["hash"] = new_hash # Latest wins if the server moved on again while draining
+    if engine_swap["task"] is None:
+        print(f"[+] New engine {new_hash[:16]}... on the server: {'preempting' if preempt else 'draining'} running batches")
+        report_progress(cid, f"engine update → {'preempting' if preempt else 'draining'} before swap")
+        engine_swap["task"] = asyncio.get_running_loop().create_task(_swap_engine(cid))
+
+async def _swap_engine(cid):
+    try:
+        while any(slot["state"] in ENGINE_BUSY_STATES for slot in slots):
+            await asyncio.sleep(1)
+        new_hash = engine_swap["hash"]
+        if await run_blocking(install_engine, new_hash):
+            print(f"[+] Engine swapped to {new_hash[:16]}... (version {ENGINE_VERSION})")
+            report_progress(cid, f"engine swapped → version {ENGINE_VERSION}")
+        else:
+            engine_swap["retry_at"] = time.monotonic() + ENGINE_SWAP_RETRY
+            print(f"[!] Engine swap failed; keeping the old binary, retrying in {ENGINE_SWAP_RETRY}s")
+            report_progress(cid, "engine swap failed → keeping old binary")
+    finally:
+        engine_swap.update(hash=None, task=None)
+
+def slot_summary():
+    """One-line state of every slot, for status reports."""
+    parts = []
+    for slot in slots:
+        part = f"{slot['index']}:{slot['state']}"
+        if slot["state"] == "running":
+            part += f" {slot['games']}/{slot['batch_games']}"
+        if slot["failures"]:
+            part += f" ({slot['failures']} failed)"
+        parts.append(part)
+    return ", ".join(parts)
 
 def cleanup_old_files(folder_path="data", max_size_gb=4, min_size_gb=2):
     """
@@ -477,6 +1732,18 @@ def cleanup_old_files(folder_path="data", max_size_gb=4, min_size_gb=2):
         if not folder.exists():
             return
 
+        # Output that will never be uploaded goes once its grace period is over
+        for name in spool_discardable():
+            file_path = folder / name
+            try:
+                if file_path.exists():
+                    file_size = file_path.stat().st_size
+                    file_path.unlink()
+                    print(f"[CLEANUP] Removed never-uploaded file: {name} ({file_size / (1024**2):.1f}MB)")
+                spool_forget(name)
+            except Exception as e:
+                print(f"[CLEANUP] Error removing {name}: {e}")
+
         # Get all .bin files with their modification times
         bin_files = [(f, f.stat().st_mtime) for f in folder.glob("*.bin")]
 
@@ -490,6 +1757,18 @@ def cleanup_old_files(folder_path="data", max_size_gb=4, min_size_gb=2):
 
         print(f"[CLEANUP] Current folder size: {total_size / (1024**3):.2f}GB")
 
+        # Space held by files the size limit may not delete, by spool state
+        states = spool_states()
+        pinned = {}
+        for file_path, _ in bin_files:
+            state = states.get(file_path.name, "untracked")
+            if state != "uploaded":
+                count, size = pinned.get(state, (0, 0))
+                pinned[state] = (count + 1, size + file_path.stat().st_size)
+        if pinned:
+            print("[CLEANUP] Pinned (not uploaded): " + ", ".join(
+                f"{state} {count} files {size / (1024**3):.2f}GB" for state, (count, size) in sorted(pinned.items())))
+
         # If under max size, do nothing
         if total_size <= max_size_bytes:
             return
@@ -497,23 +1776,32 @@ def cleanup_old_files(folder_path="data", max_size_gb=4, min_size_gb=2):
         # Sort files by modification time (oldest first)
         bin_files.sort(key=lambda x: x[1])
 
-        # Remove oldest files until we're below min size
+        # Remove oldest files until we're below min size, but only files the
+        # spool says the server already has
+        uploaded = {name for name, state in states.items() if state == "uploaded"}
         removed_count = 0
         removed_size = 0
+        skipped_count = 0
 
         for file_path, _ in bin_files:
             if total_size - removed_size <= min_size_bytes:
                 break
+            if file_path.name not in uploaded:
+                skipped_count += 1
+                continue
 
             file_size = file_path.stat().st_size
             try:
                 file_path.unlink()  # Delete the file
+                spool_forget(file_path.name)
                 removed_count += 1
                 removed_size += file_size
                 print(f"[CLEANUP] Removed old file: {file_path.name} ({file_size / (1024**2):.1f}MB)")
             except Exception as e:
                 print(f"[CLEANUP] Error removing {file_path.name}: {e}")
 
+        if skipped_count > 0:
+            print(f"[CLEANUP] Kept {skipped_count} old files that are not uploaded yet")
         if removed_count > 0:
             print(f"[CLEANUP] Removed {removed_count} files, freed {removed_size / (1024**3):.2f}GB")
             print(f"[CLEANUP] New folder size: {(total_size - removed_size) / (1024**3):.2f}GB")
@@ -523,7 +1811,10 @@ def cleanup_old_files(folder_path="data", max_size_gb=4, min_size_gb=2):
 
 # === Main Loop ===
 def main():
-    print(f"[*] Lamb Client [{COMP_NAME}] starting | Concurrency: {CONCURRENCY}")
+    if AUTO_CONCURRENCY:
+        print(f"[*] Lamb Client [{COMP_NAME}] starting | Concurrency: auto ({MIN_CONCURRENCY}-{MAX_CONCURRENCY}, {CPU_COUNT} cores)")
+    else:
+        print(f"[*] Lamb Client [{COMP_NAME}] starting | Concurrency: {CONCURRENCY}")
     print(f"[*] Engine Path: {LAMB_BINARY}")
 
     # ADD: Handle fresh registration flag
@@ -546,44 +1837,63 @@ def main():
 
     # Ensure the engine exists and is executable before proceeding
     ensure_engine_exists()
+    set_engine_version()
+    engine_in_use["server_hash"] = server_engine["hash"]
 
     cid = get_client_id() # This will register if the ID file was deleted or doesn't exist
+
+    init_spool()
+    start_reporter()
+    global upload_queue
+    upload_queue = queue.Queue()
+    start_uploaders(args.upload_concurrency)
+    print(f"[*] Started {args.upload_concurrency} background uploaders")
+    resume_spooled_uploads()
     current_params = None
-    pool = None
     cleanup_counter = 0
+    last_stats_log = time.monotonic()
+    last_batch_stats = time.monotonic()
+    last_requeue = time.monotonic()
 
     while True:
-        # CORRECTED: Fetch 4 values
-        params, changed, restart_required, _ = fetch_parameters() # Ignore engine_hash here
+        # Long poll: returns as soon as parameters change, or after POLL_INTERVAL.
+        # Startup already cached the parameters, so don't hold the first round.
+        poll_started = time.monotonic()
+        params, changed, restart_required, _ = fetch_parameters(wait=POLL_INTERVAL if slots else 0, cid=cid)
         if params is None:
             time.sleep(POLL_INTERVAL)
             continue
-
-        # If no workers running, start them with current parameters
-        if pool is None:
-            print(f"[+] Starting {CONCURRENCY} workers with {params['games']} games")
-            report_progress(cid, f"starting {CONCURRENCY} workers")
+        publish_parameters(params)
+        active = adjust_concurrency(cid, params_cache["concurrency_cap"])
+
+        # A new engine build on the server: swap it in once no lamb runs the old binary
+        if (slots and server_engine["hash"] and server_engine["hash"] != engine_in_use["server_hash"]
+                and params.get("engine_update_frequency", "always") != "never"):
+            request_engine_swap(cid, server_engine["hash"], preempt=restart_required)
+
+        # If no slots running yet, start them with current parameters
+        if not slots:
+            print(f"[+] Starting {active}/{CONCURRENCY} workers with {describe_batch_size(params)}")
+            report_progress(cid, f"starting {active} workers")
             current_params = params.copy()
+            start_supervisor(cid, current_params)
 
-            try:
-                pool = multiprocessing.Pool(processes=CONCURRENCY)
-                for i in range(CONCURRENCY):
-                    pool.apply_async(worker_task, (current_params, cid))
-                print(f"[DEBUG] Started {CONCURRENCY} workers")
-            except Exception as e:
-                print(f"[!] Error starting workers: {e}")
-                report_progress(cid, f"start error: {e}")
-                pool = None
+        # The server asked for running batches to be restarted with the new parameters
+        elif restart_required:
+            print(f"[+] Preempt reload requested by server: restarting running batches ({describe_batch_size(params)})")
+            report_progress(cid, f"restart requested → {describe_batch_size(params)} now")
+            current_params = params.copy()
+            preempt_slots()
 
         # If parameters changed but we have running workers, just update for next run
         elif changed and current_params != params:
-            print(f"[+] Parameters updated: {params['games']} games (will use after current batches)")
-            report_progress(cid, f"parameters updated → {params['games']} games next")
+            print(f"[+] Parameters updated: {describe_batch_size(params)} (will use after current batches)")
+            report_progress(cid, f"parameters updated → {describe_batch_size(params)} next")
             current_params = params.copy()
 
         else:
-            # Normal operation - workers are running
-            report_progress(cid, f"running {CONCURRENCY} workers")
+            # Normal operation - report what every slot is doing
+            report_progress(cid, f"running {active} workers | {slot_summary()}")
 
         # Run cleanup every N iterations
         cleanup_counter += 1
@@ -591,7 +1901,26 @@ def main():
             cleanup_old_files()
             cleanup_counter = 0
 
-        time.sleep(POLL_INTERVAL)
+        if time.monotonic() - last_stats_log >= HTTP_STATS_LOG_INTERVAL:
+            log_http_stats()
+            last_stats_log = time.monotonic()
+
+        if time.monotonic() - last_batch_stats >= BATCH_STATS_INTERVAL:
+            send_batch_stats(cid)
+            last_batch_stats = time.monotonic()
+
+        if time.monotonic() - last_requeue >= SPOOL_REQUEUE_INTERVAL:
+            try:
+                requeued = requeue_pending_uploads()
+            except sqlite3.Error as e:
+                print(f"[!] Spool journal error while re-submitting pending uploads: {e}")
+            else:
+                if requeued:
+                    print(f"[SPOOL] Re-submitted {requeued} pending uploads")
+            last_requeue = time.monotonic()
+
+        # Keep a steady cadence when the server answers at once (older servers, or a change)
+        time.sleep(max(0, POLL_INTERVAL - (time.monotonic() - poll_started)))
 
 # === Entry Point ===
 if __name__ == "__main__":
@@ -601,3 +1930,6 @@ if __name__ == "__main__":
         main()
     except KeyboardInterrupt:
         print("\n[!] Client stopped by user")
+    finally:
+        stop_supervisor()
+        stop_reporter()
@@ -1,12 +1,30 @@
 # server.py
-from flask import Flask, request, jsonify, render_template_string, send_from_directory
+from flask import Flask, Response, request, jsonify, render_template_string, send_from_directory, send_file
+from werkzeug.utils import secure_filename
 import uuid
+import json
 import datetime
 import os
 import sqlite3
 from pathlib import Path
 import threading # Import threading for lock
 import hashlib # Import hashlib for file hashing
+import queue
+import atexit
+import signal
+import sys
+import time
+import zlib
+import math
+import re
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    import zstandard as zstd # Optional: enables zstd-compressed uploads
+except ImportError:
+    zstd = None
 
 app = Flask(__name__)
 
@@ -14,7 +32,11 @@ app = Flask(__name__)
 DB_PATH = "server_data/progress.db"
 GAMES_DIR = "server_data/games"
 LAMB_BINARY_PATH = Path("lambergar") # Define the path to the lambergar binary
+OBJECTS_DIR = "server_data/objects" # Uploaded files, stored once by SHA256
+INCOMING_DIR = "server_data/incoming" # Partial uploads, same filesystem as OBJECTS_DIR for atomic renames
 Path(GAMES_DIR).mkdir(parents=True, exist_ok=True)
+Path(OBJECTS_DIR).mkdir(parents=True, exist_ok=True)
+Path(INCOMING_DIR).mkdir(parents=True, exist_ok=True)
 
 # === In-memory state ===
 clients = {}
@@ -30,6 +52,16 @@ parameters = {
     "random_move_count": 6,
     "skipnoisy": True,
 
+    # Batch sizing: "fixed" runs `games` per batch; "adaptive" lets each client
+    # size its batches to last about target_batch_seconds, within min/max games
+    "batch_mode": "fixed",
+    "target_batch_seconds": 300,
+    "min_games": 10,
+    "max_games": 5000,
+
+    # Job size: stop handing out leases once this many positions are done (0 = no limit)
+    "target_positions": 0,
+
     # Future parameters (GREYED OUT)
     "standard_start_pos_prob": 0.40,
     "frc_start_pos_prob": 0.33,
@@ -40,64 +72,302 @@ parameters = {
     # NEW: Engine update parameter
     "engine_update_frequency": "always" # Options: "always", "once_a_day", "never"
 }
-parameters_changed = True
-restart_required = False
-
-# === Recent Progress Tracking ===
-# List of tuples: (timestamp, client_id, positions_reported)
-# Use a lock to protect access from multiple threads
-recent_progress = []
-progress_lock = threading.Lock()
-
-# === Engine Hash Caching ===
-# Cache the hash and the time it was calculated to avoid re-hashing every request
-cached_engine_hash = None
-cached_hash_time = None
-HASH_CACHE_DURATION = datetime.timedelta(minutes=5) # Cache for 5 minutes
-
-def get_engine_hash():
-    """Calculate and return the SHA256 hash of the lamb binary, with caching."""
-    global cached_engine_hash, cached_hash_time
-    now = datetime.datetime.now(datetime.timezone.utc)
-
-    # Check if cache is still valid
-    if (cached_engine_hash and cached_hash_time and
-        now - cached_hash_time < HASH_CACHE_DURATION):
-        print(f"[SERVER DEBUG] Using cached engine hash.")
-        return cached_engine_hash
-
-    print(f"[SERVER DEBUG] Calculating engine hash for {LAMB_BINARY_PATH}...")
-    if not LAMB_BINARY_PATH.exists() or not LAMB_BINARY_PATH.is_file():
-        print(f"[SERVER DEBUG] Engine binary {LAMB_BINARY_PATH} not found.")
-        return None
+# Every change to parameters (or to the engine) bumps parameters_version; clients
+# send the version they have, so each one sees every change exactly once.
+# A change is applied either "drain" (running batches finish on the old settings)
+# or "preempt" (clients stop running batches, keep their output if lamb exits
+# cleanly, and restart on the new settings); restart_required_version is the last preempt.
+parameters_version = 1
+restart_required_version = 0 # parameters_version at which a restart was last requested
+RELOAD_MODES = ("drain", "preempt")
+parameters_cond = threading.Condition() # Notified on every change; wakes long polls
+PARAMETERS_MAX_WAIT = 60 # Longest a long-poll GET /parameters is held, in seconds
+# Per-client cap on concurrent lamb workers (client_id -> cap), set from the
+# dashboard and returned by /parameters?client_id=... Guarded by parameters_cond.
+client_caps = {}
+
+def bump_parameters_version(restart=False):
+    global parameters_version, restart_required_version
+    with parameters_cond:
+        parameters_version += 1
+        if restart:
+            restart_required_version = parameters_version
+        parameters_cond.notify_all()
+
+# === Metrics ===
+# Counters and histograms for GET /metrics (Prometheus text format). Updates go
+# to one of METRIC_SHARDS dicts picked by a hash of the thread id, each with its own lock, so
+# request threads almost never wait on each other; a scrape sums the shards.
+# Gauges are read from the live state when /metrics is scraped.
+METRIC_SHARDS = 16
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRICS = { # name -> (type, help, histogram buckets)
+    "lamb_http_requests_total": ("counter", "HTTP requests by route, method and status", None),
+    "lamb_http_request_duration_seconds": ("histogram", "HTTP request latency by route and method", LATENCY_BUCKETS),
+    "lamb_progress_events_total": ("counter", "Progress events accepted for ingest", None),
+    "lamb_positions_reported_total": ("counter", "Positions reported by clients", None),
+    "lamb_db_commit_duration_seconds": ("histogram", "Ingest transaction commit latency",
+                                        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)),
+    "lamb_upload_bytes_total": ("counter", "Upload bytes received on the wire, by encoding", None),
+    "lamb_upload_raw_bytes_total": ("counter", "Uncompressed bytes of stored uploads", None),
+    "lamb_uploads_total": ("counter", "Finished uploads by result", None),
+    "lamb_upload_duration_seconds": ("histogram", "Time from /upload/init to a successful finalize",
+                                     (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)),
+    "lamb_engine_hashes_total": ("counter", "Times the engine binary was (re)hashed", None),
+}
+_metric_shards = [({}, threading.Lock()) for _ in range(METRIC_SHARDS)]
+
+def _metric_shard():
+    # Thread idents are stack addresses, page aligned and a fixed stride apart, so
+    # their low bits barely vary; drop the page offset and Fibonacci-hash the rest.
+    page = threading.get_ident() >> 12
+    return _metric_shards[((page * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) * METRIC_SHARDS >> 64]
+
+def metric_inc(name, labels=(), value=1):
+    """Add value to counter name; labels is a tuple of (label, value) pairs."""
+    values, lock = _metric_shard()
+    key = (name, labels)
+    with lock:
+        values[key] = values.get(key, 0) + value
+
+def metric_observe(name, value, labels=()):
+    """Record value in histogram name."""
+    buckets = METRICS[name][2]
+    values, lock = _metric_shard()
+    key = (name, labels)
+    with lock:
+        counts = values.get(key)
+        if counts is None:
+            counts = values[key] = [0] * (len(buckets) + 2) # One per bucket, +Inf, then the sum
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+
+def _metric_totals():
+    """Sum every shard into {(name, labels): total or histogram counts}."""
+    totals = {}
+    for values, lock in _metric_shards:
+        with lock:
+            items = [(key, list(v) if isinstance(v, list) else v) for key, v in values.items()]
+        for key, v in items:
+            if isinstance(v, list):
+                merged = totals.setdefault(key, [0] * len(v))
+                for i, x in enumerate(v):
+                    merged[i] += x
+            else:
+                totals[key] = totals.get(key, 0) + v
+    return totals
+
+def _metric_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def render_metrics(gauges, counters=()):
+    """Prometheus text exposition of the collected metrics plus gauges and counters
+    read from live state, each [(name, help, [(labels, value)])]."""
+    by_name = {}
+    for (name, labels), value in _metric_totals().items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        for labels, value in sorted(by_name.get(name, [])):
+            if kind != "histogram":
+                lines.append(f"{name}{_metric_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_metric_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_metric_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{_metric_labels(labels)} {cumulative}")
+    for kind, entries in (("gauge", gauges), ("counter", counters)):
+        for name, help_text, samples in entries:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_metric_labels(labels)} {value}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
+
+# === Throughput Windows ===
+# Reported positions are added to fixed-size rings of per-second and per-minute
+# buckets, one set for the whole fleet and one per client. Ingest is O(1) and a
+# rate over any window is a sum over at most one ring, whatever the report rate.
+RATE_WINDOWS = {"1m": 60, "15m": 15 * 60, "1h": 60 * 60, "24h": 24 * 60 * 60}
+CLIENT_RATE_WINDOW = 15 * 60 # Window behind the per-client pos/s column; batches report in bursts
+CLIENT_BUCKET_SECONDS = 10
+
+class BucketRing:
+    """Position counts in `size` buckets of `width` seconds, reused round-robin."""
+    def __init__(self, width, size):
+        self.width = width
+        self.counts = [0] * size
+        self.slots = [-1] * size # Absolute bucket number each entry currently holds
+
+    def add(self, now, positions):
+        bucket = int(now // self.width)
+        i = bucket % len(self.counts)
+        if self.slots[i] > bucket:
+            return # Older than the ring reaches back
+        if self.slots[i] != bucket:
+            self.slots[i] = bucket
+            self.counts[i] = 0
+        self.counts[i] += positions
+
+    def total(self, now, seconds):
+        """Positions in the buckets covering the last `seconds` (the current bucket included)."""
+        newest = int(now // self.width)
+        oldest = newest - min(len(self.counts), math.ceil(seconds / self.width)) + 1
+        return sum(count for count, bucket in zip(self.counts, self.slots) if oldest <= bucket <= newest)
+
+class Throughput:
+    """Per-second buckets for windows up to `second_buckets` seconds, per-minute buckets beyond."""
+    def __init__(self, second_buckets, minute_buckets):
+        self.seconds = BucketRing(1, second_buckets)
+        self.minutes = BucketRing(60, minute_buckets)
+
+    def add(self, now, positions):
+        self.seconds.add(now, positions)
+        self.minutes.add(now, positions)
+
+    def total(self, now, seconds):
+        ring = self.seconds if seconds <= len(self.seconds.counts) else self.minutes
+        return ring.total(now, seconds)
+
+throughput_lock = threading.Lock()
+fleet_throughput = Throughput(15 * 60, 24 * 60)
+client_throughput = {} # client_id -> BucketRing of CLIENT_BUCKET_SECONDS buckets covering CLIENT_RATE_WINDOW
 
+# === SQLite DB ===
+# One long-lived writer connection (serialized by a lock) plus a small pool of
+# reader connections. WAL mode lets readers run alongside the writer, so the
+# dashboard and debug pages never block progress ingest.
+DB_READ_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHE_SIZE_KB = 20000 # Page cache per connection
+DB_STATEMENT_CACHE = 128 # Prepared statements kept per connection
+DB_WRITE_RETRIES = 3
+
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL", # Safe with WAL; only the last commits are at risk on power loss
+    f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+db_write_lock = threading.Lock()
+_db_writer = None
+_db_read_pool = queue.LifoQueue()
+_db_read_pool_lock = threading.Lock()
+_db_read_pool_created = 0
+
+def _open_db_connection():
+    """Open a tuned connection to DB_PATH. Connections are shared across threads, never concurrently."""
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def _is_busy_error(e):
+    msg = str(e).lower()
+    return "locked" in msg or "busy" in msg
+
+@contextmanager
+def db_read():
+    """Borrow a reader connection from the pool for the duration of the block."""
+    global _db_read_pool_created
     try:
-        with open(LAMB_BINARY_PATH, "rb") as f:
-            file_hash = hashlib.sha256()
-            # Read the file in chunks to handle large binaries efficiently
-            for chunk in iter(lambda: f.read(4096), b""):
-                file_hash.update(chunk)
-        calculated_hash = file_hash.hexdigest()
-        print(f"[SERVER DEBUG] Calculated engine hash: {calculated_hash[:16]}...")
-
-        # Update the cache
-        cached_engine_hash = calculated_hash
-        cached_hash_time = now
-        return calculated_hash
-    except Exception as e:
-        print(f"[SERVER DEBUG] Error calculating engine hash: {e}")
-        return None
+        conn = _db_read_pool.get_nowait()
+    except queue.Empty:
+        conn = None
+        with _db_read_pool_lock:
+            if _db_read_pool_created < DB_READ_POOL_SIZE:
+                _db_read_pool_created += 1
+                conn = _open_db_connection()
+        if conn is None:
+            conn = _db_read_pool.get() # Pool exhausted: wait for a connection to come back
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+        _db_read_pool.put(conn)
+
+def db_write(work):
+    """Run work(conn) in a single transaction on the writer connection and return its result.
+
+    Writes are serialized in-process, so SQLITE_BUSY can only come from another
+    process holding the database; those are retried with a short backoff.
+    """
+    global _db_writer
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            with db_write_lock:
+                if _db_writer is None:
+                    _db_writer = _open_db_connection()
+                with _db_writer: # Commits on success, rolls back on exception
+                    return work(_db_writer)
+        except sqlite3.OperationalError as e:
+            if not _is_busy_error(e) or attempt == DB_WRITE_RETRIES:
+                raise
+            print(f"[SERVER DEBUG] DB busy, retrying write ({attempt + 1}/{DB_WRITE_RETRIES}): {e}")
+            time.sleep(0.05 * (2 ** attempt))
+
+# Statements are kept as module constants so every connection's statement
+# cache reuses the same prepared statement instead of re-parsing the SQL.
+SQL_UPSERT_CLIENT = """
+    INSERT OR REPLACE INTO clients (client_id, name, ip, last_seen)
+    VALUES (?, ?, ?, ?)
+"""
+SQL_INSERT_RUN = """
+    INSERT INTO runs (client_id, output_file, games_completed, positions_completed, status, timestamp, engine_version)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_INSERT_ENGINE_VERSION = """
+    INSERT OR IGNORE INTO engine_versions (sha256, size, first_seen) VALUES (?, ?, ?)
+"""
+SQL_LOOKUP_ENGINE_VERSION = "SELECT id FROM engine_versions WHERE sha256 = ?"
+
+SQL_UPSERT_CLIENT_STATS = """
+    INSERT INTO client_stats (client_id, total_games, total_positions, latest_status, latest_file, updated)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(client_id) DO UPDATE SET
+        total_games = total_games + excluded.total_games,
+        total_positions = total_positions + excluded.total_positions,
+        latest_status = excluded.latest_status,
+        latest_file = COALESCE(excluded.latest_file, client_stats.latest_file),
+        updated = excluded.updated
+"""
+SQL_BACKFILL_CLIENT_STATS = """
+    INSERT INTO client_stats (client_id, total_games, total_positions, latest_status, latest_file, updated)
+    SELECT
+        r.client_id,
+        SUM(r.games_completed),
+        SUM(r.positions_completed),
+        (SELECT r2.status FROM runs r2 WHERE r2.client_id = r.client_id
+         ORDER BY r2.timestamp DESC, r2.id DESC LIMIT 1),
+        (SELECT r2.output_file FROM runs r2 WHERE r2.client_id = r.client_id AND r2.output_file IS NOT NULL
+         ORDER BY r2.timestamp DESC, r2.id DESC LIMIT 1),
+        MAX(r.timestamp)
+    FROM runs r
+    WHERE r.client_id IS NOT NULL
+    GROUP BY r.client_id
+"""
 
-# === SQLite DB ===
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.executescript(f"""
+# === Schema Migrations ===
+# The schema version lives in PRAGMA user_version. Each migration runs once,
+# in order, inside its own transaction together with the version bump, so an
+# existing progress.db is upgraded in place at startup instead of recreated.
+def _migration_base_schema(conn):
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS clients (
         client_id TEXT PRIMARY KEY,
         name TEXT,
         ip TEXT,
         last_seen TEXT
-    );
+    )""")
+    conn.execute("""
     CREATE TABLE IF NOT EXISTS runs (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         client_id TEXT,
@@ -107,75 +377,394 @@ def init_db():
         status TEXT,
         timestamp TEXT,
         FOREIGN KEY(client_id) REFERENCES clients(client_id)
-    );
-    """)
-    conn.commit()
-    conn.close()
+    )""")
+
+def _migration_runs_indexes(conn):
+    # Per-client history, newest first; also covers the latest status/file
+    # lookups used when rebuilding client_stats
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_runs_client_timestamp
+                    ON runs(client_id, timestamp, status, output_file)""")
+    # /debug_db and /debug_db_full: ORDER BY timestamp DESC LIMIT n
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_timestamp ON runs(timestamp)")
+    # Looking up the run that produced a given file
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_output_file ON runs(output_file)")
+    # Dashboard ordering
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_clients_last_seen ON clients(last_seen)")
+
+def _migration_client_stats(conn):
+    # Running totals per client, kept up to date by save_runs_to_db so the
+    # dashboard never has to aggregate the whole runs table
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS client_stats (
+        client_id TEXT PRIMARY KEY,
+        total_games INTEGER DEFAULT 0,
+        total_positions INTEGER DEFAULT 0,
+        latest_status TEXT,
+        latest_file TEXT,
+        updated TEXT
+    )""")
+    if conn.execute("SELECT 1 FROM client_stats LIMIT 1").fetchone() is None:
+        conn.execute(SQL_BACKFILL_CLIENT_STATS)
+
+def _migration_files_index(conn):
+    # Uploaded file name -> content hash of the object in OBJECTS_DIR
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS files (
+        name TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        size INTEGER,
+        client_id TEXT,
+        stored_at TEXT
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256)")
+
+def _migration_engine_versions(conn):
+    # Every distinct engine binary the server has served; the id is its version
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS engine_versions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sha256 TEXT UNIQUE NOT NULL,
+        size INTEGER,
+        first_seen TEXT
+    )""")
+    conn.execute("ALTER TABLE runs ADD COLUMN engine_version INTEGER REFERENCES engine_versions(id)")
+
+def _migration_work_leases(conn):
+    # Jobs toward a target_positions (the newest row is the current job) and
+    # every lease handed out, so job progress survives a restart and a lease id
+    # is credited once however often it is completed. Times are Unix seconds.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        target INTEGER NOT NULL,
+        started REAL NOT NULL,
+        games INTEGER DEFAULT 0,
+        positions INTEGER DEFAULT 0,
+        issued INTEGER DEFAULT 0,
+        completed INTEGER DEFAULT 0,
+        reclaimed INTEGER DEFAULT 0
+    )""")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS leases (
+        lease_id TEXT PRIMARY KEY,
+        job_id INTEGER REFERENCES jobs(id),
+        client_id TEXT,
+        games INTEGER,
+        parameters TEXT,
+        version INTEGER,
+        issued REAL,
+        status TEXT, -- active, expired or completed
+        finished REAL,
+        positions INTEGER DEFAULT 0 -- Credited to the job on completion
+    )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_leases_status_finished ON leases(status, finished)")
+
+# (version, description, function) - append only, never renumber
+MIGRATIONS = [
+    (1, "base clients/runs schema", _migration_base_schema),
+    (2, "indexes on runs and clients", _migration_runs_indexes),
+    (3, "client_stats summary table", _migration_client_stats),
+    (4, "files name-to-hash index", _migration_files_index),
+    (5, "engine versions", _migration_engine_versions),
+    (6, "jobs and work leases", _migration_work_leases),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """Bring the database up to SCHEMA_VERSION by applying pending migrations."""
+    with db_read() as conn:
+        current = get_schema_version(conn)
+    if current > SCHEMA_VERSION:
+        print(f"[SERVER] WARNING: DB schema version {current} is newer than this server ({SCHEMA_VERSION})")
+        return
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+
+        def apply(conn):
+            # DDL does not open an implicit transaction, so start one explicitly
+            # to make the migration and its version bump atomic
+            conn.execute("BEGIN IMMEDIATE")
+            migrate(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+
+        print(f"[SERVER] Applying DB migration {version}: {description}")
+        db_write(apply)
 
 init_db()
 
-def save_run_to_db(client_id, output_file, games, positions, status):
-    print(f"[SERVER DEBUG] Saving to DB: client={client_id}, games={games}, positions={positions}, file={output_file}")
+def save_runs_to_db(rows):
+    """Write a batch of progress rows in one transaction.
+
+    Each row is (client_id, name, ip, output_file, games, positions, status, timestamp, engine_version).
+    """
+    # Only the newest clients row per client matters within a batch
+    client_rows = {row[0]: (row[0], row[1], row[2], row[7]) for row in rows}
+    run_rows = [(row[0], row[3], row[4], row[5], row[6], row[7], row[8]) for row in rows]
+
+    # Fold the batch into one client_stats delta per client (rows arrive in order)
+    stats = {}
+    for client_id, _, _, output_file, games, positions, status, timestamp, _ in rows:
+        delta = stats.setdefault(client_id, [client_id, 0, 0, None, None, None])
+        delta[1] += games
+        delta[2] += positions
+        delta[3] = status
+        if output_file is not None:
+            delta[4] = output_file
+        delta[5] = timestamp
+
+    def write(conn):
+        conn.executemany(SQL_UPSERT_CLIENT, client_rows.values())
+        conn.executemany(SQL_INSERT_RUN, run_rows)
+        conn.executemany(SQL_UPSERT_CLIENT_STATS, stats.values())
+
+    db_write(write)
+
+# === Progress Ingest Queue ===
+# /progress only validates and enqueues; a single writer thread drains the
+# queue and group-commits rows, so HTTP handlers never wait on an fsync.
+# Each queue item is a list of rows from one request, so a /progress_batch
+# request always lands in a single transaction.
+INGEST_QUEUE_MAX = 10000 # Requests held in memory before /progress answers 503
+INGEST_BATCH_MAX_ROWS = 500 # Commit once this many rows are pending...
+INGEST_FLUSH_INTERVAL = 0.2 # ...or this many seconds after the first pending row
+INGEST_COMMIT_RETRIES = 5
+
+ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_MAX)
+_INGEST_STOP = object()
+ingest_stats_lock = threading.Lock()
+ingest_stats = {
+    "accepted": 0,
+    "rejected": 0,
+    "committed_rows": 0,
+    "batches": 0,
+    "failed_batches": 0,
+    "last_commit_ms": 0.0,
+    "max_commit_ms": 0.0,
+    "total_commit_ms": 0.0,
+}
 
+def enqueue_runs(rows):
+    """Queue progress rows for the writer thread as one unit. Returns False if the queue is full."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        ingest_queue.put_nowait(list(rows))
+    except queue.Full:
+        with ingest_stats_lock:
+            ingest_stats["rejected"] += len(rows)
+        return False
+    with ingest_stats_lock:
+        ingest_stats["accepted"] += len(rows)
+    metric_inc("lamb_progress_events_total", value=len(rows))
+    return True
+
+def _commit_ingest_batch(batch):
+    for attempt in range(INGEST_COMMIT_RETRIES):
+        start = time.perf_counter()
+        try:
+            save_runs_to_db(batch)
+        except Exception as e:
+            print(f"[SERVER DEBUG] ERROR committing {len(batch)} progress rows (attempt {attempt + 1}): {e}")
+            time.sleep(0.5 * (attempt + 1))
+            continue
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        metric_observe("lamb_db_commit_duration_seconds", elapsed_ms / 1000)
+        with ingest_stats_lock:
+            ingest_stats["committed_rows"] += len(batch)
+            ingest_stats["batches"] += 1
+            ingest_stats["last_commit_ms"] = elapsed_ms
+            ingest_stats["max_commit_ms"] = max(ingest_stats["max_commit_ms"], elapsed_ms)
+            ingest_stats["total_commit_ms"] += elapsed_ms
+        return
+    with ingest_stats_lock:
+        ingest_stats["failed_batches"] += 1
+    print(f"[SERVER DEBUG] ERROR: dropped {len(batch)} progress rows after {INGEST_COMMIT_RETRIES} attempts")
+
+def ingest_writer_loop():
+    """Drain ingest_queue, committing up to INGEST_BATCH_MAX_ROWS rows per transaction."""
+    stopping = False
+    while not stopping:
+        item = ingest_queue.get()
+        if item is _INGEST_STOP:
+            break
+        batch = list(item)
+        deadline = time.monotonic() + INGEST_FLUSH_INTERVAL
+        while len(batch) < INGEST_BATCH_MAX_ROWS:
+            remaining = deadline - time.monotonic()
+            try:
+                item = ingest_queue.get(timeout=remaining) if remaining > 0 else ingest_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _INGEST_STOP:
+                stopping = True
+                break
+            batch.extend(item)
+        _commit_ingest_batch(batch)
+
+    # Flush whatever was accepted before shutdown was requested
+    leftover = []
+    while True:
+        try:
+            item = ingest_queue.get_nowait()
+        except queue.Empty:
+            break
+        if item is not _INGEST_STOP:
+            leftover.extend(item)
+    for i in range(0, len(leftover), INGEST_BATCH_MAX_ROWS):
+        _commit_ingest_batch(leftover[i:i + INGEST_BATCH_MAX_ROWS])
+    print(f"[SERVER] Ingest writer stopped ({ingest_stats['committed_rows']} rows committed)")
+
+ingest_writer = threading.Thread(target=ingest_writer_loop, name="ingest-writer", daemon=True)
+ingest_writer.start()
+
+def stop_ingest_writer(timeout=30):
+    """Ask the writer to flush everything queued so far and wait for it to finish."""
+    if not ingest_writer.is_alive():
+        return
+    ingest_queue.put(_INGEST_STOP)
+    ingest_writer.join(timeout)
+
+atexit.register(stop_ingest_writer)
+
+def get_ingest_stats():
+    with ingest_stats_lock:
+        stats = dict(ingest_stats)
+    stats["queue_depth"] = ingest_queue.qsize()
+    stats["avg_commit_ms"] = stats["total_commit_ms"] / stats["batches"] if stats["batches"] else 0.0
+    return stats
+
+# === Engine Tracking ===
+# The engine hash is computed once at startup and again only when the binary's
+# (mtime, size, inode) changes or POST /reload_engine asks for it. A watcher
+# thread does the stat() polling and hashing, so other requests just read
+# engine_state; refreshes are serialized by engine_refresh_lock. Every distinct
+# binary gets a row in engine_versions; its id is the engine version clients
+# report and runs are stored with.
+ENGINE_WATCH_INTERVAL = 2 # Seconds between stat() checks of the binary
+
+engine_lock = threading.Lock()
+engine_state = {"hash": None, "version": None, "size": None, "loaded_at": None}
+_engine_stat = None # (mtime_ns, size, inode) of the binary engine_state describes
+_engine_preempted_version = None # Last engine version published with restart=True
+engine_refresh_lock = threading.Lock() # One refresh at a time, watcher or /reload_engine
+
+def _stat_engine():
+    try:
+        st = os.stat(LAMB_BINARY_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
 
-        # Check if client exists in clients dict
-        if client_id not in clients:
-            print(f"[SERVER DEBUG] ERROR: Client {client_id} not found in clients dict!")
-            return
+def _register_engine_version(sha256, size):
+    """Return the engine_versions id for sha256, adding a row the first time it is seen."""
+    first_seen = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    def write(conn):
+        conn.execute(SQL_INSERT_ENGINE_VERSION, (sha256, size, first_seen))
+        return conn.execute(SQL_LOOKUP_ENGINE_VERSION, (sha256,)).fetchone()[0]
+
+    return db_write(write)
 
-        cursor.execute("""
-            INSERT OR REPLACE INTO clients (client_id, name, ip, last_seen)
-            VALUES (?, ?, ?, ?)
-        """, (
-            client_id, clients[client_id]["name"], clients[client_id]["ip"],
-            datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        ))
-
-        cursor.execute("""
-            INSERT INTO runs (client_id, output_file, games_completed, positions_completed, status, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            client_id, output_file, games, positions, status,
-            datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        ))
-
-        conn.commit()
-        print(f"[SERVER DEBUG] Successfully saved to DB: {cursor.rowcount} rows affected")
-        conn.close()
-
-    except Exception as e:
-        print(f"[SERVER DEBUG] ERROR saving to DB: {e}")
+def refresh_engine(force=False, mode="drain"):
+    """Rehash the engine binary if it changed on disk (or if force). Returns True if a version was published.
+
+    mode (see RELOAD_MODES) is how clients apply a changed binary. A forced
+    preempt also republishes a binary the watcher already announced as drain.
+    """
+    with engine_refresh_lock:
+        return _refresh_engine(force, mode)
+
+def _refresh_engine(force, mode):
+    global _engine_stat, _engine_preempted_version
+    stat = _stat_engine()
+    if stat == _engine_stat and not force:
+        return False
+
+    if stat is None:
+        new_state = {"hash": None, "version": None, "size": None}
+        print(f"[SERVER] Engine binary {LAMB_BINARY_PATH} not found.")
+    else:
+        try:
+            file_hash = hashlib.sha256()
+            with open(LAMB_BINARY_PATH, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    file_hash.update(chunk)
+        except OSError as e:
+            print(f"[SERVER] Error hashing engine binary: {e}")
+            return False
+        metric_inc("lamb_engine_hashes_total")
+        if _stat_engine() != stat:
+            return False # Binary is still being written; try again on the next tick
+        sha256 = file_hash.hexdigest()
+        new_state = {"hash": sha256, "version": _register_engine_version(sha256, stat[1]), "size": stat[1]}
+
+    changed = new_state["hash"] != engine_state["hash"]
+    # The watcher usually sees a new build first and publishes it as drain;
+    # POST /reload_engine?mode=preempt must still be able to stop running batches
+    preempt = mode == "preempt" and new_state["hash"] is not None and \
+        (changed or (force and _engine_preempted_version != new_state["version"]))
+    with engine_lock:
+        engine_state.update(new_state)
+        engine_state["loaded_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        _engine_stat = stat
+    if changed and new_state["hash"]:
+        print(f"[SERVER] Engine version {new_state['version']}: {new_state['hash'][:16]}... ({new_state['size']} bytes)")
+    elif preempt:
+        print(f"[SERVER] Engine version {new_state['version']} republished for preempt")
+    if changed or preempt:
+        # A version bump wakes long polls; clients swap the binary once their lamb processes are done
+        bump_parameters_version(restart=preempt)
+        if preempt:
+            _engine_preempted_version = new_state["version"]
+    return changed or preempt
+
+def engine_watch_loop():
+    while True:
+        time.sleep(ENGINE_WATCH_INTERVAL)
+        try:
+            refresh_engine()
+        except Exception as e:
+            print(f"[SERVER] Engine watcher error: {e}")
+
+def get_engine_hash():
+    """SHA256 of the current lamb binary (None if missing). Never touches the disk."""
+    return engine_state["hash"]
+
+def get_engine_info():
+    with engine_lock:
+        return dict(engine_state)
+
+refresh_engine()
+threading.Thread(target=engine_watch_loop, name="engine-watcher", daemon=True).start()
+
+SQL_LOOKUP_FILE = "SELECT sha256, size FROM files WHERE name = ?"
+SQL_INSERT_FILE = """
+    INSERT OR IGNORE INTO files (name, sha256, size, client_id, stored_at)
+    VALUES (?, ?, ?, ?, ?)
+"""
+
+SQL_LATEST_RUNS = """
+    SELECT
+        c.client_id,
+        c.name,
+        c.ip,
+        c.last_seen,
+        COALESCE(s.total_games, 0) as total_games,
+        COALESCE(s.total_positions, 0) as total_positions,
+        s.latest_status,
+        s.latest_file
+    FROM clients c
+    LEFT JOIN client_stats s ON s.client_id = c.client_id
+    ORDER BY c.last_seen DESC
+"""
 
 def get_latest_runs():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Get cumulative totals per client with latest status
-    cursor.execute("""
-        SELECT
-            c.client_id,
-            c.name,
-            c.ip,
-            c.last_seen,
-            COALESCE(SUM(r.games_completed), 0) as total_games,
-            COALESCE(SUM(r.positions_completed), 0) as total_positions,
-            (SELECT r2.status FROM runs r2
-             WHERE r2.client_id = c.client_id
-             ORDER BY r2.timestamp DESC LIMIT 1) as latest_status,
-            (SELECT r2.output_file FROM runs r2
-             WHERE r2.client_id = c.client_id AND r2.output_file IS NOT NULL
-             ORDER BY r2.timestamp DESC LIMIT 1) as latest_file
-        FROM clients c
-        LEFT JOIN runs r ON c.client_id = r.client_id
-        GROUP BY c.client_id, c.name, c.ip, c.last_seen
-        ORDER BY c.last_seen DESC
-    """)
-
-    rows = cursor.fetchall()
-    conn.close()
+    # Cumulative totals and latest status come from the client_stats summary table
+    with db_read() as conn:
+        rows = conn.execute(SQL_LATEST_RUNS).fetchall()
 
     print(f"[SERVER DEBUG] get_latest_runs returned {len(rows)} clients:")
     for row in rows:
@@ -183,22 +772,25 @@ def get_latest_runs():
 
     return [{"client_id": row[0], "name": row[1], "ip": row[2],
              "timestamp": row[3], "games": row[4], "positions": row[5],
-             "status": row[6], "output_file": row[7]} for row in rows]
+             "status": row[6], "output_file": row[7],
+             "pos_per_sec": get_client_rate(row[0])} for row in rows]
 
 def get_positions_last_hour():
-    """Calculate the number of positions reported in the last hour."""
-    global recent_progress
-    now = datetime.datetime.utcnow()
-    one_hour_ago = now - datetime.timedelta(hours=1)
-
-    with progress_lock: # Acquire lock before accessing recent_progress
-        # Filter entries from the last hour
-        recent_entries = [entry for entry in recent_progress if entry[0] >= one_hour_ago]
-
-        # Calculate the total positions reported in the last hour
-        total_positions_last_hour = sum(entry[2] for entry in recent_entries)
-
-    return total_positions_last_hour
+    """Positions reported in the last hour (to the minute)."""
+    with throughput_lock:
+        return fleet_throughput.total(time.time(), RATE_WINDOWS["1h"])
+
+def get_rates():
+    """Fleet positions/sec over each of RATE_WINDOWS."""
+    now = time.time()
+    with throughput_lock:
+        return {name: fleet_throughput.total(now, seconds) / seconds for name, seconds in RATE_WINDOWS.items()}
+
+def get_client_rate(client_id):
+    """A client's positions/sec over CLIENT_RATE_WINDOW (0.0 if it has reported none)."""
+    with throughput_lock:
+        ring = client_throughput.get(client_id)
+        return ring.total(time.time(), CLIENT_RATE_WINDOW) / CLIENT_RATE_WINDOW if ring else 0.0
 
 # === HTML GUI (UPDATED) ===
 HTML_GUI = """
@@ -290,6 +882,36 @@ HTML_GUI = """
             <div class="form-text">How often clients should check for engine updates</div>
           </div>
 
+          <!-- Batch sizing -->
+          <div class="col-md-2">
+            <label class="form-label">batch_mode</label>
+            <select name="batch_mode" class="form-control">
+              <option value="fixed" {% if params.batch_mode == "fixed" %}selected{% endif %}>fixed</option>
+              <option value="adaptive" {% if params.batch_mode == "adaptive" %}selected{% endif %}>adaptive</option>
+            </select>
+            <div class="form-text">adaptive: clients size batches by their own speed</div>
+          </div>
+          <div class="col-md-2">
+            <label class="form-label">target_batch_seconds</label>
+            <input name="target_batch_seconds" type="number" min="10" class="form-control" value="{{ params.target_batch_seconds }}" required>
+            <div class="form-text">adaptive only</div>
+          </div>
+          <div class="col-md-2">
+            <label class="form-label">min_games</label>
+            <input name="min_games" type="number" min="1" class="form-control" value="{{ params.min_games }}" required>
+            <div class="form-text">adaptive only</div>
+          </div>
+          <div class="col-md-2">
+            <label class="form-label">max_games</label>
+            <input name="max_games" type="number" min="1" class="form-control" value="{{ params.max_games }}" required>
+            <div class="form-text">adaptive only</div>
+          </div>
+          <div class="col-md-2">
+            <label class="form-label">target_positions</label>
+            <input name="target_positions" type="number" min="0" class="form-control" value="{{ params.target_positions }}" required>
+            <div class="form-text">Job size; 0 = run forever</div>
+          </div>
+
           <!-- FUTURE PARAMETERS (GREYED OUT) -->
           <div class="col-md-2 future-param">
             <label class="form-label">standard_start_pos_prob</label>
@@ -322,7 +944,9 @@ HTML_GUI = """
           </div>
         </div>
         <div class="mt-3">
-          <button class="btn btn-primary btn-lg">🚀 Update Parameters (Apply on Next Run)</button>
+          <button name="apply" value="drain" class="btn btn-primary btn-lg">🚀 Update Parameters (Apply on Next Run)</button>
+          <button name="apply" value="preempt" class="btn btn-outline-danger btn-lg"
+                  onclick="return confirm('Stop running batches on every client and restart them with these parameters?')">⚡ Apply Now (Restart Running Batches)</button>
         </div>
       </form>
     </div>
@@ -332,6 +956,11 @@ HTML_GUI = """
   <div class="card">
     <div class="card-header d-flex justify-content-between align-items-center">
       <h3>📊 Live Status ({{ runs|length }} clients)</h3>
+      <form method="post" action="/set_client_cap" class="d-flex gap-2 ms-auto me-2">
+        <input name="client" class="form-control form-control-sm" placeholder="client name or id" required>
+        <input name="cap" type="number" min="0" class="form-control form-control-sm" placeholder="max workers (0 = none)">
+        <button class="btn btn-sm btn-outline-primary text-nowrap">Set worker cap</button>
+      </form>
       <button class="btn btn-sm btn-outline-secondary" onclick="location.reload()">🔄 Refresh</button>
     </div>
     <div class="card-body p-0">
@@ -339,7 +968,7 @@ HTML_GUI = """
         <table class="table table-hover mb-0">
           <thead class="table-light">
             <tr>
-              <th>Name</th><th>IP</th><th>Updated</th><th>Status</th><th>Games</th><th>Positions</th><th>File</th>
+              <th>Name</th><th>IP</th><th>Updated</th><th>Status</th><th>Games</th><th>Positions</th><th>Pos/s (15m)</th><th>File</th>
             </tr>
           </thead>
           <tbody id="runs-table-body">
@@ -351,6 +980,7 @@ HTML_GUI = """
               <td class="progress-text">{{ r.status }}</td>
               <td class="text-success fw-bold">{{ "{:,}".format(r.games) }}</td>
               <td>{{ "{:,}".format(r.positions) }}</td>
+              <td>{{ "{:,.0f}".format(r.pos_per_sec) }}</td>
               <td>
                 {% if r.output_file %}
                   <div class="btn-group btn-group-sm">
@@ -361,7 +991,7 @@ HTML_GUI = """
               </td>
             </tr>
             {% else %}
-            <tr><td colspan="7" class="text-center text-muted py-4">⏳ No runs yet. Start clients!</td></tr>
+            <tr><td colspan="8" class="text-center text-muted py-4">⏳ No runs yet. Start clients!</td></tr>
             {% endfor %}
           </tbody>
         </table>
@@ -401,11 +1031,25 @@ HTML_GUI = """
         <div class="card-body text-center">
           <h4>{{ "{:,}".format(positions_last_hour) }}</h4>
           <small>Positions in Last Hour</small>
+          <div id="rates"><small>{% for name, rate in rates.items() %}{{ name }} {{ "{:,.0f}".format(rate) }}/s{% if not loop.last %} · {% endif %}{% endfor %}</small></div>
         </div>
       </div>
     </div>
   </div>
 
+  <!-- Job / leases -->
+  <div class="card">
+    <div class="card-header"><h3>📦 Job</h3></div>
+    <div class="card-body">
+      <div class="row text-center">
+        <div class="col-md-3"><h4 id="job-leases">{{ job.outstanding_leases }}</h4><small>Outstanding Leases (<span id="job-games">{{ "{:,}".format(job.in_flight_games) }}</span> games)</small></div>
+        <div class="col-md-3"><h4 id="job-positions">{{ "{:,}".format(job.positions) }}{% if job.target %} / {{ "{:,}".format(job.target) }}{% endif %}</h4><small>Job Positions</small></div>
+        <div class="col-md-3"><h4 id="job-percent">{% if job.percent is not none %}{{ "%.1f"|format(job.percent) }}%{% else %}-{% endif %}</h4><small>Complete</small></div>
+        <div class="col-md-3"><h4 id="job-eta">{{ job.eta_text }}</h4><small>ETA (<span id="job-rate">{{ "{:,.0f}".format(job.positions_per_sec) }}</span> pos/s)</small></div>
+      </div>
+    </div>
+  </div>
+
   <div class="text-center mt-4 text-muted">
     <small>🐑 Server: <code>{{ request.host }}</code> | 💾 DB: <code>{{ db_path }}</code></small>
   </div>
@@ -421,12 +1065,23 @@ function copy(text) {
   });
 }
 
+// Client rows by id, kept in sync with /live_data?since=<version> deltas
+const liveRows = new Map();
+let liveVersion = null;
+
 // Function to fetch and update live data
 function updateLiveData() {
-  fetch('/live_data') // Fetch from the new endpoint
-    .then(response => response.json())
+  fetch(liveVersion === null ? '/live_data' : '/live_data?since=' + liveVersion)
+    .then(response => response.status === 304 ? null : response.json())
     .then(data => {
+      if (!data) return; // Nothing changed
       console.log("Fetched live data:", data); // Optional: for debugging
+      if (!data.delta) liveRows.clear();
+      data.runs.forEach(run => liveRows.set(run.client_id, run));
+      (data.removed || []).forEach(id => liveRows.delete(id));
+      liveVersion = data.version;
+      // Same order as the server: most recently seen first
+      data.runs = [...liveRows.values()].sort((a, b) => (b.timestamp || '').localeCompare(a.timestamp || ''));
 
       // Update Total Stats Cards
       document.querySelector('.bg-success .card-body h4').textContent = data.total_games.toLocaleString();
@@ -434,13 +1089,25 @@ function updateLiveData() {
       document.querySelector('.bg-primary .card-body h4').textContent = data.runs.length; // Active Clients
       // Update NEW card for Positions Last Hour
       document.querySelector('.bg-warning .card-body h4').textContent = data.positions_last_hour.toLocaleString();
+      document.querySelector('#rates small').textContent = ['1m', '15m', '1h', '24h']
+        .map(name => name + ' ' + Math.round(data.rates[name]).toLocaleString() + '/s').join(' · ');
+
+      // Update the Job card
+      const job = data.job;
+      document.getElementById('job-leases').textContent = job.outstanding_leases;
+      document.getElementById('job-positions').textContent = job.positions.toLocaleString() +
+        (job.target ? ' / ' + job.target.toLocaleString() : '');
+      document.getElementById('job-percent').textContent = job.percent === null ? '-' : job.percent.toFixed(1) + '%';
+      document.getElementById('job-eta').textContent = job.eta_text;
+      document.getElementById('job-games').textContent = job.in_flight_games.toLocaleString();
+      document.getElementById('job-rate').textContent = Math.round(job.positions_per_sec).toLocaleString();
 
       // Update the Live Status Table Body
       const tbody = document.querySelector('#runs-table-body'); // Add id="runs-table-body" to your <tbody>
       if (tbody) {
         let rowsHTML = '';
         if (data.runs.length === 0) {
-          rowsHTML = '<tr><td colspan="7" class="text-center text-muted py-4">⏳ No runs yet. Start clients!</td></tr>';
+          rowsHTML = '<tr><td colspan="8" class="text-center text-muted py-4">⏳ No runs yet. Start clients!</td></tr>';
         } else {
           data.runs.forEach(run => {
             // Format the timestamp (last 8 chars like in original) - adjust as needed
@@ -464,6 +1131,7 @@ function updateLiveData() {
               <td class="progress-text">${run.status}</td>
               <td class="text-success fw-bold">${run.games.toLocaleString()}</td>
               <td>${run.positions.toLocaleString()}</td>
+              <td>${Math.round(run.pos_per_sec).toLocaleString()}</td>
               <td>${fileCellHTML}</td>
             </tr>
             `;
@@ -494,31 +1162,29 @@ document.addEventListener('DOMContentLoaded', updateLiveData);
 # === ROUTES ===
 def get_total_stats():
     """Get total games and positions from all clients"""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT
-            COALESCE(SUM(games_completed), 0) as total_games,
-            COALESCE(SUM(positions_completed), 0) as total_positions
-        FROM runs
-    """)
-
-    row = cursor.fetchone()
-    conn.close()
+    with db_read() as conn:
+        row = conn.execute("""
+            SELECT
+                COALESCE(SUM(total_games), 0) as total_games,
+                COALESCE(SUM(total_positions), 0) as total_positions
+            FROM client_stats
+        """).fetchone()
 
     return row[0], row[1]  # total_games, total_positions
 
 @app.route("/")
 def index():
-    runs = get_latest_runs()
-    total_games, total_positions = get_total_stats()
-    positions_last_hour = get_positions_last_hour() # Calculate for display
+    # Database figures come from the shared live snapshot; parameters and the job are always current
+    live = get_live_snapshot()["data"]
+    runs = live["runs"]
+    total_games, total_positions = live["total_games"], live["total_positions"]
+    positions_last_hour = live["positions_last_hour"] # Calculate for display
 
     return render_template_string(HTML_GUI, runs=runs, params=parameters,
                                db_path=DB_PATH, total_games=total_games,
                                total_positions=total_positions,
-                               positions_last_hour=positions_last_hour) # Pass to template
+                               positions_last_hour=positions_last_hour, # Pass to template
+                               rates=get_rates(), job=get_job_status())
 
 @app.route("/register", methods=["POST"])
 def register():
@@ -532,145 +1198,1084 @@ def register():
     }
     return jsonify({"client_id": client_id})
 
+def _parameters_etag(client_id=None):
+    cap = client_caps.get(client_id) if client_id else None
+    return f'"p{parameters_version}-e{engine_state["version"]}-c{cap}"'
+
 @app.route("/parameters", methods=["GET"])
 def get_parameters():
-    global parameters_changed, restart_required  # ADD restart_required
-
-    changed = parameters_changed
-    should_restart = restart_required  # Check if restart is required
+    """Current parameters, with a version and ETag.
+
+    Query args: since=<version the client has> makes "changed"/"restart_required"
+    relative to that version, and "reload_mode" says how to apply the change
+    ("preempt" if a restart was requested since then, else "drain"); wait=<seconds> with If-None-Match holds the request
+    until something changes (long poll); client_id=<id> adds that client's
+    concurrency_cap. Unchanged polls get a bodyless 304.
+    """
+    since = request.args.get("since", type=int)
+    client_id = request.args.get("client_id")
+    wait = min(max(request.args.get("wait", 0, type=float), 0), PARAMETERS_MAX_WAIT)
+    client_etag = request.headers.get("If-None-Match")
+
+    with parameters_cond:
+        if client_etag == _parameters_etag(client_id) and wait > 0:
+            parameters_cond.wait_for(lambda: client_etag != _parameters_etag(client_id), timeout=wait)
+        etag = _parameters_etag(client_id)
+        version = parameters_version
+        should_restart = since is not None and since < restart_required_version
+        current = dict(parameters)
+        cap = client_caps.get(client_id)
+
+    if client_etag == etag:
+        return "", 304, {"ETag": etag}
+
+    engine = get_engine_info()
+    response = jsonify({
+        "parameters": current,
+        "version": version,
+        "changed": since is None or since < version,
+        "restart_required": should_restart,
+        "reload_mode": "preempt" if should_restart else "drain",
+        "engine_hash": engine["hash"], # Include the hash in the response
+        "engine_version": engine["version"],
+        "concurrency_cap": cap
+    })
+    response.headers["ETag"] = etag
+    return response
+
+@app.route("/set_client_cap", methods=["POST"])
+def set_client_cap():
+    """Cap a client's concurrent lamb workers. Form: client (id or name), cap (empty or 0 removes it)."""
+    client = request.form.get("client", "").strip()
+    cap = request.form.get("cap", "").strip()
+    matches = [cid for cid, info in clients.items() if client in (cid, info.get("name"))]
+    if not matches:
+        return jsonify({"error": f"unknown client {client!r}"}), 404
+    if cap and (not cap.isdigit()):
+        return jsonify({"error": "cap must be a non-negative integer"}), 400
+    with parameters_cond:
+        for cid in matches:
+            if cap and int(cap) > 0:
+                client_caps[cid] = int(cap)
+            else:
+                client_caps.pop(cid, None)
+        parameters_cond.notify_all() # The capped clients' ETags changed; wake their long polls
+    print(f"[SERVER] Concurrency cap for {client}: {cap or 'none'} ({len(matches)} client(s))")
+    return index()
 
-    # Reset flags after reading
-    parameters_changed = False
-    if restart_required:
-        restart_required = False  # Reset after clients read it
+MAX_DECODED_BODY = 16 * 1024 * 1024 # Cap on a gzip-encoded JSON body once inflated
 
-    # Get the current engine hash
-    engine_hash = get_engine_hash()
+def _request_json():
+    """request.get_json(silent=True), also accepting Content-Encoding: gzip bodies."""
+    if request.headers.get("Content-Encoding", "").lower() != "gzip":
+        return request.get_json(silent=True)
+    decoder = zlib.decompressobj(wbits=31)
+    try:
+        body = decoder.decompress(request.get_data(), MAX_DECODED_BODY)
+        if decoder.unconsumed_tail:
+            return None
+        return json.loads(body)
+    except (zlib.error, ValueError):
+        return None
 
-    return jsonify({
-        "parameters": parameters,
-        "changed": changed,
-        "restart_required": should_restart,
-        "engine_hash": engine_hash # Include the hash in the response
-    })
+def _validate_progress(data):
+    """Return an error message if a progress payload is malformed, else None."""
+    if not data.get("client_id"):
+        return "missing client_id"
+    for key in ("games", "positions"):
+        value = data.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            return f"{key} must be a non-negative integer"
+    output_file = data.get("output_file")
+    if output_file is not None and not isinstance(output_file, str):
+        return "output_file must be a string"
+    engine_version = data.get("engine_version")
+    if engine_version is not None and (isinstance(engine_version, bool) or not isinstance(engine_version, int)):
+        return "engine_version must be an integer"
+    event_time = data.get("time")
+    if event_time is not None and (isinstance(event_time, bool) or not isinstance(event_time, (int, float))
+                                   or not math.isfinite(event_time)):
+        return "time must be a Unix timestamp"
+    return None
+
+PROGRESS_MAX_AGE = 24 * 60 * 60 # Older event times are clamped to this far back
+
+def _stamp_event(data, now):
+    """Set data["time"] to the client's event time, clamped to [now - PROGRESS_MAX_AGE, now].
+
+    Clients stamp each event when it happens, so events that waited in a batch
+    or in the client's retry buffer are counted when they occurred; a client
+    clock running ahead cannot place positions in the future.
+    """
+    event_time = data.get("time")
+    if event_time is None: # Missing or null: older clients do not stamp events
+        event_time = now
+    data["time"] = min(now, max(now - PROGRESS_MAX_AGE, event_time))
+
+def _touch_client(client_id, data):
+    """Update the in-memory client entry for a progress event, re-registering unknown clients."""
+    if client_id in clients:
+        clients[client_id].update({
+            "progress": data.get("progress", "unknown"),
+            "output_file": data.get("output_file"),
+            "last_seen": datetime.datetime.utcnow().strftime("%H:%M:%S")
+        })
+    else:
+        # Client ID not found - auto-re-register the client
+        print(f"[SERVER DEBUG] Client {client_id} NOT found - auto-re-registering")
+        # Extract client name from progress message or use default
+        client_name = "unknown"
+        if "rl_pop" in data.get("progress", ""):
+            client_name = "rl_pop"
+
+        clients[client_id] = {
+            "name": client_name,
+            "ip": request.remote_addr,
+            "last_seen": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            "progress": "re-registered"
+        }
+        print(f"[SERVER DEBUG] Re-registered client: {client_id} as {client_name}")
+
+def _progress_row(client_id, data):
+    timestamp = datetime.datetime.utcfromtimestamp(data["time"])
+    return (
+        client_id, clients[client_id]["name"], clients[client_id]["ip"],
+        data.get("output_file"), data.get("games", 0), data.get("positions", 0),
+        data.get("progress", "unknown"), timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+        data.get("engine_version")
+    )
+
+def _record_positions(reports):
+    """Add (client_id, positions, time) reports to the throughput windows."""
+    with throughput_lock:
+        for client_id, positions, now in reports:
+            if positions <= 0:
+                continue
+            fleet_throughput.add(now, positions)
+            metric_inc("lamb_positions_reported_total", value=positions)
+            ring = client_throughput.get(client_id)
+            if ring is None:
+                ring = client_throughput[client_id] = BucketRing(CLIENT_BUCKET_SECONDS,
+                                                                 CLIENT_RATE_WINDOW // CLIENT_BUCKET_SECONDS)
+            ring.add(now, positions)
 
 @app.route("/progress", methods=["POST"])
 def progress():
-    global recent_progress # Access the global list
-    data = request.get_json(silent=True) or {}
+    data = _request_json() or {}
     client_id = data.get("client_id")
 
     print(f"[SERVER DEBUG] Progress update from {client_id}: {data}")
-    print(f"[SERVER DEBUG] Clients in memory: {list(clients.keys())}")
-
-    if client_id:
-        # If client exists, update normally
-        if client_id in clients:
-            print(f"[SERVER DEBUG] Client {client_id} found in clients dict")
-            clients[client_id].update({
-                "progress": data.get("progress", "unknown"),
-                "output_file": data.get("output_file"),
-                "last_seen": datetime.datetime.utcnow().strftime("%H:%M:%S")
-            })
-            save_run_to_db(
-                client_id, data.get("output_file"),
-                data.get("games", 0), data.get("positions", 0),
-                data.get("progress", "unknown")
-            )
-
-            # --- ADD: Store progress for last hour calculation ---
-            positions_reported = data.get("positions", 0)
-            if positions_reported > 0: # Only store if positions were reported
-                timestamp = datetime.datetime.utcnow()
-                with progress_lock: # Acquire lock before modifying list
-                    recent_progress.append((timestamp, client_id, positions_reported))
-                    # Optional: Clean up very old entries periodically to prevent unbounded growth
-                    # Keep entries only for the last 2 hours to be safe
-                    cutoff_time = timestamp - datetime.timedelta(hours=2)
-                    recent_progress = [entry for entry in recent_progress if entry[0] >= cutoff_time]
-
-        else:
-            # Client ID not found - auto-re-register the client
-            print(f"[SERVER DEBUG] Client {client_id} NOT found - auto-re-registering")
-            # Extract client name from progress message or use default
-            client_name = "unknown"
-            if "rl_pop" in data.get("progress", ""):
-                client_name = "rl_pop"
-
-            clients[client_id] = {
-                "name": client_name,
-                "ip": request.remote_addr,
-                "last_seen": datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
-                "progress": "re-registered"
-            }
-            print(f"[SERVER DEBUG] Re-registered client: {client_id} as {client_name}")
-
-            # Now save the progress
-            save_run_to_db(
-                client_id, data.get("output_file"),
-                data.get("games", 0), data.get("positions", 0),
-                data.get("progress", "unknown")
-            )
-
-            # --- ALSO ADD: Store progress for last hour calculation if re-registering ---
-            positions_reported = data.get("positions", 0)
-            if positions_reported > 0: # Only store if positions were reported
-                timestamp = datetime.datetime.utcnow()
-                with progress_lock: # Acquire lock before modifying list
-                    recent_progress.append((timestamp, client_id, positions_reported))
-                    cutoff_time = timestamp - datetime.timedelta(hours=2)
-                    recent_progress = [entry for entry in recent_progress if entry[0] >= cutoff_time]
 
+    error = _validate_progress(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    _touch_client(client_id, data)
+    _stamp_event(data, time.time())
+    if not enqueue_runs([_progress_row(client_id, data)]):
+        print(f"[SERVER DEBUG] Ingest queue full, rejecting progress from {client_id}")
+        return jsonify({"error": "ingest queue full"}), 503, {"Retry-After": "1"}
+
+    # Store progress for last hour calculation
+    _record_positions([(client_id, data.get("positions", 0), data["time"])])
+    return jsonify({"status": "queued"}), 202
+
+PROGRESS_BATCH_MAX_EVENTS = 500 # Events accepted per /progress_batch request
+
+@app.route("/progress_batch", methods=["POST"])
+def progress_batch():
+    """Accept {"client_id", "engine_version", "events": [...]}; each event is a /progress payload.
+
+    Events inherit client_id/engine_version from the envelope. The batch is
+    validated as a whole and committed in one transaction, or rejected whole.
+    """
+    data = _request_json() or {}
+    events = data.get("events")
+    if not isinstance(events, list) or not events:
+        return jsonify({"error": "events must be a non-empty list"}), 400
+    if len(events) > PROGRESS_BATCH_MAX_EVENTS:
+        return jsonify({"error": f"at most {PROGRESS_BATCH_MAX_EVENTS} events per batch"}), 413
+
+    merged = []
+    for i, event in enumerate(events):
+        if not isinstance(event, dict):
+            return jsonify({"error": f"event {i} is not an object"}), 400
+        event = {"client_id": data.get("client_id"), "engine_version": data.get("engine_version"), **event}
+        error = _validate_progress(event)
+        if error:
+            return jsonify({"error": f"event {i}: {error}"}), 400
+        merged.append(event)
+
+    print(f"[SERVER DEBUG] Progress batch from {data.get('client_id')}: {len(merged)} events")
+    now = time.time()
+    for event in merged:
+        _touch_client(event["client_id"], event)
+        _stamp_event(event, now)
+    if not enqueue_runs([_progress_row(event["client_id"], event) for event in merged]):
+        print(f"[SERVER DEBUG] Ingest queue full, rejecting progress batch from {data.get('client_id')}")
+        return jsonify({"error": "ingest queue full"}), 503, {"Retry-After": "1"}
+
+    _record_positions([(event["client_id"], event.get("positions", 0), event["time"]) for event in merged])
+    return jsonify({"status": "queued", "events": len(merged)}), 202
+
+# === Batch Accounting ===
+# Clients send aggregate figures for the batches they ran (POST /batch_stats)
+# every few minutes: batch counts, wall and CPU seconds, peak RSS and seconds
+# per phase. They are summed per client in memory for /debug_batches and
+# /metrics, so nodes and parameter settings can be compared on positions per
+# CPU-second. Each client keeps the per-batch detail in its own JSONL log.
+BATCH_STAT_FIELDS = ("batches", "failed", "games", "positions", "wall_seconds", "cpu_seconds")
+BATCH_PHASE_NAME = re.compile(r"^[a-z_]{1,32}$")
+
+batch_stats_lock = threading.Lock()
+batch_stats = {} # client_id -> totals since server start
+
+def _is_amount(value):
+    return not isinstance(value, bool) and isinstance(value, (int, float)) and value >= 0
+
+@app.route("/batch_stats", methods=["POST"])
+def post_batch_stats():
+    """Add a client's batch totals: BATCH_STAT_FIELDS, max_rss_kb and phase_seconds {phase: seconds}."""
+    data = _request_json() or {}
+    client_id = data.get("client_id")
+    if not client_id:
+        return jsonify({"error": "missing client_id"}), 400
+    for key in BATCH_STAT_FIELDS + ("max_rss_kb",):
+        if not _is_amount(data.get(key, 0)):
+            return jsonify({"error": f"{key} must be a non-negative number"}), 400
+    phases = data.get("phase_seconds", {})
+    if not isinstance(phases, dict) or not all(isinstance(k, str) and BATCH_PHASE_NAME.match(k) and _is_amount(v)
+                                               for k, v in phases.items()):
+        return jsonify({"error": "phase_seconds must map phase names to non-negative numbers"}), 400
+
+    with batch_stats_lock:
+        totals = batch_stats.setdefault(client_id, {**{key: 0 for key in BATCH_STAT_FIELDS},
+                                                    "max_rss_kb": 0, "phase_seconds": {}})
+        for key in BATCH_STAT_FIELDS:
+            totals[key] += data.get(key, 0)
+        totals["max_rss_kb"] = max(totals["max_rss_kb"], data.get("max_rss_kb", 0))
+        for phase, seconds in phases.items():
+            totals["phase_seconds"][phase] = totals["phase_seconds"].get(phase, 0) + seconds
+        totals["updated"] = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
     return jsonify({"status": "ok"})
 
+def get_batch_stats():
+    """Per-client batch totals plus derived figures, busiest client first."""
+    with batch_stats_lock:
+        snapshot = {client_id: {**totals, "phase_seconds": dict(totals["phase_seconds"])}
+                    for client_id, totals in batch_stats.items()}
+    rows = []
+    for client_id, totals in snapshot.items():
+        batches = totals["batches"] or 1
+        rows.append({
+            **totals,
+            "client_id": client_id,
+            "name": clients.get(client_id, {}).get("name", client_id),
+            "avg_wall_seconds": totals["wall_seconds"] / batches,
+            "positions_per_cpu_sec": totals["positions"] / totals["cpu_seconds"] if totals["cpu_seconds"] else 0.0,
+            "cores_per_batch": totals["cpu_seconds"] / totals["wall_seconds"] if totals["wall_seconds"] else 0.0,
+            "avg_phase_seconds": {phase: seconds / batches for phase, seconds in totals["phase_seconds"].items()},
+        })
+    rows.sort(key=lambda row: row["positions"], reverse=True)
+    return rows
+
+# === Work Leasing ===
+# Before each batch a client asks for a lease: a games quota plus the parameters
+# to run it with. It heartbeats while lamb runs and completes the lease with the
+# positions produced. Active leases are kept in memory for heartbeats; grants,
+# completions and expiries are also written to the leases and jobs tables, so
+# the job's progress and the outstanding leases survive a restart. The reaper
+# drops leases that miss their heartbeat deadline, which frees their share of
+# the job target. With target_positions set, no lease is handed out once the
+# completed positions plus the expected yield of outstanding leases cover the target.
+LEASE_TTL = 120 # Seconds a lease survives without a heartbeat
+LEASE_HEARTBEAT_INTERVAL = 30 # Heartbeat period handed to clients
+LEASE_REAP_INTERVAL = 10
+LEASE_IDLE_RETRY = 60 # Retry-After for clients when there is no work to hand out
+JOB_RATE_WINDOW = 15 * 60 # Seconds of completions used for the fleet rate and ETA
+ESTIMATED_GAME_PLIES = 160 # Assumed game length until the job has measured positions per game
+
+leases = {} # lease_id -> lease dict of the active leases, see grant_lease
+leases_lock = threading.Lock() # Held across the matching DB write, so memory and DB agree
+job_state = {"id": None, "target": 0, "started": time.time(), "games": 0, "positions": 0,
+             "issued": 0, "completed": 0, "reclaimed": 0}
+job_completions = deque() # (time, positions) of completions within JOB_RATE_WINDOW
+
+SQL_INSERT_JOB = "INSERT INTO jobs (target, started) VALUES (?, ?)"
+SQL_UPDATE_JOB = "UPDATE jobs SET games = ?, positions = ?, issued = ?, completed = ?, reclaimed = ? WHERE id = ?"
+SQL_INSERT_LEASE = """
+    INSERT INTO leases (lease_id, job_id, client_id, games, parameters, version, issued, status)
+    VALUES (?, ?, ?, ?, ?, ?, ?, 'active')
+"""
+SQL_FINISH_LEASE = "UPDATE leases SET status = ?, finished = ?, positions = ? WHERE lease_id = ?"
+SQL_LEASE_STATUS = "SELECT status FROM leases WHERE lease_id = ?"
+
+def _save_job(conn, state):
+    conn.execute(SQL_UPDATE_JOB, (state["games"], state["positions"], state["issued"],
+                                  state["completed"], state["reclaimed"], state["id"]))
+
+def load_job_state():
+    """Restore the current job, its recent completions and the active leases from the DB."""
+    now = time.time()
+    with db_read() as conn:
+        job = conn.execute("""SELECT id, target, started, games, positions, issued, completed, reclaimed
+                              FROM jobs ORDER BY id DESC LIMIT 1""").fetchone()
+        active = conn.execute("""SELECT lease_id, client_id, games, parameters, version, issued
+                                 FROM leases WHERE status = 'active'""").fetchall()
+        recent = conn.execute("""SELECT finished, positions FROM leases
+                                 WHERE status = 'completed' AND finished >= ? ORDER BY finished""",
+                              (now - JOB_RATE_WINDOW,)).fetchall()
+    if job is None:
+        reset_job(parameters["target_positions"])
+        return
+    with leases_lock:
+        job_state.update(zip(("id", "target", "started", "games", "positions", "issued", "completed", "reclaimed"), job))
+        job_completions.extend(recent)
+        # Clients could not heartbeat while the server was down; give them a full TTL
+        for lease_id, client_id, games, params, version, issued in active:
+            leases[lease_id] = {"lease_id": lease_id, "client_id": client_id, "games": games,
+                                "parameters": json.loads(params), "version": version,
+                                "issued": issued, "deadline": now + LEASE_TTL, "positions": 0}
+    parameters["target_positions"] = job_state["target"]
+    target = f" of {job_state['target']}" if job_state["target"] else ""
+    print(f"[SERVER] Resumed job {job_state['id']}: {job_state['positions']}{target} positions, "
+          f"{len(active)} active lease(s)")
+
+def reset_job(target):
+    """Start counting a new job toward target positions. Outstanding leases carry over."""
+    now = time.time()
+    with leases_lock:
+        job_id = db_write(lambda conn: conn.execute(SQL_INSERT_JOB, (target, now)).lastrowid)
+        job_state.update(id=job_id, target=target, started=now, games=0, positions=0,
+                         issued=0, completed=0, reclaimed=0)
+        job_completions.clear()
+
+def _positions_per_game():
+    if job_state["games"]:
+        return job_state["positions"] / job_state["games"]
+    # Nothing measured yet in this job: assume every game runs ESTIMATED_GAME_PLIES
+    # plies and saves each one in the save window, so outstanding leases still count
+    return max(1, min(parameters["save_max_ply"], ESTIMATED_GAME_PLIES) - parameters["save_min_ply"])
+
+def grant_lease(client_id, requested_games):
+    """Create a lease for up to requested_games games, or return None if the job needs no more work."""
+    now = time.time()
+    with leases_lock:
+        games = max(1, requested_games)
+        target = job_state["target"]
+        if target:
+            per_game = _positions_per_game()
+            in_flight = sum(lease["games"] for lease in leases.values()) * per_game
+            remaining = target - job_state["positions"] - in_flight
+            if remaining <= 0:
+                return None
+            games = max(1, min(games, math.ceil(remaining / per_game)))
+        lease = {"lease_id": uuid.uuid4().hex, "client_id": client_id, "games": games,
+                 "parameters": dict(parameters), "version": parameters_version,
+                 "issued": now, "deadline": now + LEASE_TTL, "positions": 0}
+        state = dict(job_state, issued=job_state["issued"] + 1)
+
+        def persist(conn):
+            conn.execute(SQL_INSERT_LEASE, (lease["lease_id"], state["id"], client_id, games,
+                                            json.dumps(lease["parameters"]), lease["version"], now))
+            _save_job(conn, state)
+
+        db_write(persist)
+        leases[lease["lease_id"]] = lease
+        job_state.update(state)
+    return lease
+
+def heartbeat_lease(lease_id, positions=0):
+    """Extend a lease's deadline. Returns False if it is unknown (expired or never issued)."""
+    with leases_lock:
+        lease = leases.get(lease_id)
+        if lease is None:
+            return False
+        lease["deadline"] = time.time() + LEASE_TTL
+        lease["positions"] = positions
+    return True
+
+def complete_lease(lease_id, games, positions):
+    """Close a lease and credit its output to the job, once.
+
+    Returns "completed", "late" (the lease had expired; its output is still
+    credited, the positions exist either way), "duplicate" (already completed,
+    nothing credited) or None for an id that was never issued.
+    """
+    now = time.time()
+    with leases_lock:
+        result = "completed"
+        if lease_id not in leases:
+            with db_read() as conn:
+                row = conn.execute(SQL_LEASE_STATUS, (lease_id,)).fetchone()
+            if row is None:
+                return None
+            if row[0] == "completed":
+                return "duplicate"
+            result = "late"
+        state = dict(job_state, games=job_state["games"] + games, positions=job_state["positions"] + positions,
+                     completed=job_state["completed"] + 1)
+
+        def persist(conn):
+            conn.execute(SQL_FINISH_LEASE, ("completed", now, positions, lease_id))
+            _save_job(conn, state)
+
+        db_write(persist)
+        leases.pop(lease_id, None)
+        job_state.update(state)
+        job_completions.append((now, positions))
+        while job_completions and job_completions[0][0] < now - JOB_RATE_WINDOW:
+            job_completions.popleft()
+    return result
+
+def reap_leases():
+    now = time.time()
+    with leases_lock:
+        expired = [lease_id for lease_id, lease in leases.items() if lease["deadline"] < now]
+        if not expired:
+            return
+        state = dict(job_state, reclaimed=job_state["reclaimed"] + len(expired))
+
+        def persist(conn):
+            conn.executemany(SQL_FINISH_LEASE, [("expired", now, 0, lease_id) for lease_id in expired])
+            _save_job(conn, state)
+
+        db_write(persist)
+        for lease_id in expired:
+            del leases[lease_id]
+        job_state.update(state)
+    print(f"[SERVER] Reclaimed {len(expired)} expired lease(s)")
+
+def lease_reaper_loop():
+    while True:
+        time.sleep(LEASE_REAP_INTERVAL)
+        try:
+            reap_leases()
+        except Exception as e:
+            print(f"[SERVER DEBUG] Lease reaper error: {e}")
+
+load_job_state()
+lease_reaper = threading.Thread(target=lease_reaper_loop, name="lease-reaper", daemon=True)
+lease_reaper.start()
+
+def _format_duration(seconds):
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    if seconds >= 86400:
+        return f"{seconds // 86400}d {seconds % 86400 // 3600}h"
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    return f"{seconds // 60}m {seconds % 60}s"
+
+def get_job_status():
+    """Outstanding leases, completion and ETA for the dashboard."""
+    now = time.time()
+    with leases_lock:
+        state = dict(job_state)
+        outstanding = len(leases)
+        in_flight_games = sum(lease["games"] for lease in leases.values())
+        window_start = max(now - JOB_RATE_WINDOW, state["started"])
+        window_positions = sum(positions for t, positions in job_completions if t >= window_start)
+    rate = window_positions / (now - window_start) if now > window_start else 0.0
+    target = state["target"]
+    remaining = max(0, target - state["positions"]) if target else None
+    eta = remaining / rate if remaining and rate > 0 else (0 if remaining == 0 else None)
+    return {
+        "target": target,
+        "positions": state["positions"],
+        "percent": min(100.0, 100.0 * state["positions"] / target) if target else None,
+        "done": bool(target) and remaining == 0,
+        "outstanding_leases": outstanding,
+        "in_flight_games": in_flight_games,
+        "issued": state["issued"],
+        "completed": state["completed"],
+        "reclaimed": state["reclaimed"],
+        "positions_per_sec": rate,
+        "eta_seconds": eta,
+        "eta_text": ("done" if remaining == 0 else _format_duration(eta)) if target else "no target",
+    }
+
+@app.route("/lease", methods=["POST"])
+def lease_request():
+    """Hand out a work unit: {"client_id", "games"} -> lease, or 204 when the job target is covered."""
+    data = request.get_json(silent=True) or {}
+    client_id = data.get("client_id")
+    games = data.get("games", parameters["games"])
+    if not client_id:
+        return jsonify({"error": "missing client_id"}), 400
+    if isinstance(games, bool) or not isinstance(games, int) or games < 1:
+        return jsonify({"error": "games must be a positive integer"}), 400
+
+    lease = grant_lease(client_id, games)
+    if lease is None:
+        return "", 204, {"Retry-After": str(LEASE_IDLE_RETRY)}
+    print(f"[SERVER DEBUG] Lease {lease['lease_id'][:8]} → {client_id}: {lease['games']} games")
+    return jsonify({
+        "lease_id": lease["lease_id"],
+        "games": lease["games"],
+        "parameters": lease["parameters"],
+        "version": lease["version"],
+        "ttl": LEASE_TTL,
+        "heartbeat_interval": LEASE_HEARTBEAT_INTERVAL,
+    })
+
+@app.route("/lease/<lease_id>/heartbeat", methods=["POST"])
+def lease_heartbeat(lease_id):
+    data = request.get_json(silent=True) or {}
+    positions = data.get("positions", 0)
+    if not heartbeat_lease(lease_id, positions if isinstance(positions, int) else 0):
+        return jsonify({"error": "unknown or expired lease"}), 404
+    return jsonify({"status": "ok", "ttl": LEASE_TTL})
+
+@app.route("/lease/<lease_id>/complete", methods=["POST"])
+def lease_complete(lease_id):
+    data = request.get_json(silent=True) or {}
+    for key in ("games", "positions"):
+        value = data.get(key, 0)
+        if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+            return jsonify({"error": f"{key} must be a non-negative integer"}), 400
+    result = complete_lease(lease_id, data.get("games", 0), data.get("positions", 0))
+    if result is None:
+        return jsonify({"error": "unknown lease"}), 404
+    if result == "duplicate":
+        return jsonify({"error": "lease already completed"}), 409
+    return jsonify({"status": result, "job": get_job_status()})
+
 @app.route("/set_parameters", methods=["POST"])
 def set_parameters():
-    global parameters, parameters_changed
+    global parameters
     form = request.form
 
     # Update only active parameters
     active_params = {
         "games", "depth", "save_min_ply", "save_max_ply",
         "random_min_ply", "random_50_ply", "random_10_ply", "random_move_count",
-        "engine_update_frequency" # Include the new parameter
+        "engine_update_frequency", # Include the new parameter
+        "batch_mode", "target_batch_seconds", "min_games", "max_games",
+        "target_positions"
     }
 
+    # Validate every field before anything changes: a rejected form must not reset the job.
+    # apply="drain": clients pick up the new version on their next batch.
+    # "preempt": clients stop running batches now and restart with it.
+    mode = form.get("apply", "drain")
+    if mode not in RELOAD_MODES:
+        return f"apply must be one of {', '.join(RELOAD_MODES)}", 400
+
+    updates = {}
     for key in active_params:
         if key in form:
             val = form[key].strip()
             if key == "engine_update_frequency":
                  # Validate the value if needed, for now just accept the string
-                 parameters[key] = val
+                 updates[key] = val
+            elif key == "batch_mode":
+                if val in ("fixed", "adaptive"):
+                    updates[key] = val
             else:
                 # Assume other active params are integers
-                parameters[key] = int(val)
+                try:
+                    updates[key] = int(val)
+                except ValueError:
+                    return f"{key} must be an integer", 400
+    # Keep the adaptive bounds usable whatever order they were edited in
+    min_games = max(1, updates.get("min_games", parameters["min_games"]))
+    max_games = max(min_games, updates.get("max_games", parameters["max_games"]))
+    if "min_games" in updates or "max_games" in updates:
+        updates.update(min_games=min_games, max_games=max_games)
 
     if "skipnoisy" in form:
-        parameters["skipnoisy"] = form["skipnoisy"] == "true"
-
-    parameters_changed = True
-    # NO restart_required = True - clients will pick up new params naturally
+        updates["skipnoisy"] = form["skipnoisy"] == "true"
+
+    # A new target starts a new job; re-submitting the same target keeps counting
+    if "target_positions" in updates:
+        updates["target_positions"] = max(0, updates["target_positions"])
+        if updates["target_positions"] != parameters["target_positions"]:
+            reset_job(updates["target_positions"])
+
+    # Apply and bump the version together so a poll never sees a half-updated set
+    with parameters_cond:
+        parameters.update(updates)
+        bump_parameters_version(restart=mode == "preempt")
+    print(f"[SERVER] Parameters version {parameters_version} ({mode}): {updates}")
     return index()
 
+# === Content-Addressed Game Storage ===
+# Uploaded files are stored once under OBJECTS_DIR/<sha[:2]>/<sha256>[.gz|.zst],
+# keyed by the SHA256 of their uncompressed content, and the files table maps
+# each uploaded name to that hash. Compressed uploads are stored as received
+# and decoded only when a downloader cannot accept the encoding. Re-sending a
+# file the server already has costs one GET /files/<sha256> instead of a transfer.
+HASH_READ_BLOCK = 1024 * 1024
+
+# Content-Encoding name -> object file suffix
+ENCODING_SUFFIXES = {"identity": "", "gzip": ".gz"}
+if zstd is not None:
+    ENCODING_SUFFIXES["zstd"] = ".zst"
+SUPPORTED_ENCODINGS = list(ENCODING_SUFFIXES)
+DECODE_OUTPUT_BLOCK = 1024 * 1024 # Most uncompressed bytes produced per decoder step
+
+class DecodeLimitExceeded(Exception):
+    """An upload decompressed to more bytes than it declared."""
+
+DECODE_ERRORS = (zlib.error, DecodeLimitExceeded) + ((zstd.ZstdError,) if zstd is not None else ())
+
+def _inflate(decoder, block):
+    """Yield a zlib decoder's output for block, at most DECODE_OUTPUT_BLOCK bytes at a time."""
+    while True:
+        out = decoder.decompress(block, DECODE_OUTPUT_BLOCK)
+        yield out
+        block = decoder.unconsumed_tail
+        if not block and len(out) < DECODE_OUTPUT_BLOCK:
+            return
+
+class StreamDecoder:
+    """Push-style decompressor that hands its output to a callback in bounded pieces.
+
+    The callback may raise to stop decoding, so a compression bomb costs at
+    most one piece of memory however far it would expand.
+    """
+    def __init__(self, encoding):
+        self.emit = None
+        if encoding == "gzip":
+            self.inflater = zlib.decompressobj(wbits=31)
+        else:
+            self.inflater = None
+            self.writer = zstd.ZstdDecompressor().stream_writer(self, write_return_read=True)
+
+    def write(self, data):
+        # zstd output sink, called with up to one zstd block (128 KB) at a time
+        self.emit(data)
+        return len(data)
+
+    def feed(self, block, emit):
+        self.emit = emit
+        if self.inflater is None:
+            self.writer.write(block)
+            return
+        for out in _inflate(self.inflater, block):
+            emit(out)
+
+def _object_path(sha256, encoding="identity"):
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256 + ENCODING_SUFFIXES[encoding])
+
+def find_object(sha256):
+    """Return (path, encoding) of the stored object for sha256, or None."""
+    for encoding in ENCODING_SUFFIXES:
+        path = _object_path(sha256, encoding)
+        if os.path.exists(path):
+            return path, encoding
+    return None
+
+def _is_sha256(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+def _new_verifier(encoding, limit=None):
+    """State for checking an upload's uncompressed SHA256 and size as its bytes arrive.
+
+    Decoding stops with DecodeLimitExceeded once the output passes limit bytes.
+    """
+    decoder = StreamDecoder(encoding) if encoding != "identity" else None
+    return {"hash": hashlib.sha256(), "decoder": decoder, "raw_size": 0, "offset": 0, "limit": limit}
+
+def _verifier_take(state, data):
+    state["raw_size"] += len(data)
+    if state["limit"] is not None and state["raw_size"] > state["limit"]:
+        raise DecodeLimitExceeded(f"decompressed past the declared {state['limit']} bytes")
+    state["hash"].update(data)
+
+def _verifier_update(state, block):
+    state["offset"] += len(block)
+    if state["decoder"] is None:
+        _verifier_take(state, block)
+    else:
+        state["decoder"].feed(block, lambda data: _verifier_take(state, data))
+
+def _verify_file(path, encoding, length=None, limit=None):
+    """Run the first length bytes of path (whole file if None) through a fresh verifier."""
+    state = _new_verifier(encoding, limit)
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(HASH_READ_BLOCK if remaining is None else min(HASH_READ_BLOCK, remaining))
+            if not block:
+                break
+            _verifier_update(state, block)
+            if remaining is not None:
+                remaining -= len(block)
+    return state
+
+def lookup_file(filename):
+    """Return (sha256, size) for an indexed file name, or None."""
+    with db_read() as conn:
+        return conn.execute(SQL_LOOKUP_FILE, (filename,)).fetchone()
+
+def register_file(filename, sha256, size, client_id=None):
+    """Point filename at stored content. Returns False if the name already holds other content."""
+    stored_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+    def write(conn):
+        conn.execute(SQL_INSERT_FILE, (filename, sha256, size, client_id, stored_at))
+        return conn.execute(SQL_LOOKUP_FILE, (filename,)).fetchone()[0] == sha256
+
+    return db_write(write)
+
+def name_conflicts(filename, sha256):
+    existing = lookup_file(filename)
+    return existing is not None and existing[0] != sha256
+
+def store_object(tmp_path, sha256, encoding="identity"):
+    """Move a fully received, verified file into the object store (or drop it if already stored)."""
+    if find_object(sha256) is not None:
+        os.remove(tmp_path) # Duplicate content - keep the copy we already have
+        return
+    target = _object_path(sha256, encoding)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    _fsync_file(tmp_path)
+    os.replace(tmp_path, target) # Atomic: readers never see a partial object
+
+@app.route("/files/<sha256>", methods=["GET"])
+def file_exists(sha256):
+    """Cheap pre-check so clients can skip uploading content the server already has."""
+    stored = find_object(sha256) if _is_sha256(sha256) else None
+    if stored is None:
+        return jsonify({"exists": False}), 404
+    path, encoding = stored
+    return jsonify({"exists": True, "sha256": sha256, "encoding": encoding,
+                    "stored_size": os.path.getsize(path)})
+
 @app.route("/upload", methods=["POST"])
 def upload():
     file = request.files.get('file')
     if not file or not file.filename:
         return jsonify({"error": "no file"}), 400
-    save_path = os.path.join(GAMES_DIR, file.filename)
-    file.save(save_path)
-    return jsonify({"status": "saved", "file": file.filename})
+    filename = secure_filename(file.filename)
+    expected_sha256 = request.form.get("sha256")
+    # Write to a temp file first so a half-received upload never replaces a good one
+    tmp_path = os.path.join(INCOMING_DIR, f"{uuid.uuid4().hex}.part")
+    file.save(tmp_path)
+    verified = _verify_file(tmp_path, "identity")
+    sha256 = verified["hash"].hexdigest()
+    if expected_sha256 and expected_sha256 != sha256:
+        os.remove(tmp_path)
+        return jsonify({"error": "sha256 mismatch", "sha256": sha256}), 422
+    if name_conflicts(filename, sha256):
+        os.remove(tmp_path)
+        return jsonify({"error": "a different file with this name already exists"}), 409
+    metric_inc("lamb_upload_bytes_total", (("encoding", "identity"),), os.path.getsize(tmp_path))
+    store_object(tmp_path, sha256)
+    if not register_file(filename, sha256, verified["raw_size"], request.form.get("client_id")):
+        # Lost a race with another upload of this name; the stored content is harmless
+        return jsonify({"error": "a different file with this name already exists"}), 409
+    metric_inc("lamb_upload_raw_bytes_total", value=verified["raw_size"])
+    metric_inc("lamb_uploads_total", (("result", "saved"),))
+    return jsonify({"status": "saved", "file": filename, "sha256": sha256})
+
+# === Chunked, Resumable Uploads ===
+# Protocol: POST /upload/init -> PUT /upload/<id>?offset=N (repeat) -> POST /upload/<id>/finalize.
+# Chunks are appended to INCOMING_DIR/<id>.part; the part file's size is the
+# acknowledged offset, so both sides can resume after a failure or restart.
+# The upload id is derived from the file name, hash and encoding, which makes
+# init idempotent: a client that calls it again simply gets the current offset.
+# Offsets count bytes as sent, i.e. after compression.
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024 # Largest chunk a client should send
+UPLOAD_READ_BLOCK = 64 * 1024
+
+upload_locks = {} # upload_id -> lock, only for uploads with metadata on disk
+upload_locks_lock = threading.Lock()
+# upload_id -> verifier covering the received bytes; rebuilt from the part file if lost
+upload_verifiers = {}
+
+def _upload_id(filename, sha256, encoding, encoded_size):
+    return hashlib.sha256(f"{filename}:{sha256}:{encoding}:{encoded_size}".encode()).hexdigest()[:32]
+
+def _upload_paths(upload_id):
+    return (os.path.join(INCOMING_DIR, f"{upload_id}.part"),
+            os.path.join(INCOMING_DIR, f"{upload_id}.json"))
+
+def _upload_lock(upload_id, create=False):
+    """Lock serializing requests for one upload, or None if the upload is unknown.
+
+    Only init passes create; other requests get a lock only while the upload's
+    metadata exists, and _discard_upload drops it again.
+    """
+    with upload_locks_lock:
+        lock = upload_locks.get(upload_id)
+        if lock is None and (create or os.path.exists(_upload_paths(upload_id)[1])):
+            lock = upload_locks[upload_id] = threading.Lock()
+        return lock
+
+def _upload_verifier(upload_id, meta, part_path, offset):
+    """Verifier covering the first offset bytes of an upload. Caller holds the upload lock."""
+    state = upload_verifiers.get(upload_id)
+    if state is None or state["offset"] != offset:
+        # Server restarted or a chunk was rolled back: re-verify what is on disk
+        state = _verify_file(part_path, meta["encoding"], offset, limit=meta["size"])
+        upload_verifiers[upload_id] = state
+    return state
+
+def _discard_upload(upload_id):
+    for path in _upload_paths(upload_id):
+        if os.path.exists(path):
+            os.remove(path)
+    upload_verifiers.pop(upload_id, None)
+    with upload_locks_lock:
+        upload_locks.pop(upload_id, None)
+
+def _load_upload(upload_id):
+    """Return (meta, part_path, offset) for a pending upload, or None if unknown."""
+    part_path, meta_path = _upload_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    return meta, part_path, offset
+
+def count_pending_uploads():
+    """Chunked uploads started but not yet finalized or discarded, including ones from before a restart."""
+    try:
+        return sum(1 for name in os.listdir(INCOMING_DIR) if name.endswith(".json"))
+    except OSError:
+        return 0
+
+def _fsync_file(path):
+    with open(path, "rb") as f:
+        os.fsync(f.fileno())
+
+@app.route("/upload/encodings", methods=["GET"])
+def upload_encodings():
+    """Encodings the server accepts for chunked uploads, in order of preference."""
+    preferred = [e for e in ("zstd", "gzip") if e in ENCODING_SUFFIXES]
+    return jsonify({"encodings": preferred + ["identity"]})
+
+@app.route("/upload/init", methods=["POST"])
+def upload_init():
+    data = request.get_json(silent=True) or {}
+    filename = secure_filename(data.get("filename") or "")
+    size = data.get("size") # Uncompressed size
+    sha256 = data.get("sha256") # Of the uncompressed content
+    encoding = data.get("encoding", "identity")
+    encoded_size = data.get("encoded_size", size) # Bytes that will be sent
+    if not filename or any(isinstance(n, bool) or not isinstance(n, int) or n < 0 for n in (size, encoded_size)):
+        return jsonify({"error": "filename and size are required"}), 400
+    if not _is_sha256(sha256):
+        return jsonify({"error": "sha256 must be a lowercase hex SHA256 digest"}), 400
+    if encoding not in ENCODING_SUFFIXES:
+        return jsonify({"error": f"unsupported encoding {encoding}", "encodings": SUPPORTED_ENCODINGS}), 415
+
+    if name_conflicts(filename, sha256):
+        return jsonify({"error": "a different file with this name already exists"}), 409
+    if find_object(sha256) is not None:
+        # Content is already stored (retry after a crash, or a duplicate file): just index the name
+        if not register_file(filename, sha256, size, data.get("client_id")):
+            return jsonify({"error": "a different file with this name already exists"}), 409
+        metric_inc("lamb_uploads_total", (("result", "exists"),))
+        print(f"[SERVER] Upload of {filename} skipped: content {sha256[:16]}... already stored")
+        return jsonify({"status": "exists", "file": filename, "sha256": sha256})
+
+    upload_id = _upload_id(filename, sha256, encoding, encoded_size)
+    with _upload_lock(upload_id, create=True):
+        pending = _load_upload(upload_id)
+        if pending is None:
+            part_path, meta_path = _upload_paths(upload_id)
+            try:
+                open(part_path, "wb").close()
+                with open(meta_path, "w") as f:
+                    json.dump({"filename": filename, "size": size, "sha256": sha256, "encoding": encoding,
+                               "encoded_size": encoded_size, "client_id": data.get("client_id"),
+                               "created": time.time()}, f)
+            except OSError:
+                _discard_upload(upload_id)
+                raise
+            offset = 0
+        else:
+            offset = pending[2]
+
+    print(f"[SERVER] Upload {upload_id} for {filename} ({encoding}): {offset}/{encoded_size} bytes already received")
+    return jsonify({"upload_id": upload_id, "offset": offset, "size": encoded_size, "chunk_size": UPLOAD_CHUNK_SIZE})
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    pending = _load_upload(secure_filename(upload_id))
+    if pending is None:
+        return jsonify({"error": "unknown upload"}), 404
+    meta, _, offset = pending
+    return jsonify({"upload_id": upload_id, "offset": offset, "size": meta["encoded_size"]})
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    upload_id = secure_filename(upload_id)
+    try:
+        offset = int(request.args.get("offset", ""))
+    except ValueError:
+        return jsonify({"error": "offset is required"}), 400
+    length = request.content_length
+    if length is None:
+        return jsonify({"error": "Content-Length is required"}), 411
+    if length > UPLOAD_CHUNK_SIZE:
+        return jsonify({"error": f"chunk larger than {UPLOAD_CHUNK_SIZE} bytes"}), 413
+
+    lock = _upload_lock(upload_id)
+    if lock is None:
+        return jsonify({"error": "unknown upload"}), 404
+    with lock:
+        pending = _load_upload(upload_id)
+        if pending is None:
+            return jsonify({"error": "unknown upload"}), 404
+        meta, part_path, current = pending
+        if offset != current:
+            # Client is out of sync (e.g. a previous chunk was lost); tell it where to resume
+            return jsonify({"error": "offset mismatch", "offset": current}), 409
+        if offset + length > meta["encoded_size"]:
+            return jsonify({"error": "chunk exceeds declared size", "offset": current}), 400
+
+        # Decode and hash while streaming to disk so finalize never has to re-read the file
+        verifier = _upload_verifier(upload_id, meta, part_path, current)
+        received = 0
+        try:
+            with open(part_path, "ab") as f:
+                while received < length:
+                    block = request.stream.read(min(UPLOAD_READ_BLOCK, length - received))
+                    if not block:
+                        break
+                    f.write(block)
+                    _verifier_update(verifier, block)
+                    received += len(block)
+        except DECODE_ERRORS as e:
+            # Not valid compressed data, or more than it declared; nothing received so far can be trusted
+            _discard_upload(upload_id)
+            return jsonify({"error": f"corrupt {meta['encoding']} stream: {e}"}), 422
+        if received < length:
+            # Truncated body: drop the partial chunk so the offset stays on a chunk boundary
+            os.truncate(part_path, current)
+            upload_verifiers.pop(upload_id, None)
+            return jsonify({"error": "incomplete chunk", "offset": current}), 400
+
+    metric_inc("lamb_upload_bytes_total", (("encoding", meta["encoding"]),), received)
+    return jsonify({"upload_id": upload_id, "offset": current + received})
+
+@app.route("/upload/<upload_id>/finalize", methods=["POST"])
+def upload_finalize(upload_id):
+    upload_id = secure_filename(upload_id)
+    lock = _upload_lock(upload_id)
+    if lock is None:
+        return jsonify({"error": "unknown upload"}), 404
+    with lock:
+        pending = _load_upload(upload_id)
+        if pending is None:
+            return jsonify({"error": "unknown upload"}), 404
+        meta, part_path, offset = pending
+        if offset != meta["encoded_size"]:
+            return jsonify({"error": "upload incomplete", "offset": offset, "size": meta["encoded_size"]}), 409
+
+        verifier = _upload_verifier(upload_id, meta, part_path, offset)
+        sha256 = verifier["hash"].hexdigest()
+        if sha256 != meta["sha256"] or verifier["raw_size"] != meta["size"]:
+            # Corrupt transfer: throw it away so the client starts over from zero
+            _discard_upload(upload_id)
+            metric_inc("lamb_uploads_total", (("result", "rejected"),))
+            print(f"[SERVER] Upload {upload_id} rejected: sha256 {sha256[:16]}... != declared {meta['sha256'][:16]}...")
+            return jsonify({"error": "sha256 mismatch", "sha256": sha256}), 422
+        if name_conflicts(meta["filename"], sha256):
+            _discard_upload(upload_id)
+            return jsonify({"error": "a different file with this name already exists"}), 409
+        store_object(part_path, sha256, meta["encoding"])
+        registered = register_file(meta["filename"], sha256, meta["size"], meta.get("client_id"))
+        _discard_upload(upload_id)
+        if not registered:
+            # Another upload claimed the name after the check above
+            return jsonify({"error": "a different file with this name already exists"}), 409
+    metric_inc("lamb_upload_raw_bytes_total", value=meta["size"])
+    metric_inc("lamb_uploads_total", (("result", "saved"),))
+    if "created" in meta: # Uploads started before the server recorded start times have none
+        metric_observe("lamb_upload_duration_seconds", time.time() - meta["created"])
+
+    print(f"[SERVER] Upload {upload_id} complete: {meta['filename']} "
+          f"({meta['size']} bytes, {meta['encoded_size']} sent as {meta['encoding']}, {sha256[:16]}...)")
+    return jsonify({"status": "saved", "file": meta["filename"], "sha256": sha256})
+
+def _decode_stream(path, encoding):
+    """Yield the uncompressed content of a stored object, at most DECODE_OUTPUT_BLOCK bytes at a time."""
+    with open(path, "rb") as f:
+        if encoding == "zstd":
+            yield from zstd.ZstdDecompressor().read_to_iter(f, read_size=HASH_READ_BLOCK,
+                                                            write_size=DECODE_OUTPUT_BLOCK)
+            return
+        decoder = zlib.decompressobj(wbits=31)
+        for block in iter(lambda: f.read(HASH_READ_BLOCK), b""):
+            yield from _inflate(decoder, block)
 
 @app.route("/download/<filename>")
 def download(filename):
-    return send_from_directory(GAMES_DIR, filename, as_attachment=True)
+    indexed = lookup_file(filename)
+    stored = find_object(indexed[0]) if indexed is not None else None
+    if stored is None:
+        # Files uploaded before content-addressed storage existed
+        return send_from_directory(os.path.abspath(GAMES_DIR), filename, as_attachment=True)
+
+    # Absolute: Flask resolves relative paths against the app's root, not the cwd the data dirs live in
+    path, encoding = os.path.abspath(stored[0]), stored[1]
+    sha256 = indexed[0]
+    if encoding == "identity":
+        return send_file(path, as_attachment=True, download_name=filename, etag=sha256, conditional=True)
+    if encoding in request.accept_encodings:
+        # Let the client decompress: send the stored bytes as they are
+        response = send_file(path, as_attachment=True, download_name=filename,
+                             mimetype="application/octet-stream", etag=f"{sha256}-{encoding}", conditional=True)
+        response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
+    response = Response(_decode_stream(path, encoding), mimetype="application/octet-stream")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    response.headers["ETag"] = f'"{sha256}"'
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
 
 @app.route("/download_engine")
 def download_engine():
-    """Provides the lamb binary for download."""
-    directory = os.path.dirname(os.path.abspath(__file__))
-    print(f"[SERVER] Engine download request received. Serving from: {directory}")
-    return send_from_directory(directory, LAMB_BINARY_PATH, as_attachment=True)
+    """Provides the lamb binary for download.
+
+    The ETag is the binary's SHA256, so clients can skip unchanged engines with
+    If-None-Match and resume interrupted downloads with Range + If-Range.
+    """
+    engine_hash = get_engine_hash()
+    if engine_hash is None:
+        return jsonify({"error": "engine binary not available"}), 404
+    print(f"[SERVER] Engine download request received ({request.headers.get('Range', 'full')})")
+    response = send_file(LAMB_BINARY_PATH.absolute(), as_attachment=True, download_name=LAMB_BINARY_PATH.name,
+                         mimetype="application/octet-stream", etag=engine_hash, conditional=True)
+    response.headers["X-Engine-SHA256"] = engine_hash
+    return response
+
+@app.route("/reload_engine", methods=["POST"])
+def reload_engine():
+    """Rehash the engine binary now, e.g. right after deploying a new build.
+
+    mode=drain (default) lets running batches finish on the old binary;
+    mode=preempt makes clients stop them first, also when the watcher has
+    already published the new binary as drain. Otherwise nothing is left pending.
+    """
+    mode = request.values.get("mode", "drain")
+    if mode not in RELOAD_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(RELOAD_MODES)}"}), 400
+    changed = refresh_engine(force=True, mode=mode)
+    return jsonify({"status": "reloaded" if changed else "unchanged", "mode": mode, "current": get_engine_info()})
+
+@app.route("/debug_engine")
+def debug_engine():
+    result = "<h1>Engine</h1><table border=1>"
+    for key, value in get_engine_info().items():
+        result += f"<tr><th>{key}</th><td>{value}</td></tr>"
+    result += "</table><h2>Known Versions</h2><table border=1><tr><th>Version</th><th>SHA256</th><th>Size</th><th>First Seen</th></tr>"
+    with db_read() as conn:
+        rows = conn.execute("SELECT id, sha256, size, first_seen FROM engine_versions ORDER BY id DESC").fetchall()
+    for row in rows:
+        result += f"<tr><td>{row[0]}</td><td><code>{row[1]}</code></td><td>{row[2]}</td><td>{row[3]}</td></tr>"
+    result += "</table>"
+    return result
 
 @app.route("/debug_db_status")
 def debug_db_status():
@@ -688,21 +2293,20 @@ def debug_db_status():
 
         # Try to connect and count rows
         try:
-            conn = sqlite3.connect(DB_PATH)
-            cursor = conn.cursor()
+            with db_read() as conn:
+                # Count clients
+                client_count = conn.execute("SELECT COUNT(*) FROM clients").fetchone()[0]
 
-            # Count clients
-            cursor.execute("SELECT COUNT(*) FROM clients")
-            client_count = cursor.fetchone()[0]
+                # Count runs
+                run_count = conn.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
 
-            # Count runs
-            cursor.execute("SELECT COUNT(*) FROM runs")
-            run_count = cursor.fetchone()[0]
+                journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+                schema_version = get_schema_version(conn)
 
             result += f"<p>Clients in DB: {client_count}</p>"
             result += f"<p>Runs in DB: {run_count}</p>"
-
-            conn.close()
+            result += f"<p>Journal mode: {journal_mode}</p>"
+            result += f"<p>Schema version: {schema_version} (server expects {SCHEMA_VERSION})</p>"
         except Exception as e:
             result += f"<p>Error accessing DB: {e}</p>"
     else:
@@ -712,35 +2316,27 @@ def debug_db_status():
 
 @app.route("/debug_db")
 def debug_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM runs ORDER BY timestamp DESC LIMIT 10")
-    rows = cursor.fetchall()
-    conn.close()
+    with db_read() as conn:
+        rows = conn.execute("SELECT * FROM runs ORDER BY timestamp DESC LIMIT 10").fetchall()
 
     result = "<h1>Latest Runs</h1><table border=1>"
-    result += "<tr><th>ID</th><th>Client ID</th><th>File</th><th>Games</th><th>Positions</th><th>Status</th><th>Timestamp</th></tr>"
+    result += "<tr><th>ID</th><th>Client ID</th><th>File</th><th>Games</th><th>Positions</th><th>Status</th><th>Timestamp</th><th>Engine</th></tr>"
     for row in rows:
-        result += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td><td>{row[4]}</td><td>{row[5]}</td><td>{row[6]}</td></tr>"
+        result += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td><td>{row[4]}</td><td>{row[5]}</td><td>{row[6]}</td><td>{row[7]}</td></tr>"
     result += "</table>"
     return result
 
 @app.route("/debug_db_full")
 def debug_db_full():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
     # Check all recent runs
-    cursor.execute("SELECT * FROM runs ORDER BY timestamp DESC LIMIT 20")
-    rows = cursor.fetchall()
+    with db_read() as conn:
+        rows = conn.execute("SELECT * FROM runs ORDER BY timestamp DESC LIMIT 20").fetchall()
 
     result = "<h1>All Recent Runs in DB</h1><table border=1>"
-    result += "<tr><th>ID</th><th>Client ID</th><th>File</th><th>Games</th><th>Positions</th><th>Status</th><th>Timestamp</th></tr>"
+    result += "<tr><th>ID</th><th>Client ID</th><th>File</th><th>Games</th><th>Positions</th><th>Status</th><th>Timestamp</th><th>Engine</th></tr>"
     for row in rows:
-        result += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td><td>{row[4]}</td><td>{row[5]}</td><td>{row[6]}</td></tr>"
+        result += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td><td>{row[4]}</td><td>{row[5]}</td><td>{row[6]}</td><td>{row[7]}</td></tr>"
     result += "</table>"
-
-    conn.close()
     return result
 
 @app.route("/debug_runs")
@@ -756,34 +2352,207 @@ def debug_runs():
 @app.route("/debug_clients")
 def debug_clients():
     result = "<h1>Clients in Memory</h1><table border=1>"
-    result += "<tr><th>Client ID</th><th>Name</th><th>IP</th><th>Last Seen</th><th>Progress</th></tr>"
+    result += "<tr><th>Client ID</th><th>Name</th><th>IP</th><th>Last Seen</th><th>Progress</th><th>Worker Cap</th></tr>"
     for client_id, client_data in clients.items():
-        result += f"<tr><td>{client_id}</td><td>{client_data['name']}</td><td>{client_data['ip']}</td><td>{client_data['last_seen']}</td><td>{client_data['progress']}</td></tr>"
+        result += f"<tr><td>{client_id}</td><td>{client_data['name']}</td><td>{client_data['ip']}</td><td>{client_data['last_seen']}</td><td>{client_data['progress']}</td><td>{client_caps.get(client_id, '-')}</td></tr>"
     result += "</table>"
     return result
 
-@app.route("/live_data") # Add this new route
-def live_data():
+@app.route("/debug_ingest")
+def debug_ingest():
+    stats = get_ingest_stats()
+    result = "<h1>Progress Ingest Queue</h1><table border=1>"
+    for key, value in stats.items():
+        if isinstance(value, float):
+            value = f"{value:.2f}"
+        result += f"<tr><th>{key}</th><td>{value}</td></tr>"
+    result += "</table>"
+    return result
+
+@app.route("/debug_batches")
+def debug_batches():
+    rows = get_batch_stats()
+    phases = sorted({phase for row in rows for phase in row["avg_phase_seconds"]})
+    result = "<h1>Batch Accounting (since server start)</h1><table border=1>"
+    result += ("<tr><th>Name</th><th>Batches</th><th>Failed</th><th>Positions</th><th>Avg Wall s</th>"
+               "<th>CPU s</th><th>Pos/CPU-s</th><th>Cores/Batch</th><th>Peak RSS MB</th>"
+               + "".join(f"<th>Avg {phase} s</th>" for phase in phases) + "<th>Updated</th></tr>")
+    for row in rows:
+        result += (f"<tr><td>{row['name']}</td><td>{row['batches']}</td><td>{row['failed']}</td>"
+                   f"<td>{row['positions']:,}</td><td>{row['avg_wall_seconds']:.1f}</td>"
+                   f"<td>{row['cpu_seconds']:.0f}</td><td>{row['positions_per_cpu_sec']:.1f}</td>"
+                   f"<td>{row['cores_per_batch']:.2f}</td><td>{row['max_rss_kb'] / 1024:.0f}</td>"
+                   + "".join(f"<td>{row['avg_phase_seconds'].get(phase, 0):.2f}</td>" for phase in phases)
+                   + f"<td>{row['updated']}</td></tr>")
+    result += "</table>"
+    return result
+
+# === Live Data Snapshot ===
+# /live_data and the dashboard page share one snapshot, rebuilt at most every
+# LIVE_SNAPSHOT_INTERVAL seconds by the first request that finds it stale; other
+# requests keep getting the previous snapshot meanwhile (single flight). The
+# version only moves when the content changes, and each client row remembers
+# the version it last changed in, so /live_data?since=<version> sends just the
+# changed rows. Versions start at the server's start time, so after a restart
+# they are higher than any version a dashboard still holds.
+LIVE_SNAPSHOT_INTERVAL = 5
+LIVE_FIRST_VERSION = int(time.time())
+
+live_snapshot_lock = threading.Lock() # Held by the one request rebuilding the snapshot
+live_snapshot = {
+    "built": float("-inf"), "version": LIVE_FIRST_VERSION - 1, "digest": None, "data": None, "body": None,
+    "rows": {},    # client_id -> (version it last changed in, row)
+    "removed": {}, # client_id -> version it disappeared in
+}
+
+def _build_live_data():
     runs = get_latest_runs()
+    for run in runs:
+        run["pos_per_sec"] = round(run["pos_per_sec"]) # Whole pos/s, so idle rows stay unchanged
     total_games, total_positions = get_total_stats()
-    positions_last_hour = get_positions_last_hour() # Calculate for live data endpoint
-    # Include the current parameters as well, maybe only the ones you want to display
-    current_params = parameters # You might want a subset or formatted version
-    # Get the engine hash for live data endpoint too (if needed by GUI later)
-    engine_hash = get_engine_hash()
-    return jsonify({
+    engine = get_engine_info()
+    return {
         "runs": runs,
         "total_games": total_games,
         "total_positions": total_positions,
-        "positions_last_hour": positions_last_hour, # Include the new metric
-        "parameters": current_params, # Include if you want to update param display too
-        "engine_hash": engine_hash, # Include hash
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat() # Optional: to see the update time
-    })
+        "positions_last_hour": get_positions_last_hour(),
+        "rates": get_rates(), # Fleet positions/sec over 1m, 15m, 1h and 24h
+        "parameters": dict(parameters),
+        "engine_hash": engine["hash"],
+        "engine_version": engine["version"],
+        "job": get_job_status(),
+    }
+
+def get_live_snapshot():
+    """Return the current live snapshot, rebuilding it first if it is stale."""
+    global live_snapshot
+    snapshot = live_snapshot
+    if time.monotonic() - snapshot["built"] < LIVE_SNAPSHOT_INTERVAL:
+        return snapshot
+    # Only the very first build makes requests wait; later ones serve the previous snapshot
+    if not live_snapshot_lock.acquire(blocking=snapshot["data"] is None):
+        return snapshot
+    try:
+        snapshot = live_snapshot
+        if time.monotonic() - snapshot["built"] < LIVE_SNAPSHOT_INTERVAL:
+            return snapshot # Rebuilt while we waited for the lock
+        data = _build_live_data()
+        digest = hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+        if digest == snapshot["digest"]:
+            live_snapshot = {**snapshot, "built": time.monotonic()}
+            return live_snapshot
+
+        version = snapshot["version"] + 1
+        rows = {}
+        for run in data["runs"]:
+            previous = snapshot["rows"].get(run["client_id"])
+            rows[run["client_id"]] = previous if previous and previous[1] == run else (version, run)
+        removed = {client_id: v for client_id, v in snapshot["removed"].items() if client_id not in rows}
+        removed.update({client_id: version for client_id in snapshot["rows"] if client_id not in rows})
+        data["version"] = version
+        data["timestamp"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        live_snapshot = {"built": time.monotonic(), "version": version, "digest": digest, "data": data,
+                         "body": json.dumps(data).encode(), "rows": rows, "removed": removed}
+        return live_snapshot
+    finally:
+        live_snapshot_lock.release()
+
+@app.route("/live_data") # Add this new route
+def live_data():
+    """Dashboard data from the shared snapshot; since=<version> returns only the client rows changed after it."""
+    snapshot = get_live_snapshot()
+    headers = {"ETag": f'"live-{snapshot["version"]}"', "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == headers["ETag"]:
+        return "", 304, headers
+
+    since = request.args.get("since", type=int)
+    if since is None or not LIVE_FIRST_VERSION <= since <= snapshot["version"]:
+        # No version, or one from before a restart: send everything
+        return Response(snapshot["body"], mimetype="application/json", headers=headers)
+    delta = {key: value for key, value in snapshot["data"].items() if key != "runs"}
+    delta.update(delta=True, since=since,
+                 runs=[row for version, row in snapshot["rows"].values() if version > since],
+                 removed=[client_id for client_id, version in snapshot["removed"].items() if version > since])
+    response = jsonify(delta)
+    response.headers.update(headers)
+    return response
+
+@app.before_request
+def _start_request_timer():
+    request.environ["lamb.start"] = time.perf_counter()
+
+@app.after_request
+def _count_request(response):
+    start = request.environ.get("lamb.start")
+    if start is not None:
+        # The route pattern, not the path, so ids in URLs don't explode the label set
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metric_inc("lamb_http_requests_total",
+                   (("route", route), ("method", request.method), ("status", str(response.status_code))))
+        metric_observe("lamb_http_request_duration_seconds", time.perf_counter() - start,
+                       (("route", route), ("method", request.method)))
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    ingest = get_ingest_stats()
+    engine = get_engine_info()
+    job = get_job_status()
+    now = time.time()
+    with throughput_lock:
+        active_clients = sum(1 for ring in client_throughput.values() if ring.total(now, CLIENT_RATE_WINDOW))
+    gauges = [
+        ("lamb_ingest_queue_depth", "Progress requests waiting for the writer thread", [((), ingest["queue_depth"])]),
+        ("lamb_ingest_last_commit_seconds", "Latency of the latest ingest commit",
+         [((), ingest["last_commit_ms"] / 1000)]),
+        ("lamb_upload_pending", "Chunked uploads in progress", [((), count_pending_uploads())]),
+        ("lamb_engine_info", "Engine the server currently serves",
+         [((("sha256", engine["hash"] or ""), ("version", engine["version"] or "")), 1 if engine["hash"] else 0)]),
+        ("lamb_engine_loaded_timestamp_seconds", "When the engine hash was last computed",
+         [((), datetime.datetime.fromisoformat(engine["loaded_at"]).timestamp() if engine["loaded_at"] else 0)]),
+        ("lamb_clients_registered", "Clients known to this server process", [((), len(clients))]),
+        ("lamb_clients_active", "Clients that reported positions within the client rate window",
+         [((), active_clients)]),
+        ("lamb_positions_per_second", "Fleet positions/sec by window",
+         [((("window", name),), rate) for name, rate in get_rates().items()]),
+        ("lamb_parameters_version", "Current parameters version", [((), parameters_version)]),
+        ("lamb_job_positions", "Positions completed in the current job", [((), job["positions"])]),
+        ("lamb_job_target_positions", "Position target of the current job (0 = none)", [((), job["target"])]),
+        ("lamb_leases_outstanding", "Work leases currently held by clients", [((), job["outstanding_leases"])]),
+    ]
+    counters = [
+        ("lamb_ingest_rows_committed_total", "Progress rows committed since start", [((), ingest["committed_rows"])]),
+        ("lamb_ingest_rows_rejected_total", "Progress rows rejected with 503 (queue full) since start",
+         [((), ingest["rejected"])]),
+        ("lamb_ingest_failed_batches_total", "Ingest batches dropped after retries since start",
+         [((), ingest["failed_batches"])]),
+    ]
+    batches = get_batch_stats()
+    # Names can repeat across clients, so series are keyed by client_id; join on
+    # lamb_client_info to show names
+    gauges += [
+        ("lamb_client_info", "Name of each client that reported batches",
+         [((("client_id", row["client_id"]), ("name", row["name"])), 1) for row in batches]),
+        ("lamb_client_positions_per_cpu_second", "Positions per lamb CPU-second, by client",
+         [((("client_id", row["client_id"]),), row["positions_per_cpu_sec"]) for row in batches]),
+        ("lamb_client_peak_rss_bytes", "Largest lamb peak RSS reported, by client",
+         [((("client_id", row["client_id"]),), row["max_rss_kb"] * 1024) for row in batches]),
+    ]
+    counters += [
+        ("lamb_client_batches_total", "Batches reported by each client since server start",
+         [((("client_id", row["client_id"]),), row["batches"]) for row in batches]),
+        ("lamb_client_phase_seconds_total", "Batch seconds spent per phase since server start, by client",
+         [((("client_id", row["client_id"]), ("phase", phase)), seconds)
+          for row in batches for phase, seconds in sorted(row["phase_seconds"].items())]),
+    ]
+    return Response(render_metrics(gauges, counters), mimetype="text/plain; version=0.0.4")
 
 if __name__ == "__main__":
     os.makedirs("templates", exist_ok=True)
     with open("templates/gui.html", "w") as f:
         f.write(HTML_GUI)
+    # Turn SIGTERM (systemd stop, kill) into a normal exit so atexit flushes the ingest queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     print("🐑 Lamb Server → http://0.0.0.0:5001")
     app.run(host="0.0.0.0", port=5001, debug=False, threaded=True)
\ No newline at end of file
@@ -0,0 +1,30 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """server.py imported in a scratch directory: it creates server_data/ and its DB in the cwd on import."""
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("server"))
+    try:
+        yield importlib.import_module("server")
+    finally:
+        os.chdir(previous)
+
+@pytest.fixture(scope="session")
+def client(tmp_path_factory):
+    """client.py imported in a scratch directory: it parses sys.argv and creates data/ in the cwd on import."""
+    previous, argv = os.getcwd(), sys.argv
+    os.chdir(tmp_path_factory.mktemp("client"))
+    sys.argv = ["client.py", "--name", "test", "--server", "http://127.0.0.1:1"]
+    try:
+        yield importlib.import_module("client")
+    finally:
+        sys.argv = argv
+        os.chdir(previous)
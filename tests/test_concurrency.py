@@ -0,0 +1,30 @@
+import pytest
+
+@pytest.fixture
+def idle(client, monkeypatch):
+    """An idle 8-core machine with plenty of memory."""
+    monkeypatch.setattr(client, "CPU_COUNT", 8)
+    monkeypatch.setattr(client, "read_loadavg", lambda: 0.0)
+    monkeypatch.setattr(client, "read_steal_percent", lambda: 0.0)
+    monkeypatch.setattr(client, "read_meminfo", lambda: (64 << 20, 64 << 20))
+
+def _bounds(client, monkeypatch, auto, low, high):
+    monkeypatch.setattr(client, "AUTO_CONCURRENCY", auto)
+    monkeypatch.setattr(client, "MIN_CONCURRENCY", low)
+    monkeypatch.setattr(client, "MAX_CONCURRENCY", high)
+
+def test_cap_below_fixed_concurrency_wins(client, monkeypatch):
+    _bounds(client, monkeypatch, False, 4, 4)
+    assert client.target_concurrency(4, cap=1) == (1, "server cap")
+    assert client.target_concurrency(4) == (4, "fixed")
+
+def test_cap_below_min_concurrency_wins(client, monkeypatch, idle):
+    _bounds(client, monkeypatch, True, 3, 8)
+    assert client.target_concurrency(3, cap=1)[0] == 1
+    assert client.target_concurrency(1, cap=2)[0] == 2
+    assert client.target_concurrency(1)[0] == 3 # Without a cap the floor applies again
+
+def test_cap_limits_growth(client, monkeypatch, idle):
+    _bounds(client, monkeypatch, True, 1, 8)
+    assert client.target_concurrency(4, cap=4)[0] == 4
+    assert client.target_concurrency(4)[0] == 5
@@ -0,0 +1,60 @@
+import hashlib
+
+import pytest
+
+ENGINE = b"engine build 2"
+
+class FakeResponse:
+    def __init__(self, status_code, body=b""):
+        self.status_code, self.body = status_code, body
+        self.headers = {"X-Engine-SHA256": hashlib.sha256(ENGINE).hexdigest()}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AssertionError(f"unexpected {self.status_code}")
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+@pytest.fixture
+def engine_server(client, tmp_path, monkeypatch):
+    """Serves ENGINE like /download_engine does; returns the Range headers the client sent."""
+    ranges = []
+
+    def http_request(method, path, headers=None, **kwargs):
+        start = headers.get("Range")
+        ranges.append(start)
+        if start is None:
+            return FakeResponse(200, ENGINE)
+        offset = int(start[len("bytes="):-1])
+        if offset >= len(ENGINE):
+            return FakeResponse(416)
+        return FakeResponse(206, ENGINE[offset:])
+
+    monkeypatch.setattr(client, "http_request", http_request)
+    monkeypatch.setattr(client, "LAMB_BINARY", tmp_path / "lambergar")
+    return ranges
+
+def _leftover(client, content):
+    tmp_path = client.LAMB_BINARY.with_name(client.LAMB_BINARY.name + ".download")
+    tmp_path.write_bytes(content)
+    return tmp_path
+
+@pytest.mark.parametrize("leftover", [ENGINE, b"x" * (len(ENGINE) + 5)], ids=["complete", "too long"])
+def test_unresumable_leftover_restarts_from_zero(client, engine_server, leftover):
+    tmp_path = _leftover(client, leftover)
+    assert client.download_engine_from_server(hashlib.sha256(ENGINE).hexdigest())
+    assert engine_server == [f"bytes={len(leftover)}-", None]
+    assert client.LAMB_BINARY.read_bytes() == ENGINE and not tmp_path.exists()
+
+def test_bad_prefix_restarts_from_zero(client, engine_server):
+    tmp_path = _leftover(client, b"bad ")
+    assert client.download_engine_from_server(hashlib.sha256(ENGINE).hexdigest())
+    assert engine_server == ["bytes=4-", None]
+    assert client.LAMB_BINARY.read_bytes() == ENGINE and not tmp_path.exists()
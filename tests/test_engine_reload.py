@@ -0,0 +1,33 @@
+import pytest
+
+@pytest.fixture
+def engine(server, tmp_path, monkeypatch):
+    """A scratch engine binary the server tracks from a clean state."""
+    binary = tmp_path / "lambergar"
+    binary.write_bytes(b"build 1")
+    monkeypatch.setattr(server, "LAMB_BINARY_PATH", str(binary))
+    monkeypatch.setattr(server, "_engine_stat", None)
+    monkeypatch.setattr(server, "_engine_preempted_version", None)
+    monkeypatch.setitem(server.engine_state, "hash", None)
+    server.refresh_engine()
+    return binary
+
+def test_preempt_after_the_watcher_published_the_build(server, engine):
+    engine.write_bytes(b"build 2")
+    assert server.refresh_engine() # The watcher gets there first and publishes drain
+    drained = server.parameters_version
+    assert server.restart_required_version < drained
+
+    response = server.app.test_client().post("/reload_engine?mode=preempt")
+    assert response.get_json()["status"] == "reloaded"
+    assert server.restart_required_version == server.parameters_version > drained
+
+    # Once preempted, the same build is not republished
+    response = server.app.test_client().post("/reload_engine?mode=preempt")
+    assert response.get_json()["status"] == "unchanged"
+
+def test_drain_reload_of_the_same_build_is_unchanged(server, engine):
+    version = server.parameters_version
+    response = server.app.test_client().post("/reload_engine")
+    assert response.get_json()["status"] == "unchanged"
+    assert server.parameters_version == version
@@ -0,0 +1,62 @@
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+
+REFUSED = requests.exceptions.ConnectionError(
+    MaxRetryError(None, "/lease", reason=NewConnectionError(None, "Connection refused")))
+ABORTED = requests.exceptions.ConnectionError(ProtocolError("Connection aborted.", ConnectionResetError()))
+
+class Answer:
+    def __init__(self, status_code):
+        self.status_code, self.headers = status_code, {}
+
+    def close(self):
+        pass
+
+@pytest.fixture
+def send(client, monkeypatch):
+    """Make http_request's session fail with or answer each outcome in turn; returns the attempts made."""
+    attempts = []
+
+    class Session:
+        def request(self, method, url, **kwargs):
+            outcome = outcomes[len(attempts)]
+            attempts.append(method)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return Answer(outcome)
+
+    outcomes = []
+    monkeypatch.setattr(client, "http_session", lambda: Session())
+    monkeypatch.setattr(client.time, "sleep", lambda delay: None)
+
+    def run(method, *answers):
+        outcomes[:] = answers
+        attempts.clear()
+        try:
+            return client.http_request(method, "/lease", retries=3).status_code, len(attempts)
+        except requests.exceptions.RequestException as e:
+            return e, len(attempts)
+    return run
+
+@pytest.mark.parametrize("failure", [REFUSED, requests.exceptions.ConnectTimeout()])
+def test_post_is_retried_when_it_never_connected(send, failure):
+    assert send("POST", failure, 200) == (200, 2)
+
+@pytest.mark.parametrize("failure", [ABORTED, requests.exceptions.ReadTimeout()])
+def test_post_is_not_retried_once_it_may_have_been_applied(send, failure):
+    assert send("POST", failure, 200) == (failure, 1)
+
+def test_post_is_retried_only_on_503(send):
+    assert send("POST", 503, 200) == (200, 2)
+    assert send("POST", 504, 200) == (504, 1)
+
+def test_get_is_retried_on_any_failure(send):
+    assert send("GET", ABORTED, requests.exceptions.ReadTimeout(), 504, 200) == (200, 4)
+
+@pytest.mark.parametrize("failure, kept", [(REFUSED, True), (ABORTED, False)])
+def test_progress_batch_is_kept_only_if_the_server_never_saw_it(client, monkeypatch, failure, kept):
+    def fail(*args, **kwargs):
+        raise failure
+    monkeypatch.setattr(client, "http_request", fail)
+    assert client.send_progress_batch([{"client_id": "c"}]) is not kept
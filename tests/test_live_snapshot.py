@@ -0,0 +1,76 @@
+import pytest
+
+@pytest.fixture
+def live(server, monkeypatch):
+    """Fresh snapshot state, rebuilt on every call, built from the runs in the returned list."""
+    runs = []
+    monkeypatch.setattr(server, "LIVE_SNAPSHOT_INTERVAL", 0)
+    monkeypatch.setattr(server, "_build_live_data",
+                        lambda: {"runs": [dict(run) for run in runs], "total_positions": sum(r["positions"] for r in runs)})
+    monkeypatch.setattr(server, "live_snapshot", {
+        "built": float("-inf"), "version": server.LIVE_FIRST_VERSION - 1, "digest": None, "data": None, "body": None,
+        "rows": {}, "removed": {},
+    })
+    return runs
+
+def _run(client_id, positions):
+    return {"client_id": client_id, "positions": positions}
+
+def _delta(server, since):
+    response = server.app.test_client().get(f"/live_data?since={since}")
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_version_only_moves_when_content_changes(server, live):
+    live.append(_run("a", 1))
+    first = server.get_live_snapshot()["version"]
+    assert first == server.LIVE_FIRST_VERSION
+    assert server.get_live_snapshot()["version"] == first
+    live[0]["positions"] = 2
+    assert server.get_live_snapshot()["version"] == first + 1
+
+def test_since_returns_changed_and_removed_rows(server, live):
+    live.extend([_run("a", 1), _run("b", 1), _run("c", 1)])
+    v1 = server.get_live_snapshot()["version"]
+    live[1]["positions"] = 5 # b changes
+    del live[2] # c goes away
+    live.append(_run("d", 1)) # d is new
+    v2 = server.get_live_snapshot()["version"]
+
+    delta = _delta(server, v1)
+    assert delta["delta"] is True
+    assert sorted(run["client_id"] for run in delta["runs"]) == ["b", "d"]
+    assert delta["removed"] == ["c"]
+    assert delta["total_positions"] == 7
+
+    current = _delta(server, v2)
+    assert current["runs"] == [] and current["removed"] == []
+
+def test_removed_row_that_returns_is_sent_as_changed(server, live):
+    live.extend([_run("a", 1), _run("b", 1)])
+    v1 = server.get_live_snapshot()["version"]
+    del live[1]
+    server.get_live_snapshot()
+    live.append(_run("b", 1))
+    server.get_live_snapshot()
+
+    delta = _delta(server, v1)
+    assert [run["client_id"] for run in delta["runs"]] == ["b"]
+    assert delta["removed"] == []
+
+def test_unknown_since_gets_the_full_snapshot(server, live):
+    live.append(_run("a", 1))
+    version = server.get_live_snapshot()["version"]
+    client = server.app.test_client()
+    for since in (server.LIVE_FIRST_VERSION - 1, version + 1): # From before a restart, or from the future
+        data = client.get(f"/live_data?since={since}").get_json()
+        assert "delta" not in data
+        assert data["version"] == version and data["runs"] == [_run("a", 1)]
+
+def test_etag_matches_give_304(server, live):
+    live.append(_run("a", 1))
+    client = server.app.test_client()
+    etag = client.get("/live_data").headers["ETag"]
+    assert client.get("/live_data", headers={"If-None-Match": etag}).status_code == 304
+    live[0]["positions"] = 2
+    assert client.get("/live_data", headers={"If-None-Match": etag}).status_code == 200
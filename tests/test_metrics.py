@@ -0,0 +1,58 @@
+import threading
+
+def _samples(text, prefix):
+    """{series: value} for the exposition lines starting with prefix."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+def test_histogram_buckets_are_cumulative(server, monkeypatch):
+    monkeypatch.setitem(server.METRICS, "test_latency_seconds", ("histogram", "Test latency", (0.1, 1)))
+    for value in (0.05, 0.1, 0.5, 5):
+        server.metric_observe("test_latency_seconds", value, (("route", "/x"),))
+    samples = _samples(server.render_metrics([]), "test_latency_seconds")
+    assert samples == {
+        'test_latency_seconds_bucket{route="/x",le="0.1"}': 2, # le is inclusive: 0.1 counts here
+        'test_latency_seconds_bucket{route="/x",le="1"}': 3,
+        'test_latency_seconds_bucket{route="/x",le="+Inf"}': 4,
+        'test_latency_seconds_sum{route="/x"}': 5.65,
+        'test_latency_seconds_count{route="/x"}': 4,
+    }
+
+def test_observations_from_many_threads_are_merged(server, monkeypatch):
+    monkeypatch.setitem(server.METRICS, "test_merge_seconds", ("histogram", "Test merge", (1,)))
+    monkeypatch.setitem(server.METRICS, "test_merge_total", ("counter", "Test merge", None))
+
+    def work():
+        for _ in range(100):
+            server.metric_observe("test_merge_seconds", 0.5)
+            server.metric_inc("test_merge_total")
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples = _samples(server.render_metrics([]), "test_merge")
+    assert samples['test_merge_seconds_bucket{le="1"}'] == 800
+    assert samples['test_merge_seconds_bucket{le="+Inf"}'] == 800
+    assert samples["test_merge_total"] == 800
+
+def test_gauges_and_counters_get_their_type(server):
+    text = server.render_metrics([("test_depth", "Depth", [((), 3)])],
+                                 [("test_rows_total", "Rows", [((("kind", 'a"b'),), 7)])])
+    assert "# TYPE test_depth gauge\ntest_depth 3" in text
+    assert '# TYPE test_rows_total counter\ntest_rows_total{kind="a\\"b"} 7' in text
+
+def test_client_batch_totals_are_counters(server):
+    client = server.app.test_client()
+    assert client.post("/batch_stats", json={"client_id": "metrics-client", "batches": 2,
+                                             "phase_seconds": {"run": 3.5}}).status_code == 200
+    text = client.get("/metrics").get_data(as_text=True)
+    assert '# TYPE lamb_client_batches_total counter\nlamb_client_batches_total{client_id="metrics-client"} 2' in text
+    assert "# TYPE lamb_client_phase_seconds_total counter\n" in text
+    assert 'lamb_client_phase_seconds_total{client_id="metrics-client",phase="run"} 3.5' in text
+    assert "lamb_client_batches{" not in text and "lamb_client_phase_seconds{" not in text
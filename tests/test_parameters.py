@@ -0,0 +1,14 @@
+import pytest
+
+@pytest.mark.parametrize("form", [
+    {"target_positions": "12345", "apply": "later"},
+    {"target_positions": "12345", "games": "many"},
+])
+def test_rejected_form_changes_nothing(server, form):
+    job_id, target = server.job_state["id"], server.parameters["target_positions"]
+    version = server.parameters_version
+    response = server.app.test_client().post("/set_parameters", data=form)
+    assert response.status_code == 400
+    assert server.job_state["id"] == job_id
+    assert server.parameters["target_positions"] == target
+    assert server.parameters_version == version
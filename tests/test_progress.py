@@ -0,0 +1,23 @@
+import time
+
+import pytest
+
+@pytest.fixture
+def client_id(server):
+    return server.app.test_client().post("/register", json={"name": "test"}).get_json()["client_id"]
+
+@pytest.mark.parametrize("event_time", [None, "soon", float("inf")])
+def test_event_time_null_is_missing_and_garbage_is_rejected(server, client_id, event_time):
+    client = server.app.test_client()
+    event = {"progress": "running", "positions": 1, "time": event_time}
+    response = client.post("/progress_batch", json={"client_id": client_id, "events": [event]})
+    assert response.status_code == (202 if event_time is None else 400)
+
+def test_event_time_is_clamped_to_now(server):
+    now = time.time()
+    future = {"time": now + 3600}
+    stale = {"time": now - 2 * server.PROGRESS_MAX_AGE}
+    server._stamp_event(future, now)
+    server._stamp_event(stale, now)
+    assert future["time"] == now
+    assert stale["time"] == now - server.PROGRESS_MAX_AGE
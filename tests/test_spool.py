@@ -0,0 +1,51 @@
+import queue
+
+import pytest
+
+@pytest.fixture
+def spool(client, tmp_path, monkeypatch):
+    """A fresh spool journal and upload queue, with no uploader threads draining it."""
+    monkeypatch.setattr(client, "OUTPUT_DIR", tmp_path)
+    monkeypatch.setattr(client, "SPOOL_DB", tmp_path / "spool.db")
+    monkeypatch.setattr(client, "upload_queue", queue.Queue())
+    monkeypatch.setattr(client, "uploads_in_flight", set())
+    client.init_spool()
+    return tmp_path
+
+def _pending(client, spool, name):
+    (spool / name).write_bytes(b"games")
+    client.spool_record(name, "pending")
+
+def test_requeue_skips_files_already_in_flight(client, spool):
+    _pending(client, spool, "a.bin")
+    client.submit_upload(spool / "a.bin")
+    _pending(client, spool, "b.bin")
+    assert client.requeue_pending_uploads() == 1
+    assert client.requeue_pending_uploads() == 0
+    assert sorted(client.upload_queue.queue) == [str(spool / "a.bin"), str(spool / "b.bin")]
+
+def test_file_an_uploader_gave_up_on_is_requeued(client, spool, monkeypatch):
+    monkeypatch.setattr(client, "UPLOAD_RETRY_ROUNDS", 1)
+    monkeypatch.setattr(client, "upload_file_to_server", lambda file_path: False)
+    monkeypatch.setattr(client, "record_upload_done", lambda *args: None)
+    monkeypatch.setattr(client.time, "sleep", lambda delay: None)
+    _pending(client, spool, "a.bin")
+    client.submit_upload(spool / "a.bin")
+    client.upload_queue.put(None) # Stops the loop below after one file
+
+    def get():
+        item = client.upload_queue.queue.popleft()
+        if item is None:
+            raise StopIteration
+        return item
+
+    monkeypatch.setattr(client.upload_queue, "get", get)
+    with pytest.raises(StopIteration):
+        client.uploader_loop()
+    assert client.spool_states() == {"a.bin": "pending"}
+    assert client.requeue_pending_uploads() == 1
+
+def test_requeue_marks_vanished_files_missing(client, spool):
+    client.spool_record("gone.bin", "pending")
+    assert client.requeue_pending_uploads() == 0
+    assert client.spool_states() == {"gone.bin": "missing"}
@@ -0,0 +1,43 @@
+def test_bucket_ring_window_includes_current_bucket(server):
+    ring = server.BucketRing(10, 6)
+    ring.add(100, 5)
+    ring.add(109.9, 2) # Same 10s bucket
+    assert ring.total(109.9, 1) == 7 # A window shorter than a bucket still covers the current one
+    assert ring.total(110, 1) == 0
+
+def test_bucket_ring_window_edges(server):
+    ring = server.BucketRing(10, 6)
+    ring.add(100, 5) # Bucket 10
+    ring.add(159.9, 7) # Bucket 15
+    assert ring.total(159.9, 60) == 12 # Buckets 10-15
+    assert ring.total(160, 60) == 7 # Buckets 11-16: bucket 10 has left the window
+    assert ring.total(159.9, 20) == 7 # Buckets 14-15
+
+def test_bucket_ring_window_is_capped_at_ring_size(server):
+    ring = server.BucketRing(10, 6)
+    ring.add(100, 5)
+    ring.add(150, 7)
+    assert ring.total(150, 10_000) == 12
+    assert ring.total(170, 10_000) == 7 # Bucket 10 is older than the ring reaches
+
+def test_bucket_ring_reuses_stale_slot(server):
+    ring = server.BucketRing(10, 6)
+    ring.add(100, 5) # Bucket 10 in slot 4
+    ring.add(160, 3) # Bucket 16, same slot: the old count must not carry over
+    assert ring.total(160, 60) == 3
+    assert ring.total(160, 10) == 3
+
+def test_bucket_ring_ignores_times_older_than_the_ring(server):
+    ring = server.BucketRing(10, 6)
+    ring.add(160, 3)
+    ring.add(100, 5) # Would land in bucket 16's slot
+    assert ring.total(160, 60) == 3
+
+def test_throughput_switches_to_minute_buckets_beyond_second_window(server):
+    throughput = server.Throughput(60, 60)
+    throughput.add(1000, 4)
+    assert throughput.total(1059, 60) == 4 # Per-second ring, last of the 60 buckets
+    assert throughput.total(1060, 60) == 0
+    assert throughput.total(1060, 120) == 4 # Per-minute ring: minutes 16-17
+    assert throughput.total(1000 + 59 * 60, 3600) == 4
+    assert throughput.total(1020 + 60 * 60, 3600) == 0 # Minute 16 has left the hour
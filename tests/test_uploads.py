@@ -0,0 +1,44 @@
+import hashlib
+
+def _init(client, content, sha256=None):
+    return client.post("/upload/init", json={
+        "filename": f"upload-{hashlib.md5(content).hexdigest()}.txt", "size": len(content),
+        "sha256": sha256 or hashlib.sha256(content).hexdigest(),
+    }).get_json()["upload_id"]
+
+def test_unknown_upload_creates_no_lock(server):
+    client = server.app.test_client()
+    assert client.put("/upload/nosuchupload?offset=0", data=b"x").status_code == 404
+    assert client.post("/upload/nosuchupload/finalize").status_code == 404
+    assert "nosuchupload" not in server.upload_locks
+
+def test_lock_is_dropped_when_an_upload_ends(server):
+    client = server.app.test_client()
+    saved = _init(client, b"saved upload")
+    rejected = _init(client, b"rejected upload", sha256="0" * 64)
+    for upload_id, content in ((saved, b"saved upload"), (rejected, b"rejected upload")):
+        assert upload_id in server.upload_locks
+        assert client.put(f"/upload/{upload_id}?offset=0", data=content).status_code == 200
+    assert client.post(f"/upload/{saved}/finalize").status_code == 200
+    assert client.post(f"/upload/{rejected}/finalize").status_code == 422
+    assert saved not in server.upload_locks and rejected not in server.upload_locks
+
+def test_pending_gauge_counts_unfinished_uploads(server):
+    client = server.app.test_client()
+    before = server.count_pending_uploads()
+    client.put("/upload/nosuchupload?offset=0", data=b"x")
+    upload_id = _init(client, b"pending upload")
+    assert server.count_pending_uploads() == before + 1
+    assert f"lamb_upload_pending {before + 1}" in client.get("/metrics").get_data(as_text=True)
+    client.put(f"/upload/{upload_id}?offset=0", data=b"pending upload")
+    client.post(f"/upload/{upload_id}/finalize")
+    assert server.count_pending_uploads() == before
+
+def test_download_works_outside_the_script_directory(server):
+    # The server fixture runs in a scratch directory, like a server started from elsewhere
+    client = server.app.test_client()
+    upload_id = _init(client, b"downloaded upload")
+    client.put(f"/upload/{upload_id}?offset=0", data=b"downloaded upload")
+    filename = client.post(f"/upload/{upload_id}/finalize").get_json()["file"]
+    response = client.get(f"/download/{filename}")
+    assert response.status_code == 200 and response.data == b"downloaded upload"